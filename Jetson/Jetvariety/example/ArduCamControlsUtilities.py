@@ -1,5 +1,7 @@
 import fcntl
 import ctypes
+import time
+from jetson_board import board_name
 
 _IOC_NRBITS = 8
 _IOC_TYPEBITS = 8
@@ -57,6 +59,8 @@ VIDIOC_R_I2C = _IOWR('V', BASE_VIDIOC_PRIVATE + 0, arducam_i2c)
 VIDIOC_W_I2C = _IOWR('V', BASE_VIDIOC_PRIVATE + 1, arducam_i2c)
 VIDIOC_R_DEV = _IOWR('V', BASE_VIDIOC_PRIVATE + 2, arducam_dev)
 VIDIOC_W_DEV = _IOWR('V', BASE_VIDIOC_PRIVATE + 3, arducam_dev)
+VIDIOC_STREAMON = _IOW('V', 18, ctypes.c_int)
+VIDIOC_STREAMOFF = _IOW('V', 19, ctypes.c_int)
 
 
 class ArduCamControlUtilities(object):
@@ -99,54 +103,387 @@ class ArduCamControlUtilities(object):
 
     DEVICE_ID = 0x0030
 
-    def __init__(self, device_num):
-        self.vd = open('/dev/video{}'.format(device_num), 'w')
+    def __init__(self, device_num, device = None, shadow = True, sensor_regs = ()):
+        '''
+        device: object with an ioctl(request, arg) method used instead of
+        /dev/videoX, e.g. sim_v4l2.sim_device.
+        shadow: keep a RegisterShadow of the device and sensor registers.
+        sensor_regs: sensor registers whose repeated writes the shadow may
+        skip, none by default.
+        '''
+        self.device = device
+        self.vd = device if device is not None else open('/dev/video{}'.format(device_num), 'w')
+        self.shadow = RegisterShadow(sensor_regs) if shadow else None
+        # Reused by every single register access
+        self._i2c = arducam_i2c()
+        self._dev = arducam_dev()
+
+    def ioctl(self, request, arg):
+        if self.shadow is not None:
+            return self.shadow.ioctl(self._ioctl, request, arg)
+        return self._ioctl(request, arg)
+
+    def _ioctl(self, request, arg):
+        if self.device is not None:
+            return self.device.ioctl(request, arg)
+        return fcntl.ioctl(self.vd, request, arg)
+
+    def invalidate(self, device = False):
+        '''
+        Forget the shadowed sensor registers (and the device registers
+        with device = True). Call it after starting or stopping the stream
+        through another handle, e.g. cv2.VideoCapture, since the driver
+        reprograms the sensor then.
+        '''
+        if self.shadow is not None:
+            self.shadow.invalidate(device)
 
     @staticmethod
     def get_platform_type():
-        from jtop import jtop
-        with jtop() as jetson:
-            if jetson.ok():
-                for name_category, category in jetson.board.items():
-                    if name_category == "hardware":
-                        environment_vars = category['Module']
+        environment_vars = board_name()
         print("Hardware is: {}".format(environment_vars))
         return environment_vars
 
     def read_sensor(self, reg):
-        i2c = arducam_i2c()
+        i2c = self._i2c
         i2c.reg = reg
-        fcntl.ioctl(self.vd, VIDIOC_R_I2C, i2c)
+        self.ioctl(VIDIOC_R_I2C, i2c)
         return i2c.val
 
     def write_sensor(self, reg, val):
-        i2c = arducam_i2c()
+        i2c = self._i2c
         i2c.reg = reg
         i2c.val = val
-        return fcntl.ioctl(self.vd, VIDIOC_W_I2C, i2c)
+        return self.ioctl(VIDIOC_W_I2C, i2c)
 
     def read_dev(self, reg):
-        dev = arducam_dev()
+        dev = self._dev
         dev.reg = reg
-        ret = fcntl.ioctl(self.vd, VIDIOC_R_DEV, dev)
+        ret = self.ioctl(VIDIOC_R_DEV, dev)
         return ret, dev.val
 
     def write_dev(self, reg, val):
-        dev = arducam_dev()
+        dev = self._dev
         dev.reg = reg
         dev.val = val
-        return fcntl.ioctl(self.vd, VIDIOC_W_DEV, dev)
+        return self.ioctl(VIDIOC_W_DEV, dev)
+
+    def batch(self, log = None):
+        '''
+        A RegisterBatch on this camera, see RegisterBatch.
+        '''
+        return RegisterBatch(self, log)
+
+    def run_script(self, script, log = None):
+        '''
+        Run a register script (see parse_register_script), returns the
+        values read.
+        '''
+        return RegisterBatch(self, log).script(script).run()
 
     def get_device_info(self):
-        _, fw_sensor_id = self.read_dev(ArduCamControlUtilities.FIRMWARE_SENSOR_ID_REG)
-        _, sensor_id = self.read_dev(ArduCamControlUtilities.SENSOR_ID_REG)
-        _, fw_version = self.read_dev(ArduCamControlUtilities.FIRMWARE_VERSION_REG)
-        _, serial_number = self.read_dev(ArduCamControlUtilities.SERIAL_NUMBER_REG)
-        return fw_sensor_id, sensor_id, fw_version, serial_number
+        return tuple(self.batch()
+            .read_dev(ArduCamControlUtilities.FIRMWARE_SENSOR_ID_REG)
+            .read_dev(ArduCamControlUtilities.SENSOR_ID_REG)
+            .read_dev(ArduCamControlUtilities.FIRMWARE_VERSION_REG)
+            .read_dev(ArduCamControlUtilities.SERIAL_NUMBER_REG)
+            .run())
 
     def show_camera_info(self):
         _, sensor_id, firmware_version, serial_number = self.get_device_info()
         print("\nV4L2:")
         print("Firmware Version: {}".format(firmware_version))
         print("Sensor ID: 0x{:04X}".format(sensor_id))
-        print("Serial Number: 0x{:08X}".format(serial_number))
\ No newline at end of file
+        print("Serial Number: 0x{:08X}".format(serial_number))
+
+
+# Register operations: sensor registers over I2C, device registers of the
+# Jetvariety firmware (the "d" variants).
+READ_SENSOR, WRITE_SENSOR, UPDATE_SENSOR = "r", "w", "m"
+READ_DEV, WRITE_DEV, UPDATE_DEV = "rd", "wd", "md"
+DELAY = "delay"
+
+_arguments = {READ_SENSOR: 1, WRITE_SENSOR: 2, UPDATE_SENSOR: 3,
+    READ_DEV: 1, WRITE_DEV: 2, UPDATE_DEV: 3, DELAY: 1}
+
+
+class RegisterBatch(object):
+    '''
+    Register operations queued and executed by one run() call, through two
+    ioctl structs allocated once per batch:
+
+        values = (arducam_utils.batch()
+            .write_sensor(0x3820, 0x42)
+            .update_sensor(0x3821, 0x06, 0x00)
+            .read_dev(ArduCamControlUtilities.SENSOR_ID_REG)
+            .run())
+
+    Operations are tuples (op, reg[, mask], value) or (DELAY, ms), the
+    update operations write (old & ~mask) | (value & mask) and skip the
+    write when nothing changes. The driver takes one register per ioctl,
+    so a batch saves the per-access Python and allocation overhead, not
+    the round-trips. With log (a list) every executed access is appended
+    with its actual value: updates as the write they became, reads with
+    the value read. replay() and format_register_log() turn a log back
+    into a batch or a script.
+    '''
+    def __init__(self, utils, log = None):
+        self.utils = utils
+        self.log = log
+        self.ops = []
+        self._i2c = arducam_i2c()
+        self._dev = arducam_dev()
+
+    def _add(self, *op):
+        self.ops.append(op)
+        return self
+
+    def read_sensor(self, reg):
+        return self._add(READ_SENSOR, reg)
+
+    def write_sensor(self, reg, val):
+        return self._add(WRITE_SENSOR, reg, val)
+
+    def update_sensor(self, reg, mask, val):
+        return self._add(UPDATE_SENSOR, reg, mask, val)
+
+    def read_dev(self, reg):
+        return self._add(READ_DEV, reg)
+
+    def write_dev(self, reg, val):
+        return self._add(WRITE_DEV, reg, val)
+
+    def update_dev(self, reg, mask, val):
+        return self._add(UPDATE_DEV, reg, mask, val)
+
+    def delay(self, ms):
+        return self._add(DELAY, ms)
+
+    def write_sensor_regs(self, regs):
+        '''
+        Queue sensor writes from a list of (reg, val).
+        '''
+        self.ops.extend((WRITE_SENSOR, reg, val) for reg, val in regs)
+        return self
+
+    def write_dev_regs(self, regs):
+        self.ops.extend((WRITE_DEV, reg, val) for reg, val in regs)
+        return self
+
+    def extend(self, ops):
+        ops = [tuple(op) for op in ops]
+        for op in ops:
+            if op[0] not in _arguments or len(op) != _arguments[op[0]] + 1:
+                raise ValueError("Invalid register operation {}".format(op))
+        self.ops.extend(ops)
+        return self
+
+    def script(self, script):
+        return self.extend(parse_register_script(script))
+
+    def run(self):
+        '''
+        Execute the queued operations in order, returns the values read
+        (update operations included). The batch can be run again.
+        '''
+        ioctl = self.utils.ioctl
+        log = self.log
+        i2c, dev = self._i2c, self._dev
+        values = []
+        for op in self.ops:
+            kind = op[0]
+            if kind == DELAY:
+                time.sleep(op[1] / 1000.0)
+                if log is not None:
+                    log.append(op)
+                continue
+            if kind in (READ_SENSOR, WRITE_SENSOR, UPDATE_SENSOR):
+                arg, read, write = i2c, VIDIOC_R_I2C, VIDIOC_W_I2C
+                write_op = WRITE_SENSOR
+            else:
+                arg, read, write = dev, VIDIOC_R_DEV, VIDIOC_W_DEV
+                write_op = WRITE_DEV
+            arg.reg = op[1]
+            if kind == write_op:
+                arg.val = op[2]
+                ioctl(write, arg)
+                if log is not None:
+                    log.append(op)
+                continue
+            ioctl(read, arg)
+            old = arg.val
+            values.append(old)
+            if kind in (READ_SENSOR, READ_DEV):
+                if log is not None:
+                    log.append((kind, op[1], old))
+                continue
+            mask = op[2]
+            new = (old & ~mask) | (op[3] & mask)
+            if new != old:
+                arg.reg = op[1]
+                arg.val = new
+                ioctl(write, arg)
+                if log is not None:
+                    log.append((write_op, op[1], new))
+        return values
+
+
+def replay(utils, log):
+    '''
+    A batch repeating the writes and delays of a transaction log.
+    '''
+    return RegisterBatch(utils).extend(op for op in log
+        if op[0] not in (READ_SENSOR, READ_DEV))
+
+
+def parse_register_script(script):
+    '''
+    Operations of a register script, one per line, "#" starts a comment:
+
+        w 0x3820 0x42           write sensor register
+        m 0x3821 0x06 0x00      update sensor register bits 0x06 to 0x00
+        r 0x300a                read sensor register
+        wd 0x0008 1             device register write, rd / md likewise
+        delay 10                sleep 10 ms
+
+    Numbers are decimal or 0x hex. script is the text or a list of lines.
+    '''
+    lines = script.splitlines() if isinstance(script, str) else script
+    ops = []
+    for number, line in enumerate(lines, 1):
+        fields = line.split("#", 1)[0].split()
+        if not fields:
+            continue
+        kind = fields[0].lower()
+        if kind not in _arguments:
+            raise ValueError("Line {}: unknown register operation {}".format(number, fields[0]))
+        if len(fields) != _arguments[kind] + 1:
+            raise ValueError("Line {}: {} takes {} arguments".format(number, kind, _arguments[kind]))
+        try:
+            ops.append((kind,) + tuple(int(field, 0) for field in fields[1:]))
+        except ValueError:
+            raise ValueError("Line {}: invalid number in {}".format(number, line.strip()))
+    return ops
+
+
+def format_register_log(log):
+    '''
+    A transaction log as a register script, reads as comments.
+    '''
+    lines = []
+    for op in log:
+        if op[0] == DELAY:
+            lines.append("delay {}".format(op[1]))
+        elif op[0] in (READ_SENSOR, READ_DEV):
+            lines.append("# {} 0x{:04X} = 0x{:02X}".format(*op))
+        else:
+            lines.append("{} 0x{:04X} 0x{:02X}".format(*op))
+    return "\n".join(lines) + "\n"
+
+
+class RegisterShadow(object):
+    '''
+    In-memory copy of registers in front of the register ioctls.
+
+    Device registers that never change (firmware version, sensor ID,
+    serial number, MIPI lanes) and the format and control tables read
+    through an index register are read once and then answered from
+    memory, the tables keyed by the index. Index register writes always
+    reach the device, another handle may have moved the index since.
+
+    Sensor registers are only skipped when listed in sensor_regs:
+    configuration registers where writing the value again has no effect.
+    Their shadow is the value last read or written, sensor reads always
+    go to the sensor and refresh it. Other sensor writes always reach the
+    sensor, they may be commands (group hold launch, soft reset) or the
+    register may have been changed through another handle.
+
+    Writing STREAM_ON, switching channels or VIDIOC_STREAMON/STREAMOFF
+    through the shadow forget the sensor registers, the driver
+    reprograms the sensor then. Streams started elsewhere need an
+    explicit invalidate(). hits and skipped count the saved accesses.
+    '''
+    regs = ArduCamControlUtilities
+    static_regs = (regs.FIRMWARE_VERSION_REG, regs.SENSOR_ID_REG, regs.DEVICE_ID_REG,
+        regs.FIRMWARE_SENSOR_ID_REG, regs.SERIAL_NUMBER_REG, regs.MIPI_LANES_REG)
+    # Table registers and the index register that selects their entry
+    indexed_regs = {
+        regs.PIXFORMAT_TYPE_REG: regs.PIXFORMAT_INDEX_REG,
+        regs.PIXFORMAT_ORDER_REG: regs.PIXFORMAT_INDEX_REG,
+        regs.FORMAT_WIDTH_REG: regs.RESOLUTION_INDEX_REG,
+        regs.FORMAT_HEIGHT_REG: regs.RESOLUTION_INDEX_REG,
+        regs.CTRL_ID_REG: regs.CTRL_INDEX_REG,
+        regs.CTRL_MIN_REG: regs.CTRL_INDEX_REG,
+        regs.CTRL_MAX_REG: regs.CTRL_INDEX_REG,
+        regs.CTRL_STEP_REG: regs.CTRL_INDEX_REG,
+        regs.CTRL_DEF_REG: regs.CTRL_INDEX_REG,
+    }
+    index_regs = (regs.PIXFORMAT_INDEX_REG, regs.RESOLUTION_INDEX_REG, regs.CTRL_INDEX_REG)
+    del regs
+
+    def __init__(self, sensor_regs = ()):
+        self.sensor_regs = frozenset(sensor_regs)
+        self.device = {}
+        self.sensor = {}
+        self.index = {}
+        self.hits = 0
+        self.skipped = 0
+
+    def invalidate(self, device = False):
+        self.sensor.clear()
+        if device:
+            self.device.clear()
+            self.index.clear()
+
+    def _key(self, reg):
+        if reg in self.static_regs:
+            return reg, None
+        index_reg = self.indexed_regs.get(reg)
+        if index_reg is not None and index_reg in self.index:
+            return reg, self.index[index_reg]
+        return None
+
+    def ioctl(self, ioctl, request, arg):
+        '''
+        Answer or forward one ioctl, ioctl(request, arg) issues it.
+        '''
+        if request == VIDIOC_R_DEV:
+            key = self._key(arg.reg)
+            if key is None:
+                return ioctl(request, arg)
+            value = self.device.get(key)
+            if value is not None:
+                arg.val = value
+                self.hits += 1
+                return 0
+            ret = ioctl(request, arg)
+            self.device[key] = arg.val
+            return ret
+        if request == VIDIOC_W_DEV:
+            reg = arg.reg
+            if reg in self.index_regs:
+                self.index.pop(reg, None)
+                ret = ioctl(request, arg)
+                self.index[reg] = arg.val
+                return ret
+            if reg == ArduCamControlUtilities.CHANNEL_SWITCH_REG:
+                self.invalidate(device = True)
+            elif reg == ArduCamControlUtilities.STREAM_ON:
+                self.invalidate()
+            return ioctl(request, arg)
+        if request == VIDIOC_W_I2C:
+            if arg.reg in self.sensor_regs and self.sensor.get(arg.reg) == arg.val:
+                self.skipped += 1
+                return 0
+            self.sensor.pop(arg.reg, None)
+            ret = ioctl(request, arg)
+            self.sensor[arg.reg] = arg.val
+            return ret
+        if request == VIDIOC_R_I2C:
+            self.sensor.pop(arg.reg, None)
+            ret = ioctl(request, arg)
+            self.sensor[arg.reg] = arg.val
+            return ret
+        if request in (VIDIOC_STREAMON, VIDIOC_STREAMOFF):
+            self.invalidate()
+        return ioctl(request, arg)
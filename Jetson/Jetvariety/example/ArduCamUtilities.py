@@ -5,6 +5,10 @@ import ctypes
 import cv2
 import numpy as np
 from ArduCamControlsUtilities import ArduCamControlUtilities
+from frame_convert import FrameConverter
+from camera_profile import CameraProfile
+from jetson_board import msb_aligned
+from control_catalog import ControlCatalog
 
 
 class ArduCamUtilities(ArduCamControlUtilities):
@@ -32,42 +36,69 @@ class ArduCamUtilities(ArduCamControlUtilities):
 
     AUTO_CONVERT_TO_RGB = { "depth":-1, "cvt_code": -1, "convert2rgb": 1}
 
-    def __init__(self, device_num):
-        super().__init__(device_num)
+    def __init__(self, device_num, device = None, pixelformat = None, interactive = False,
+            profile = True, profile_dir = None, shadow = True, sensor_regs = ()):
+        '''
+        pixelformat: use the conversion config of this pixel format, e.g.
+        the one set with cv2.CAP_PROP_FOURCC.
+        interactive: ask for the pixel format when neither pixelformat nor
+        the camera profile names one. profile: keep enumerated formats and
+        the chosen pixel format in a per-camera profile, see CameraProfile.
+        shadow, sensor_regs: see ArduCamControlUtilities.
+        '''
+        super().__init__(device_num, device, shadow, sensor_regs)
         self.pixfmt_map = self.get_colour_conversion_map()
-        self.config = self.get_pixfmt_cfg()
+        self.profile = CameraProfile.for_device(self, profile_dir) if profile else None
+        self.controls = None
+        self.config = self.get_pixfmt_cfg(pixelformat, interactive)
+        self.gamma = None
+        self.tone_curve = None
+        self.converter = None
 
     def get_colour_conversion_map(self) -> dict:
-        this_platform_type = self.get_platform_type()
+        if self.device is not None:
+            this_platform_type = self.device.platform
+        else:
+            this_platform_type = self.get_platform_type()
         # Jetson Model
-        pixfmt_map = None
-        if "Xavier NX" in this_platform_type:
-            pixfmt_map = ArduCamUtilities.pixfmt_map_xavier_nx
-        elif "Orin NX" in this_platform_type:
-            pixfmt_map = ArduCamUtilities.pixfmt_map_xavier_nx
-        elif "Orin Nano" in this_platform_type:
-            pixfmt_map = ArduCamUtilities.pixfmt_map_xavier_nx
-        elif "AGX Orin" in this_platform_type:
-            pixfmt_map = ArduCamUtilities.pixfmt_map_xavier_nx
-        return pixfmt_map
+        if msb_aligned(this_platform_type):
+            return ArduCamUtilities.pixfmt_map_xavier_nx
+        return ArduCamUtilities.pixfmt_map_default
+
+    def set_tone_curve(self, gamma = None, curve = None):
+        '''
+        Apply gamma, or curve mapping [0, 1] to [0, 1], in convert().
+        None for both restores the plain conversion.
+        '''
+        self.gamma = gamma
+        self.tone_curve = curve
+        self.converter = None
+
+    def get_converter(self):
+        '''
+        The FrameConverter of the current depth and cvt_code, rebuilt when
+        they were changed, e.g. cvt_code overridden for a flipped sensor.
+        '''
+        converter = self.converter
+        if converter is None or converter.cvt_code != self.cvt_code or \
+                converter.depth != max(self.depth, 8):
+            converter = self.converter = FrameConverter(self.depth, self.cvt_code,
+                self.gamma, self.tone_curve)
+        return converter
 
     def convert(self, frame):
+        '''
+        The frame as 8 bit BGR (or gray), see FrameConverter. The returned
+        array is reused for the next frame.
+        '''
         if self.convert2rgb == 1:
             return frame
-
-        if self.depth != -1:
-            frame = cv2.convertScaleAbs(frame, None, 256.0 / (1 << self.depth))
-            frame = frame.astype(np.uint8)
-
-        if self.cvt_code != -1:
-            frame = cv2.cvtColor(frame, self.cvt_code)
-
-        return frame
+        return self.get_converter().convert(frame)
 
     def get_current_pixelformat(self):
         fmt = v4l2.v4l2_format()
         fmt.type = v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE
-        ret = fcntl.ioctl(self.vd, v4l2.VIDIOC_G_FMT, fmt)
+        ret = self.ioctl(v4l2.VIDIOC_G_FMT, fmt)
         return ret, fmt.fmt.pix.pixelformat
 
     def set_pixelformat(self, target_pixfmt=v4l2.V4L2_PIX_FMT_SRGGB10):
@@ -79,7 +110,7 @@ class ArduCamUtilities(ArduCamControlUtilities):
         ''' Query the current format first '''
         fmt = v4l2.v4l2_format()
         fmt.type = v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE
-        ret = fcntl.ioctl(self.vd, v4l2.VIDIOC_G_FMT, fmt)
+        ret = self.ioctl(v4l2.VIDIOC_G_FMT, fmt)
 
         ''' If the current format is not the target one, attempt to set it explicitly '''
         print("\nV4L2:")
@@ -87,24 +118,63 @@ class ArduCamUtilities(ArduCamControlUtilities):
             print(f"Current pixel format is 0x{fmt.fmt.pix.pixelformat:08x} ({get_v4l2_key_name(fmt.fmt.pix.pixelformat, v4l2)}), changing to 0x{target_pixfmt:08x} ({get_v4l2_key_name(target_pixfmt, v4l2)})")
             fmt.fmt.pix.pixelformat = target_pixfmt
             try:
-                ret = fcntl.ioctl(self.vd, v4l2.VIDIOC_S_FMT, fmt)
+                ret = self.ioctl(v4l2.VIDIOC_S_FMT, fmt)
                 print(f"Pixel format set to 0x{target_pixfmt:08x} ({get_v4l2_key_name(target_pixfmt, v4l2)})")
             except Exception as e:
                 print(f"Failed to set pixel format to 0x{target_pixfmt:08x} ({get_v4l2_key_name(target_pixfmt, v4l2)}):", e)
                 ''' Revert to actual settings if failed '''
-                ret = fcntl.ioctl(self.vd, v4l2.VIDIOC_G_FMT, fmt)
+                ret = self.ioctl(v4l2.VIDIOC_G_FMT, fmt)
         else:
             print(f"Current pixel format is already 0x{target_pixfmt:08x} ({get_v4l2_key_name(target_pixfmt, v4l2)}), no need to update")
 
-    def get_pixfmt_cfg(self):
-        # 初始化默认配置为 AUTO_CONVERT_TO_RGB
-        chosen_config = ArduCamUtilities.AUTO_CONVERT_TO_RGB
-        chosen_pixfmt = None
-        print("\nV4L2:")
+    def get_pixfmt_cfg(self, pixelformat = None, interactive = False):
+        """
+        The conversion config of pixelformat. Without one, the user picks
+        one when interactive, else the pixel format saved in the camera
+        profile is used, else AUTO_CONVERT_TO_RGB. Explicit and interactive
+        choices are saved in the profile, so later runs start without
+        enumerating or asking again.
+        """
+        ret, current = self.get_current_pixelformat()
+        pf = ArduCamUtilities.pixfmt_map_raw8.get(current, None)
+        if pf is not None:
+            print("Found matched conversion config in raw8 mappings.")
+            return pf
+
+        profile = self.profile
+        if pixelformat is not None:
+            if pixelformat not in self.pixfmt_map:
+                print(f"No conversion config for pixel format 0x{pixelformat:08x} ({get_v4l2_key_name(pixelformat, v4l2)}), using AUTO_CONVERT_TO_RGB")
+                return ArduCamUtilities.AUTO_CONVERT_TO_RGB
+        elif interactive:
+            pixelformat = self.choose_pixelformat(current)
+        elif profile is not None and "pixelformat" in profile:
+            pixelformat = profile.get("pixelformat")
+            if pixelformat is not None and pixelformat not in self.pixfmt_map:
+                pixelformat = None
+        else:
+            print("No pixel format configured, using AUTO_CONVERT_TO_RGB")
+            return ArduCamUtilities.AUTO_CONVERT_TO_RGB
+        if profile is not None:
+            profile.set("pixelformat", pixelformat)
+            profile.save()
 
+        if pixelformat is None:
+            print("Using AUTO_CONVERT_TO_RGB")
+            return ArduCamUtilities.AUTO_CONVERT_TO_RGB
+        config = self.pixfmt_map[pixelformat]
+        ''' Print out the config the program will use. '''
+        print(f"Key: {get_v4l2_key_name(pixelformat, v4l2)}, Value: {config}")
+        return config
+
+    def choose_pixelformat(self, current):
+        """
+        Ask the user for one of the supported pixel formats that have a
+        conversion config, None for AUTO_CONVERT_TO_RGB.
+        """
+        print("\nV4L2:")
         # 显示目前的相机像素格式
-        ret, pixfmt = self.get_current_pixelformat()
-        print(f"The camera's current pixel format: 0x{pixfmt:08x} ({get_v4l2_key_name(pixfmt, v4l2)})")
+        print(f"The camera's current pixel format: 0x{current:08x} ({get_v4l2_key_name(current, v4l2)})")
 
         # 列出所有相机支持的像素格式
         print("The camera supported pixel formats: ")
@@ -113,94 +183,108 @@ class ArduCamUtilities(ArduCamControlUtilities):
             print(f"\t{element['index']}: {element['description']} (pixelformat: 0x{element['pixelformat']:08x})")
 
         # 列出所有程序支持的像素格式，然后让用户选择
-        print("Detecting program supported pixel formats...")
-        # 检查当前像素格式是否在 pixfmt_map_raw8 中
-        ret, pixfmt = self.get_current_pixelformat()
-        pf = ArduCamUtilities.pixfmt_map_raw8.get(pixfmt, None)
-        if pf is not None:
-            print("Found matched conversion config in raw8 mappings.")
-            chosen_config = pf
-        else:
-            matches = []
-            for element in camera_supported_formats:
-                pixfmt_config = self.pixfmt_map.get(element["pixelformat"], None)
-                if pixfmt_config is not None:
-                    matches.append({
-                        "index": element["index"],
-                        "pixelformat": element["pixelformat"],
-                        "description": element["description"],
-                        "config": pixfmt_config
-                    })
-
-            if matches:
-                print("Found following program supported pixel format configs:")
-                for idx, match in enumerate(matches):
-                    pixfmt_hex = f"0x{match['pixelformat']:08X}"
-                    print(f"\t{idx}: {match['description']} (pixelformat: {pixfmt_hex})")
-
-                while True:
-                    try:
-                        selection = input(f"请选择一个像素格式配置 (0-{len(matches) - 1})，或按回车使用默认配置: ")
-                        if selection == "":
-                            print("使用默认配置: AUTO_CONVERT_TO_RGB")
-                            break  # 保持默认配置
-                        selection = int(selection)
-                        if 0 <= selection < len(matches):
-                            chosen_config = matches[selection]["config"]
-                            chosen_pixfmt = matches[selection]["pixelformat"]
-                            print(f"已选择: {matches[selection]['description']} (pixelformat: 0x{matches[selection]['pixelformat']:08X})")
-                            break
-                        else:
-                            print(f"请输入一个介于 0 和 {len(matches) - 1} 之间的数字。")
-                    except ValueError:
-                        print("无效输入，请输入一个数字。")
-            # 如果没有找到匹配的配置，保持默认配置 AUTO_CONVERT_TO_RGB
+        matches = [element for element in camera_supported_formats if element["pixelformat"] in self.pixfmt_map]
+        if not matches:
+            # 如果没有找到匹配的配置，使用默认配置 AUTO_CONVERT_TO_RGB
+            return None
+        print("Found following program supported pixel format configs:")
+        for idx, match in enumerate(matches):
+            print(f"\t{idx}: {match['description']} (pixelformat: 0x{match['pixelformat']:08X})")
 
-        ''' Print out the config the program will use. '''
-        key_name = get_v4l2_key_name(chosen_pixfmt, v4l2)
-        print(f"Key: {key_name}, Value: {self.pixfmt_map[chosen_pixfmt]}")
-
-        # 在函数末尾统一返回选择的配置
-        return chosen_config
+        while True:
+            try:
+                selection = input(f"请选择一个像素格式配置 (0-{len(matches) - 1})，或按回车使用默认配置: ")
+                if selection == "":
+                    print("使用默认配置: AUTO_CONVERT_TO_RGB")
+                    return None
+                selection = int(selection)
+                if 0 <= selection < len(matches):
+                    print(f"已选择: {matches[selection]['description']} (pixelformat: 0x{matches[selection]['pixelformat']:08X})")
+                    return matches[selection]["pixelformat"]
+                else:
+                    print(f"请输入一个介于 0 和 {len(matches) - 1} 之间的数字。")
+            except ValueError:
+                print("无效输入，请输入一个数字。")
 
-    def get_camera_supported_pixelformats(self):
+    def get_camera_supported_pixelformats(self, refresh = False):
+        """
+        Enumerated once per camera and kept in the profile, refresh = True
+        asks the driver again.
+        """
+        if self.profile is not None and not refresh and "formats" in self.profile:
+            return self.profile.get("formats")
         supported_formats = []
         fmtdesc = v4l2.v4l2_fmtdesc()
         fmtdesc.index = 0
         fmtdesc.type = v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE
         while True:
             try:
-                fcntl.ioctl(self.vd, v4l2.VIDIOC_ENUM_FMT, fmtdesc)
+                self.ioctl(v4l2.VIDIOC_ENUM_FMT, fmtdesc)
                 supported_formats.append({
                     "index": fmtdesc.index,
                     "pixelformat": fmtdesc.pixelformat,
-                    "description": fmtdesc.description
+                    "description": fmtdesc.description.decode(errors="replace")
                 })
                 fmtdesc.index += 1
             except Exception as e:
                 break
+        if self.profile is not None:
+            self.profile.set("formats", supported_formats)
+            self.profile.save()
         return supported_formats
 
-    def get_framesizes(self, pixel_format = v4l2.V4L2_PIX_FMT_Y16):
+    def get_framesizes(self, pixel_format = v4l2.V4L2_PIX_FMT_Y16, refresh = False):
+        """
+        Frame sizes of pixel_format, cached in the profile like the formats.
+        """
+        cached = self.profile.get("framesizes", {}) if self.profile is not None else {}
+        key = f"0x{pixel_format:08x}"
+        if not refresh and key in cached:
+            return [tuple(size) for size in cached[key]]
         framesizes = []
         framesize = v4l2.v4l2_frmsizeenum()
         framesize.index = 0
         framesize.pixel_format = pixel_format
         while True:
             try:
-                fcntl.ioctl(self.vd, v4l2.VIDIOC_ENUM_FRAMESIZES, framesize)
+                self.ioctl(v4l2.VIDIOC_ENUM_FRAMESIZES, framesize)
                 framesizes.append((framesize.discrete.width, framesize.discrete.height))
                 framesize.index += 1
             except Exception as e:
                 break
+        if self.profile is not None:
+            self.profile.set("framesizes", dict(cached, **{key: [list(size) for size in framesizes]}))
+            self.profile.save()
         return framesizes
 
+    def get_controls(self, refresh = False):
+        """
+        The ControlCatalog of the camera, enumerated once and kept in the
+        profile. refresh = True enumerates the controls again.
+        """
+        if self.controls is not None and not refresh:
+            return self.controls
+        cached = self.profile.get("controls") if self.profile is not None else None
+        if cached is not None and not refresh:
+            self.controls = ControlCatalog.from_list(self, cached)
+        else:
+            self.controls = ControlCatalog.enumerate(self)
+            if self.profile is not None:
+                self.profile.set("controls", self.controls.to_list())
+                self.profile.save()
+        return self.controls
+
     def __getattr__(self, key):
         return self.config.get(key)
 
+_v4l2_key_names = {}
+
 def get_v4l2_key_name(key, module):
-    # Reverse lookup for key names
-    constants = {value: name for name, value in vars(module).items() if name.startswith("V4L2_PIX_FMT_")}
+    # Reverse lookup for key names, built once per module
+    constants = _v4l2_key_names.get(module.__name__)
+    if constants is None:
+        constants = {value: name for name, value in vars(module).items() if name.startswith("V4L2_PIX_FMT_")}
+        _v4l2_key_names[module.__name__] = constants
     return constants.get(key, f"Unknown ({key})")
 
 def print_ctypes_structure(obj, indent=0):
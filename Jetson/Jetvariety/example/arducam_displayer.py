@@ -11,6 +11,7 @@ import fcntl
 import os
 import argparse
 from ArduCamUtilities import ArduCamUtilities
+from v4l2_capture import V4L2Capture
 try:
     from utils import ArducamUtils
 except ImportError as e:
@@ -31,9 +32,6 @@ except ImportError as e:
     except ImportError:
         from pip._internal import main as pipmain
 
-    print("Try to install jetson-stats...")
-    pipmain(['install', 'jetson-stats'])
-
     print("Try to install v4l2-fix...")
     pipmain(['install', 'v4l2-fix'])
 
@@ -111,6 +109,8 @@ def display(cap, arducam_utils, fps = False):
     avgtime = elapsed_time.total_seconds() / counter
     print ("Average time between frames: " + str(avgtime))
     print ("Average FPS: " + str(1/avgtime))
+    if isinstance(cap, V4L2Capture):
+        print ("Frames: {}, dropped by the driver: {}".format(cap.count, cap.dropped))
 
 def fourcc(a, b, c, d):
     return ord(a) | (ord(b) << 8) | (ord(c) << 16) | (ord(d) << 24)
@@ -138,6 +138,11 @@ def process_arguments():
     parser.add_argument('--width', type=lambda x: int(x, 0), help="set width of image")
     parser.add_argument('--height', type=lambda x: int(x, 0), help="set height of image")
     parser.add_argument('--fps', action='store_true', help="display fps")
+    parser.add_argument('--select-pixelformat', action='store_true', help="choose the pixel format conversion interactively and save it in the camera profile")
+    parser.add_argument('--gamma', type=float, help="apply a gamma curve in the 8 bit conversion, e.g. 2.2")
+    parser.add_argument('--native', action='store_true', help="capture with mmap'd V4L2 buffers (V4L2Capture) instead of cv2.VideoCapture")
+    parser.add_argument('--buffers', default=4, type=int, help="number of V4L2 buffers with --native")
+    parser.add_argument('--sim', action='store_true', help="use the simulated camera from sim_v4l2 instead of /dev/videoX")
     parser.add_argument('--channel', default=-1, type=int, nargs='?', help="When using Camarray's single channel, use this parameter to switch channels. (E.g. ov9781/ov9281 Quadrascopic Camera Bundle Kit)")
 
     args_local = parser.parse_args()
@@ -147,10 +152,25 @@ if __name__ == "__main__":
     args = process_arguments()
     print("\nProgram starting... User input arguments are: " + str(vars(args)))
 
-    arducam_utils = ArduCamUtilities(args.device)
-
+    if args.sim:
+        from sim_v4l2 import sim_device, sim_capture
+        device = sim_device()
+        arducam_utils = ArduCamUtilities(args.device, device = device, pixelformat = args.pixelformat,
+            interactive = args.select_pixelformat)
+    else:
+        device = None
+        arducam_utils = ArduCamUtilities(args.device, pixelformat = args.pixelformat,
+            interactive = args.select_pixelformat)
+    if args.native and arducam_utils.convert2rgb:
+        print("Not a raw pixel format, --native ignored.")
+        args.native = False
     # open camera
-    cap = cv2.VideoCapture(args.device, cv2.CAP_V4L2)
+    if args.native:
+        cap = V4L2Capture(args.device, arducam_utils, buffers = args.buffers, device = device)
+    elif args.sim:
+        cap = sim_capture(device)
+    else:
+        cap = cv2.VideoCapture(args.device, cv2.CAP_V4L2)
     # set pixel format, width, height, etc.
     if args.pixelformat != None:
         if not cap.set(cv2.CAP_PROP_FOURCC, args.pixelformat):
@@ -167,6 +187,8 @@ if __name__ == "__main__":
     # print("\nFourCC 设置成功") if int(cap.get(cv2.CAP_PROP_FOURCC)) == cv2.VideoWriter_fourcc(*'RG10') else print("FourCC 设置失败")
 
     arducam_utils.show_camera_info()
+    if args.gamma is not None:
+        arducam_utils.set_tone_curve(gamma = args.gamma)
     # turn off RGB conversion
     if arducam_utils.convert2rgb == 0:
         cap.set(cv2.CAP_PROP_CONVERT_RGB, arducam_utils.convert2rgb)
@@ -0,0 +1,73 @@
+import json
+import os
+
+PROFILE_DIR = os.environ.get("ARDUCAM_PROFILE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "arducam"))
+
+
+class CameraProfile(object):
+    '''
+    Per-camera settings kept on disk between runs, one JSON file per
+    sensor ID and serial number: the pixel formats and frame sizes the
+    camera enumerates and the chosen pixel format. A profile written by a
+    different firmware version is ignored.
+
+        profile = CameraProfile.for_device(arducam_utils)
+        formats = profile.get("formats")
+        profile.set("pixelformat", pixfmt)
+        profile.save()
+    '''
+    def __init__(self, sensor_id, serial_number, firmware_version, profile_dir=None):
+        self.path = os.path.join(profile_dir or PROFILE_DIR,
+            "{:04x}_{:08x}.json".format(sensor_id, serial_number))
+        self.firmware_version = firmware_version
+        self.data = self.load()
+        self.dirty = False
+
+    @classmethod
+    def for_device(cls, utils, profile_dir=None):
+        '''
+        The profile of the camera behind an ArduCamControlUtilities.
+        '''
+        _, sensor_id, firmware_version, serial_number = utils.get_device_info()
+        return cls(sensor_id, serial_number, firmware_version, profile_dir)
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get("firmware_version") != self.firmware_version:
+            return {}
+        return data
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value):
+        if self.data.get(key) != value or key not in self.data:
+            self.data[key] = value
+            self.dirty = True
+
+    def save(self):
+        '''
+        Write the profile if it changed. A read-only home only loses the
+        cache, it is not an error.
+        '''
+        if not self.dirty:
+            return
+        self.data["firmware_version"] = self.firmware_version
+        tmp = self.path + ".tmp"
+        try:
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            with open(tmp, "w") as f:
+                json.dump(self.data, f, indent=2, sort_keys=True)
+            os.replace(tmp, self.path)
+            self.dirty = False
+        except OSError as e:
+            print("Cannot save the camera profile {}: {}".format(self.path, e))
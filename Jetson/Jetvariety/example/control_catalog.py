@@ -0,0 +1,175 @@
+import re
+import numpy as np
+import v4l2
+from ArduCamControlsUtilities import ArduCamControlUtilities as regs
+
+control_dtype = np.dtype([
+    ("id", np.uint32),
+    ("min", np.int32),
+    ("max", np.int32),
+    ("step", np.int32),
+    ("default", np.int32),
+    ("value", np.int32),
+])
+
+
+def control_key(name):
+    '''
+    Lookup form of a control name: "Horizontal Flip" -> "horizontal_flip".
+    '''
+    return re.sub(r"[^0-9a-z]+", "_", name.lower()).strip("_")
+
+
+def _signed(value):
+    return value - (1 << 32) if value & 0x80000000 else value
+
+
+class ControlCatalog(object):
+    '''
+    The camera controls as one table, enumerated once from the CTRL_*
+    registers (names from VIDIOC_QUERYCTRL): table is a structured array
+    of id, min, max, step, default and the last known value, names the
+    matching control names. Controls are looked up by V4L2 CID or name in
+    O(1), clamp() fits many values to their ranges in one vectorized step.
+
+        catalog = arducam_utils.get_controls()
+        catalog.set_control("exposure", 20000)      # clamped to the range
+        gains = catalog.clamp(["gain", "exposure"], [300, 10])
+
+    ArduCamUtilities keeps the catalog in the camera profile, so tools
+    started again do not enumerate the controls again.
+    '''
+    def __init__(self, utils, table, names):
+        self.utils = utils
+        self.table = table
+        self.names = names
+        self._rows = {}
+        for row, (ctrl_id, name) in enumerate(zip(table["id"], names)):
+            self._rows[int(ctrl_id)] = row
+            self._rows[control_key(name)] = row
+
+    @classmethod
+    def enumerate(cls, utils):
+        '''
+        Walk the control table of the device, one index at a time.
+        '''
+        rows = []
+        names = []
+        index = 0
+        while True:
+            utils.write_dev(regs.CTRL_INDEX_REG, index)
+            _, ctrl_id = utils.read_dev(regs.CTRL_ID_REG)
+            if ctrl_id == regs.NO_DATA_AVAILABLE:
+                break
+            values = [_signed(utils.read_dev(reg)[1]) for reg in
+                (regs.CTRL_MIN_REG, regs.CTRL_MAX_REG, regs.CTRL_STEP_REG,
+                 regs.CTRL_DEF_REG, regs.CTRL_VALUE_REG)]
+            rows.append(tuple([ctrl_id] + values))
+            names.append(cls._query_name(utils, ctrl_id))
+            index += 1
+        return cls(utils, np.array(rows, control_dtype), names)
+
+    @staticmethod
+    def _query_name(utils, ctrl_id):
+        queryctrl = v4l2.v4l2_queryctrl()
+        queryctrl.id = ctrl_id
+        try:
+            utils.ioctl(v4l2.VIDIOC_QUERYCTRL, queryctrl)
+            return queryctrl.name.decode(errors="replace")
+        except Exception:
+            return "0x{:08x}".format(ctrl_id)
+
+    @classmethod
+    def from_list(cls, utils, controls):
+        '''
+        Catalog of rows [id, name, min, max, step, default, value] as
+        to_list() returns them.
+        '''
+        table = np.array([tuple([c[0]] + list(c[2:])) for c in controls], control_dtype)
+        return cls(utils, table, [c[1] for c in controls])
+
+    def to_list(self):
+        return [[int(row[0]), name] + [int(v) for v in tuple(row)[1:]]
+            for row, name in zip(self.table, self.names)]
+
+    def __len__(self):
+        return len(self.table)
+
+    def __contains__(self, key):
+        return self._key(key) in self._rows
+
+    def __iter__(self):
+        for row in range(len(self.table)):
+            yield self._info(row)
+
+    @staticmethod
+    def _key(key):
+        return control_key(key) if isinstance(key, str) else int(key)
+
+    def row(self, key):
+        '''
+        Table row of a control given by CID or name, KeyError if unknown.
+        '''
+        try:
+            return self._rows[self._key(key)]
+        except KeyError:
+            raise KeyError("Unknown control {}".format(key))
+
+    def rows(self, keys):
+        return np.fromiter((self.row(key) for key in keys), np.intp)
+
+    def info(self, key):
+        '''
+        The control as a dict: id, name, min, max, step, default, value.
+        '''
+        return self._info(self.row(key))
+
+    def _info(self, row):
+        info = dict(zip(control_dtype.names, (int(v) for v in self.table[row])))
+        info["name"] = self.names[row]
+        return info
+
+    def clamp(self, keys, values):
+        '''
+        values fitted to the range and step of the controls keys, vectorized.
+        '''
+        rows = self.rows(keys)
+        minimum = self.table["min"][rows].astype(np.int64)
+        maximum = self.table["max"][rows].astype(np.int64)
+        step = np.maximum(self.table["step"][rows], 1).astype(np.int64)
+        values = np.clip(np.asarray(values, np.int64), minimum, maximum)
+        values = minimum + (values - minimum + step // 2) // step * step
+        return np.minimum(values, maximum - (maximum - minimum) % step)
+
+    def get_control(self, key):
+        '''
+        Current value read from the camera, also stored in the table.
+        '''
+        row = self.row(key)
+        control = v4l2.v4l2_control()
+        control.id = int(self.table["id"][row])
+        self.utils.ioctl(v4l2.VIDIOC_G_CTRL, control)
+        self.table["value"][row] = control.value
+        return control.value
+
+    def set_control(self, key, value):
+        '''
+        Set a control to value clamped to its range, returns the value set.
+        '''
+        row = self.row(key)
+        value = int(self.clamp([int(self.table["id"][row])], [value])[0])
+        control = v4l2.v4l2_control()
+        control.id = int(self.table["id"][row])
+        control.value = value
+        self.utils.ioctl(v4l2.VIDIOC_S_CTRL, control)
+        self.table["value"][row] = value
+        return value
+
+    def refresh_values(self):
+        '''
+        Read the current value of every control.
+        '''
+        for row in range(len(self.table)):
+            self.utils.write_dev(regs.CTRL_INDEX_REG, row)
+            self.table["value"][row] = _signed(self.utils.read_dev(regs.CTRL_VALUE_REG)[1])
+        return self.table["value"]
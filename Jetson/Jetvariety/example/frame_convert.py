@@ -0,0 +1,61 @@
+import cv2
+import numpy as np
+
+
+class FrameConverter(object):
+    '''
+    Converts raw frames of the given bit depth to 8 bit, then to BGR with
+    cvt_code (-1 keeps them single channel). depth is the number of
+    significant bits of the 16 bit samples: 10 for LSB aligned RAW10, 16
+    for the MSB aligned containers of Xavier NX / Orin, 8 or -1 for frames
+    that already are 8 bit.
+
+    Without a tone curve the conversion is a single scale by 2**-shift
+    that saturates samples above the bit depth like the original
+    cv2.convertScaleAbs() call. With gamma or curve (a function mapping [0, 1] to [0, 1]) a lookup table
+    over every input code applies the curve at full precision in the same
+    pass. Output arrays are reused, convert() returns the same arrays for
+    every frame of the same size.
+    '''
+    def __init__(self, depth, cvt_code=-1, gamma=None, curve=None):
+        depth = max(depth, 8)
+        self.depth = depth
+        self.cvt_code = cvt_code
+        self.shift = depth - 8
+        self.scale = 1.0 / (1 << self.shift)
+        self.lut = None
+        if gamma is not None or curve is not None:
+            self.lut = self.tone_lut(depth, gamma, curve)
+        self._gray = None
+        self._bgr = None
+
+    @staticmethod
+    def tone_lut(depth, gamma=None, curve=None):
+        x = np.arange(1 << depth, dtype=np.float64) / ((1 << depth) - 1)
+        y = curve(x) if curve is not None else np.power(x, 1.0 / gamma)
+        return np.clip(np.rint(np.asarray(y) * 255), 0, 255).astype(np.uint8)
+
+    def _buffer(self, name, shape):
+        buf = getattr(self, name)
+        if buf is None or buf.shape != shape:
+            buf = np.empty(shape, np.uint8)
+            setattr(self, name, buf)
+        return buf
+
+    def to_8bit(self, frame):
+        if frame.dtype == np.uint8 and self.lut is None:
+            return frame
+        gray = self._buffer("_gray", frame.shape)
+        if self.lut is None:
+            cv2.convertScaleAbs(frame, gray, self.scale)
+        elif frame.dtype == np.uint8:
+            cv2.LUT(frame, self.lut, dst=gray)
+        else:
+            np.take(self.lut, frame, out=gray, mode='clip')
+        return gray
+
+    def convert(self, frame):
+        frame = self.to_8bit(frame)
+        if self.cvt_code != -1:
+            frame = cv2.cvtColor(frame, self.cvt_code, dst=self._buffer("_bgr", frame.shape + (3,)))
+        return frame
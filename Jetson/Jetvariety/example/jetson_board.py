@@ -0,0 +1,109 @@
+import json
+import os
+from camera_profile import PROFILE_DIR
+
+DEVICE_TREE = "/proc/device-tree"
+CACHE_FILE = os.path.join(PROFILE_DIR, "board.json")
+
+# Jetson modules by the part number in the device tree compatible strings,
+# most specific first.
+_modules = [
+    ("nvidia,p3767-0003", "Orin Nano"),
+    ("nvidia,p3767-0004", "Orin Nano"),
+    ("nvidia,p3767-0005", "Orin Nano"),
+    ("nvidia,p3767", "Orin NX"),
+    ("nvidia,p3701", "AGX Orin"),
+    ("nvidia,p3668", "Xavier NX"),
+    ("nvidia,p2888", "AGX Xavier"),
+    ("nvidia,p3636", "TX2 NX"),
+    ("nvidia,p3310", "TX2"),
+    ("nvidia,p3489", "TX2"),
+    ("nvidia,p3448", "Nano"),
+]
+
+# Modules whose VI writes 10-bit samples MSB aligned in 16 bits, see
+# ArduCamUtilities.pixfmt_map_xavier_nx.
+MSB_ALIGNED_MODULES = ("Xavier NX", "Orin NX", "Orin Nano", "AGX Orin")
+
+_board = None
+
+
+def read_device_tree(root=DEVICE_TREE):
+    '''
+    The model string and the compatible list of the device tree, empty
+    when there is none.
+    '''
+    try:
+        with open(os.path.join(root, "model"), "rb") as f:
+            model = f.read().rstrip(b"\0").decode(errors="replace").strip()
+    except OSError:
+        model = ""
+    try:
+        with open(os.path.join(root, "compatible"), "rb") as f:
+            compatible = [c.decode(errors="replace") for c in f.read().split(b"\0") if c]
+    except OSError:
+        compatible = []
+    return model, compatible
+
+
+def detect_board(root=DEVICE_TREE):
+    '''
+    Board name from the device tree: the model when it names a Jetson
+    module, otherwise the module found in the compatible strings (custom
+    carrier boards have their own model). None without a device tree.
+    '''
+    model, compatible = read_device_tree(root)
+    names = set(name for _, name in _modules)
+    if any(name in model for name in names):
+        return model
+    for prefix, name in _modules:
+        if any(c.startswith(prefix) for c in compatible):
+            return "NVIDIA Jetson " + name
+    return model or None
+
+
+def board_name(refresh=False, cache_file=CACHE_FILE):
+    '''
+    Name of the board, e.g. "NVIDIA Jetson Xavier NX Developer Kit",
+    detected once per process. $ARDUCAM_PLATFORM overrides it. Reading the
+    device tree is cheaper than any cache, the last detected name is kept
+    in cache_file for containers and chroots that hide the device tree.
+    '''
+    global _board
+    if _board is not None and not refresh:
+        return _board
+    name = os.environ.get("ARDUCAM_PLATFORM")
+    if not name:
+        name = detect_board()
+        if name is not None:
+            _save(cache_file, name)
+        else:
+            name = _load(cache_file) or "Unknown"
+    _board = name
+    return name
+
+
+def msb_aligned(name):
+    return any(module in name for module in MSB_ALIGNED_MODULES)
+
+
+def _load(cache_file):
+    try:
+        with open(cache_file) as f:
+            return json.load(f).get("board")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _save(cache_file, name):
+    if _load(cache_file) == name:
+        return
+    try:
+        if not os.path.isdir(os.path.dirname(cache_file)):
+            os.makedirs(os.path.dirname(cache_file))
+        tmp = cache_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"board": name}, f)
+        os.replace(tmp, cache_file)
+    except OSError:
+        pass
@@ -2,6 +2,7 @@ import v4l2
 import fcntl
 import ctypes
 import argparse
+from ArduCamControlsUtilities import ArduCamControlUtilities, format_register_log
 
 _IOC_NRBITS = 8
 _IOC_TYPEBITS = 8
@@ -119,9 +120,24 @@ if __name__ == "__main__":
                         help='The address of the register you want to read.')
     parser.add_argument('-vd', '--dev-values', type=lambda x: int(x,0), nargs='+',
                         help='The register value to be written.')
+    parser.add_argument('-s', '--script',
+                        help='Register script to run, e.g. a sensor bring-up sequence (see parse_register_script).')
+    parser.add_argument('-l', '--log',
+                        help='Save the register accesses of the script to this file, it can be run again with --script.')
 
     args = parser.parse_args()
 
+    if args.script != None:
+        arducam_utils = ArduCamControlUtilities(args.device)
+        log = []
+        with open(args.script) as f:
+            values = arducam_utils.run_script(f.read(), log)
+        print(format_register_log(log), end="")
+        if args.log != None:
+            with open(args.log, "w") as f:
+                f.write(format_register_log(log))
+        exit(0)
+
     if args.values != None and len(args.regs) != len(args.values):
         print("Requires the same number of regs and values.")
         exit(0)
@@ -130,7 +146,7 @@ if __name__ == "__main__":
         exit(0)
 
     if args.regs == None and args.dev_regs == None:
-        print("error: argument -r/--regs or -rd/--dev-regs is required")
+        print("error: argument -r/--regs, -rd/--dev-regs or -s/--script is required")
         exit(0)
 
     vd = open('/dev/video{}'.format(args.device), 'w')
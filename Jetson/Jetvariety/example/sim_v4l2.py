@@ -0,0 +1,448 @@
+'''
+Simulated Arducam Jetvariety V4L2 device for machines without a camera.
+
+sim_device answers the ioctls ArducamUtils / ArduCamUtilities issue (pixel
+format and frame size enumeration, the private register ioctls, controls)
+and sim_capture stands in for cv2.VideoCapture, delivering synthesized
+Bayer test patterns or replayed raw frames at the configured frame rate:
+
+    device = sim_device(platform = "Jetson Nano")
+    arducam_utils = ArduCamUtilities(0, device = device)
+    cap = sim_capture(device)
+    ret, frame = cap.read()
+
+sim_device also streams through mmap'd buffers for v4l2_capture.V4L2Capture
+(VIDIOC_REQBUFS/QUERYBUF/QBUF/DQBUF/STREAMON/STREAMOFF), dropping frames
+that arrive while no buffer is queued like the driver does.
+'''
+import errno
+import math
+import mmap
+import time
+import numpy as np
+import cv2
+import v4l2
+from ArduCamControlsUtilities import ArduCamControlUtilities as regs, \
+    VIDIOC_R_I2C, VIDIOC_W_I2C, VIDIOC_R_DEV, VIDIOC_W_DEV
+from jetson_board import msb_aligned
+
+_bayer_order = {
+    v4l2.V4L2_PIX_FMT_SRGGB10: 'RGGB', v4l2.V4L2_PIX_FMT_SBGGR10: 'BGGR',
+    v4l2.V4L2_PIX_FMT_SGBRG10: 'GBRG', v4l2.V4L2_PIX_FMT_SGRBG10: 'GRBG',
+    v4l2.V4L2_PIX_FMT_SRGGB8: 'RGGB', v4l2.V4L2_PIX_FMT_SBGGR8: 'BGGR',
+    v4l2.V4L2_PIX_FMT_SGBRG8: 'GBRG', v4l2.V4L2_PIX_FMT_SGRBG8: 'GRBG',
+    v4l2.V4L2_PIX_FMT_Y10: None, v4l2.V4L2_PIX_FMT_GREY: None,
+}
+
+_bit_width = {
+    v4l2.V4L2_PIX_FMT_SRGGB8: 8, v4l2.V4L2_PIX_FMT_SBGGR8: 8,
+    v4l2.V4L2_PIX_FMT_SGBRG8: 8, v4l2.V4L2_PIX_FMT_SGRBG8: 8,
+    v4l2.V4L2_PIX_FMT_GREY: 8,
+}
+
+_bars = np.array([
+    (1.0, 1.0, 1.0), (1.0, 1.0, 0.0), (0.0, 1.0, 1.0), (0.0, 1.0, 0.0),
+    (1.0, 0.0, 1.0), (1.0, 0.0, 0.0), (0.0, 0.0, 1.0), (0.0, 0.0, 0.0),
+], np.float32) * 0.75
+
+class sim_device(object):
+    '''
+    In-memory V4L2 capture device. formats: (pixelformat, description)
+    tuples, sizes: (width, height) frame sizes shared by all formats.
+    platform is reported instead of querying the board.
+    '''
+    controls = [
+        # id, name, min, max, step, default
+        (v4l2.V4L2_CID_EXPOSURE, b"exposure", 1, 65535, 1, 1000),
+        (v4l2.V4L2_CID_GAIN, b"gain", 0, 255, 1, 16),
+        (v4l2.V4L2_CID_HFLIP, b"horizontal_flip", 0, 1, 1, 0),
+        (v4l2.V4L2_CID_VFLIP, b"vertical_flip", 0, 1, 1, 0),
+    ]
+
+    def __init__(self, formats = ((v4l2.V4L2_PIX_FMT_SRGGB10, b"10-bit Bayer RGRG/GBGB"),
+                (v4l2.V4L2_PIX_FMT_Y16, b"16-bit Greyscale")),
+            sizes = ((1920, 1080), (1280, 720)), fps = 60, platform = "Jetson Nano",
+            sensor_id = 0x0230, firmware_version = 0x0010, serial_number = 0x12345678):
+        self.formats = list(formats)
+        self.sizes = list(sizes)
+        self.fps = fps
+        self.platform = platform
+        self.pixelformat = self.formats[0][0]
+        self.width, self.height = self.sizes[0]
+        self.values = dict((ctrl[0], ctrl[5]) for ctrl in self.controls)
+        self.sensor_registers = {}
+        self.device_registers = {
+            regs.STREAM_ON: 0,
+            regs.FIRMWARE_VERSION_REG: firmware_version,
+            regs.SENSOR_ID_REG: sensor_id,
+            regs.DEVICE_ID_REG: regs.DEVICE_ID,
+            regs.FIRMWARE_SENSOR_ID_REG: sensor_id,
+            regs.SERIAL_NUMBER_REG: serial_number,
+            regs.CHANNEL_SWITCH_REG: 0,
+        }
+        self._index = {regs.PIXFORMAT_INDEX_REG: 0, regs.RESOLUTION_INDEX_REG: 0,
+            regs.CTRL_INDEX_REG: 0}
+        self.ioctl_count = 0
+        # Streaming: mmap'd buffers, the queue of (index, time queued)
+        self.realtime = True
+        self.streaming = False
+        self._buffers = []
+        self._buffer_size = 0
+        self._queue = []
+        self._start = 0.0
+        self._sequence = -1
+        self._patterns = {}
+        self._dispatch = {
+            v4l2.VIDIOC_G_FMT: self._g_fmt,
+            v4l2.VIDIOC_S_FMT: self._s_fmt,
+            v4l2.VIDIOC_ENUM_FMT: self._enum_fmt,
+            v4l2.VIDIOC_ENUM_FRAMESIZES: self._enum_framesizes,
+            v4l2.VIDIOC_QUERYCTRL: self._queryctrl,
+            v4l2.VIDIOC_G_CTRL: self._g_ctrl,
+            v4l2.VIDIOC_S_CTRL: self._s_ctrl,
+            VIDIOC_R_I2C: self._r_i2c,
+            VIDIOC_W_I2C: self._w_i2c,
+            VIDIOC_R_DEV: self._r_dev,
+            VIDIOC_W_DEV: self._w_dev,
+            v4l2.VIDIOC_REQBUFS: self._reqbufs,
+            v4l2.VIDIOC_QUERYBUF: self._querybuf,
+            v4l2.VIDIOC_QBUF: self._qbuf,
+            v4l2.VIDIOC_DQBUF: self._dqbuf,
+            v4l2.VIDIOC_STREAMON: self._streamon,
+            v4l2.VIDIOC_STREAMOFF: self._streamoff,
+        }
+
+    def close(self):
+        pass
+
+    def bytesperline(self):
+        return self.width * (1 if _bit_width.get(self.pixelformat, 16) == 8 else 2)
+
+    def ioctl(self, request, arg, mutate_flag = True):
+        '''
+        fcntl.ioctl() semantics: arg is updated in place, 0 is returned and
+        unsupported or out of range requests raise OSError.
+        '''
+        self.ioctl_count += 1
+        handler = self._dispatch.get(request)
+        if handler is None:
+            raise OSError(errno.ENOTTY, "Inappropriate ioctl for device")
+        return handler(arg)
+
+    def _g_fmt(self, fmt):
+        fmt.fmt.pix.width = self.width
+        fmt.fmt.pix.height = self.height
+        fmt.fmt.pix.pixelformat = self.pixelformat
+        fmt.fmt.pix.field = v4l2.V4L2_FIELD_NONE
+        fmt.fmt.pix.bytesperline = self.bytesperline()
+        fmt.fmt.pix.sizeimage = self.bytesperline() * self.height
+        return 0
+
+    def _s_fmt(self, fmt):
+        pix = fmt.fmt.pix
+        if self._buffers:
+            raise OSError(errno.EBUSY, "Device or resource busy")
+        if pix.pixelformat not in [f[0] for f in self.formats]:
+            raise OSError(errno.EINVAL, "Unsupported pixel format")
+        self.pixelformat = pix.pixelformat
+        if pix.width and pix.height:
+            self.width, self.height = min(self.sizes, key=lambda size:
+                abs(size[0] - pix.width) + abs(size[1] - pix.height))
+        return self._g_fmt(fmt)
+
+    def _enum_fmt(self, fmtdesc):
+        if not 0 <= fmtdesc.index < len(self.formats):
+            raise OSError(errno.EINVAL, "No such format")
+        fmtdesc.pixelformat, fmtdesc.description = self.formats[fmtdesc.index]
+        return 0
+
+    def _enum_framesizes(self, framesize):
+        if not 0 <= framesize.index < len(self.sizes):
+            raise OSError(errno.EINVAL, "No such frame size")
+        framesize.type = v4l2.V4L2_FRMSIZE_TYPE_DISCRETE
+        framesize.discrete.width, framesize.discrete.height = self.sizes[framesize.index]
+        return 0
+
+    def _control(self, ctrl_id):
+        for ctrl in self.controls:
+            if ctrl[0] == ctrl_id:
+                return ctrl
+        raise OSError(errno.EINVAL, "No such control")
+
+    def _queryctrl(self, queryctrl):
+        ctrl_id, name, minimum, maximum, step, default = self._control(queryctrl.id)
+        queryctrl.type = v4l2.V4L2_CTRL_TYPE_INTEGER
+        queryctrl.name = name
+        queryctrl.minimum = minimum
+        queryctrl.maximum = maximum
+        queryctrl.step = step
+        queryctrl.default = default
+        return 0
+
+    def _g_ctrl(self, control):
+        self._control(control.id)
+        control.value = self.values[control.id]
+        return 0
+
+    def _s_ctrl(self, control):
+        ctrl = self._control(control.id)
+        if not ctrl[2] <= control.value <= ctrl[3]:
+            raise OSError(errno.ERANGE, "Control value out of range")
+        self.values[control.id] = control.value
+        return 0
+
+    def _r_i2c(self, i2c):
+        i2c.val = self.sensor_registers.get(i2c.reg, 0)
+        return 0
+
+    def _w_i2c(self, i2c):
+        self.sensor_registers[i2c.reg] = i2c.val
+        return 0
+
+    def _indexed(self, reg):
+        '''
+        Registers read through an index register, NO_DATA_AVAILABLE past
+        the end of the table.
+        '''
+        if reg in (regs.PIXFORMAT_TYPE_REG, regs.PIXFORMAT_ORDER_REG):
+            index = self._index[regs.PIXFORMAT_INDEX_REG]
+            if index >= len(self.formats):
+                return regs.NO_DATA_AVAILABLE
+            return self.formats[index][0]
+        if reg in (regs.FORMAT_WIDTH_REG, regs.FORMAT_HEIGHT_REG):
+            index = self._index[regs.RESOLUTION_INDEX_REG]
+            if index >= len(self.sizes):
+                return regs.NO_DATA_AVAILABLE
+            return self.sizes[index][0 if reg == regs.FORMAT_WIDTH_REG else 1]
+        fields = {regs.CTRL_ID_REG: 0, regs.CTRL_MIN_REG: 2, regs.CTRL_MAX_REG: 3,
+            regs.CTRL_STEP_REG: 4, regs.CTRL_DEF_REG: 5}
+        if reg in fields or reg == regs.CTRL_VALUE_REG:
+            index = self._index[regs.CTRL_INDEX_REG]
+            if index >= len(self.controls):
+                return regs.NO_DATA_AVAILABLE
+            if reg == regs.CTRL_VALUE_REG:
+                return self.values[self.controls[index][0]]
+            return self.controls[index][fields[reg]] & 0xFFFFFFFF
+        return None
+
+    def _r_dev(self, dev):
+        if dev.reg in self._index:
+            dev.val = self._index[dev.reg]
+            return 0
+        value = self._indexed(dev.reg)
+        if value is None:
+            value = self.device_registers.get(dev.reg, 0)
+        dev.val = value
+        return 0
+
+    def _w_dev(self, dev):
+        if dev.reg in self._index:
+            self._index[dev.reg] = dev.val
+        else:
+            self.device_registers[dev.reg] = dev.val
+        return 0
+
+    def mmap(self, length, offset):
+        '''
+        The buffer at offset, as mmap() of the device file returns it.
+        '''
+        if self._buffer_size == 0 or offset % self._buffer_size or \
+                not 0 <= offset // self._buffer_size < len(self._buffers) or \
+                length > self._buffer_size:
+            raise OSError(errno.EINVAL, "Invalid argument")
+        return self._buffers[offset // self._buffer_size]
+
+    def _reqbufs(self, req):
+        if req.memory != v4l2.V4L2_MEMORY_MMAP:
+            raise OSError(errno.EINVAL, "Only V4L2_MEMORY_MMAP is supported")
+        if self.streaming:
+            raise OSError(errno.EBUSY, "Device or resource busy")
+        self._queue = []
+        sizeimage = self.bytesperline() * self.height
+        self._buffer_size = -(-sizeimage // mmap.PAGESIZE) * mmap.PAGESIZE
+        self._buffers = [mmap.mmap(-1, self._buffer_size) for _ in range(min(req.count, 32))]
+        req.count = len(self._buffers)
+        return 0
+
+    def _buffer(self, buf):
+        if not 0 <= buf.index < len(self._buffers):
+            raise OSError(errno.EINVAL, "No such buffer")
+        buf.length = self.bytesperline() * self.height
+        buf.m.offset = buf.index * self._buffer_size
+        buf.flags = 0x2000  # V4L2_BUF_FLAG_TIMESTAMP_MONOTONIC
+        return buf.index
+
+    def _querybuf(self, buf):
+        self._buffer(buf)
+        return 0
+
+    def _qbuf(self, buf):
+        index = self._buffer(buf)
+        if any(queued == index for queued, _ in self._queue):
+            raise OSError(errno.EINVAL, "Buffer already queued")
+        self._queue.append((index, time.monotonic()))
+        return 0
+
+    def _dqbuf(self, buf):
+        '''
+        The oldest queued buffer filled with the first frame that arrived
+        after it was queued, frames arriving before are dropped. Blocks
+        until that frame is due unless realtime is False.
+        '''
+        if not self.streaming or not self._queue:
+            raise OSError(errno.EINVAL if not self.streaming else errno.EAGAIN,
+                "Resource temporarily unavailable")
+        index, queued = self._queue.pop(0)
+        sequence = self._sequence + 1
+        if self.realtime:
+            sequence = max(sequence, int(math.ceil((queued - self._start) * self.fps)))
+        due = self._start + sequence / float(self.fps)
+        if self.realtime:
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        key = (self.width, self.height, self.pixelformat, sequence % 16)
+        frame = self._patterns.get(key)
+        if frame is None:
+            frame = self._patterns[key] = self.pattern(sequence)
+        target = self._buffers[index]
+        target.seek(0)
+        target.write(frame)
+        self._sequence = sequence
+        buf.index = index
+        self._buffer(buf)
+        buf.bytesused = frame.nbytes
+        buf.sequence = sequence
+        buf.timestamp.secs = int(due)
+        buf.timestamp.usecs = int((due - int(due)) * 1e6)
+        return 0
+
+    def _streamon(self, buf_type):
+        if not self._buffers:
+            raise OSError(errno.EINVAL, "No buffers allocated")
+        self.streaming = True
+        self._start = time.monotonic()
+        self._sequence = -1
+        return 0
+
+    def _streamoff(self, buf_type):
+        self.streaming = False
+        self._queue = []
+        return 0
+
+    def pattern(self, index, frames = 16):
+        '''
+        Test pattern frame as the VI delivers it: uint16 samples (MSB
+        aligned on the platforms that do so) or uint8 for 8-bit formats.
+        '''
+        width, height = self.width, self.height
+        x = np.arange(width)
+        rgb = np.empty((height, width, 3), np.float32)
+        rgb[:] = _bars[x * len(_bars) // width]
+        bar = index % frames * width // frames
+        rgb[:, bar:bar + max(width // 32, 2)] = 1.0
+        order = _bayer_order.get(self.pixelformat, None)
+        if order is None:
+            plane = rgb.dot(np.array((0.299, 0.587, 0.114), np.float32))
+        else:
+            channel = {'R': 0, 'G': 1, 'B': 2}
+            plane = np.empty((height, width), np.float32)
+            for i, c in enumerate(order):
+                dy, dx = divmod(i, 2)
+                plane[dy::2, dx::2] = rgb[dy::2, dx::2, channel[c]]
+        bit_width = _bit_width.get(self.pixelformat, 10)
+        if bit_width == 8:
+            return (plane * 255).astype(np.uint8)
+        frame = (plane * 1023).astype(np.uint16)
+        if self.pixelformat == v4l2.V4L2_PIX_FMT_Y16 or \
+                msb_aligned(self.platform):
+            frame <<= 6
+        return frame
+
+class sim_capture(object):
+    '''
+    cv2.VideoCapture stand-in reading from a sim_device. Frames are paced
+    at the device fps unless realtime = False. replay is an optional file
+    of raw frames in the current format, cycled; otherwise the device
+    test pattern is used.
+    '''
+    def __init__(self, device, replay = None, realtime = True, frames = 16):
+        self.device = device
+        self.realtime = realtime
+        self.frames = frames
+        self._replay = np.memmap(replay, np.uint8, 'r') if replay else None
+        self._cache = {}
+        self._index = 0
+        self._start = None
+        self._opened = True
+
+    def isOpened(self):
+        return self._opened
+
+    def release(self):
+        self._opened = False
+
+    def get(self, prop):
+        device = self.device
+        return float({
+            cv2.CAP_PROP_FRAME_WIDTH: device.width,
+            cv2.CAP_PROP_FRAME_HEIGHT: device.height,
+            cv2.CAP_PROP_FPS: device.fps,
+            cv2.CAP_PROP_FOURCC: device.pixelformat,
+            cv2.CAP_PROP_CONVERT_RGB: 0,
+        }.get(prop, 0))
+
+    def set(self, prop, value):
+        device = self.device
+        fmt = v4l2.v4l2_format()
+        fmt.type = v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE
+        device.ioctl(v4l2.VIDIOC_G_FMT, fmt)
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            fmt.fmt.pix.width = int(value)
+        elif prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            fmt.fmt.pix.height = int(value)
+        elif prop == cv2.CAP_PROP_FOURCC:
+            fmt.fmt.pix.pixelformat = int(value)
+        elif prop == cv2.CAP_PROP_FPS:
+            device.fps = value
+            return True
+        elif prop == cv2.CAP_PROP_CONVERT_RGB:
+            return True
+        else:
+            return False
+        try:
+            device.ioctl(v4l2.VIDIOC_S_FMT, fmt)
+        except OSError:
+            return False
+        self._cache.clear()
+        return True
+
+    def _frame(self, index):
+        device = self.device
+        if self._replay is not None:
+            size = device.bytesperline() * device.height
+            count = self._replay.size // size
+            if count == 0:
+                return None
+            data = self._replay[index % count * size:(index % count + 1) * size]
+            dtype = np.uint8 if _bit_width.get(device.pixelformat, 16) == 8 else '<u2'
+            return np.array(data).view(dtype).reshape(device.height, device.width)
+        key = (device.width, device.height, device.pixelformat, index % self.frames)
+        frame = self._cache.get(key)
+        if frame is None:
+            frame = self._cache[key] = device.pattern(index, self.frames)
+        return frame.copy()
+
+    def read(self):
+        if not self._opened:
+            return False, None
+        if self.realtime:
+            now = time.time()
+            if self._start is None:
+                self._start = now
+            delay = self._start + self._index / float(self.device.fps) - now
+            if delay > 0:
+                time.sleep(delay)
+        frame = self._frame(self._index)
+        self._index += 1
+        return frame is not None, frame
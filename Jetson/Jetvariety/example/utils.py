@@ -4,6 +4,10 @@ import array
 import ctypes
 import cv2
 import numpy as np
+from frame_convert import FrameConverter
+from camera_profile import CameraProfile
+from jetson_board import board_name, msb_aligned
+from ArduCamControlsUtilities import RegisterBatch
 
 _IOC_NRBITS = 8
 _IOC_TYPEBITS = 8
@@ -126,77 +130,119 @@ class ArducamUtils(object):
 
     DEVICE_ID = 0x0030
 
-    def __init__(self, device_num):
-        from jtop import jtop
-        with jtop() as jetson:
-            if jetson.ok():
-                for name_category, category in jetson.board.items():
-                    if name_category == "hardware":
-                        environment_vars = category['Module']
+    def __init__(self, device_num, device = None, pixelformat = None, interactive = False,
+            profile = True, profile_dir = None):
+        '''
+        device: object with an ioctl(request, arg) method and a platform
+        name used instead of /dev/videoX, e.g. sim_v4l2.sim_device.
+        pixelformat, interactive, profile: see
+        ArduCamUtilities.ArduCamUtilities.
+        '''
+        self.device = device
+        if device is not None:
+            environment_vars = device.platform
+        else:
+            environment_vars = board_name()
         print("Hardware is: {}".format(environment_vars))
         # Jetson Model
-        if "Xavier NX" in environment_vars:
-            ArducamUtils.pixfmt_map = ArducamUtils.pixfmt_map_xavier_nx
-        elif "Orin NX" in environment_vars:
-            ArducamUtils.pixfmt_map = ArducamUtils.pixfmt_map_xavier_nx
-        elif "Orin Nano" in environment_vars:
+        if msb_aligned(environment_vars):
             ArducamUtils.pixfmt_map = ArducamUtils.pixfmt_map_xavier_nx
-        elif "AGX Orin" in environment_vars:
-            ArducamUtils.pixfmt_map = ArducamUtils.pixfmt_map_xavier_nx
-        self.vd = open('/dev/video{}'.format(device_num), 'w')
+        self.vd = device if device is not None else open('/dev/video{}'.format(device_num), 'w')
+        self._i2c = arducam_i2c()
+        self._dev = arducam_dev()
+        self.gamma = None
+        self.tone_curve = None
+        self._pixelformat = pixelformat
+        self._interactive = interactive
+        self.profile = CameraProfile.for_device(self, profile_dir) if profile else None
         self.refresh()
 
+    def ioctl(self, request, arg):
+        if self.device is not None:
+            return self.device.ioctl(request, arg)
+        return fcntl.ioctl(self.vd, request, arg)
+
     def refresh(self):
-        self.config = self.get_pixfmt_cfg()
+        self.config = self.get_pixfmt_cfg(self._pixelformat, self._interactive)
+        # Asked once, the choice is in the profile now
+        self._interactive = False
+        self.converter = None
+
+    def set_tone_curve(self, gamma = None, curve = None):
+        '''
+        Apply gamma, or curve mapping [0, 1] to [0, 1], in convert().
+        None for both restores the plain conversion.
+        '''
+        self.gamma = gamma
+        self.tone_curve = curve
+        self.converter = None
 
     def read_sensor(self, reg):
-        i2c = arducam_i2c()
+        i2c = self._i2c
         i2c.reg = reg
-        fcntl.ioctl(self.vd, VIDIOC_R_I2C, i2c)
+        self.ioctl(VIDIOC_R_I2C, i2c)
         return i2c.val
 
     def write_sensor(self, reg, val):
-        i2c = arducam_i2c()
+        i2c = self._i2c
         i2c.reg = reg
         i2c.val = val
-        return fcntl.ioctl(self.vd, VIDIOC_W_I2C, i2c)
+        return self.ioctl(VIDIOC_W_I2C, i2c)
 
     def read_dev(self, reg):
-        dev = arducam_dev()
+        dev = self._dev
         dev.reg = reg
-        ret = fcntl.ioctl(self.vd, VIDIOC_R_DEV, dev)
+        ret = self.ioctl(VIDIOC_R_DEV, dev)
         return ret, dev.val
 
     def write_dev(self, reg, val):
-        dev = arducam_dev()
+        dev = self._dev
         dev.reg = reg
         dev.val = val
-        return fcntl.ioctl(self.vd, VIDIOC_W_DEV, dev)
+        return self.ioctl(VIDIOC_W_DEV, dev)
+
+    def batch(self, log = None):
+        '''
+        A RegisterBatch on this camera, see ArduCamControlsUtilities.
+        '''
+        return RegisterBatch(self, log)
+
+    def run_script(self, script, log = None):
+        return RegisterBatch(self, log).script(script).run()
 
     def get_device_info(self):
-        _, fw_sensor_id = self.read_dev(ArducamUtils.FIRMWARE_SENSOR_ID_REG)
-        _, sensor_id = self.read_dev(ArducamUtils.SENSOR_ID_REG)
-        _, fw_version = self.read_dev(ArducamUtils.FIRMWARE_VERSION_REG)
-        _, serial_number = self.read_dev(ArducamUtils.SERIAL_NUMBER_REG)
-        return fw_sensor_id, sensor_id, fw_version, serial_number
+        return tuple(self.batch()
+            .read_dev(ArducamUtils.FIRMWARE_SENSOR_ID_REG)
+            .read_dev(ArducamUtils.SENSOR_ID_REG)
+            .read_dev(ArducamUtils.FIRMWARE_VERSION_REG)
+            .read_dev(ArducamUtils.SERIAL_NUMBER_REG)
+            .run())
+
+    def get_converter(self):
+        '''
+        The FrameConverter of the current depth and cvt_code, rebuilt when
+        they were changed, e.g. cvt_code overridden for a flipped sensor.
+        '''
+        converter = self.converter
+        if converter is None or converter.cvt_code != self.cvt_code or \
+                converter.depth != max(self.depth, 8):
+            converter = self.converter = FrameConverter(self.depth, self.cvt_code,
+                self.gamma, self.tone_curve)
+        return converter
 
     def convert(self, frame):
+        '''
+        The frame as 8 bit BGR (or gray), see FrameConverter. The returned
+        array is reused for the next frame.
+        '''
         if self.convert2rgb == 1:
             return frame
-
-        if self.depth != -1:
-            frame = cv2.convertScaleAbs(frame, None, 256.0 / (1 << self.depth))
-            frame = frame.astype(np.uint8)
-
-        if self.cvt_code != -1:
-            frame = cv2.cvtColor(frame, self.cvt_code)
-
-        return frame
+        return self.get_converter().convert(frame)
 
     def get_pixelformat(self):
         fmt = v4l2.v4l2_format()
         fmt.type = v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE
-        ret = fcntl.ioctl(self.vd, v4l2.VIDIOC_G_FMT, fmt)
+        ret = self.ioctl(v4l2.VIDIOC_G_FMT, fmt)
         return ret, fmt.fmt.pix.pixelformat
 
     def set_pixelformat(self, target_pixfmt=v4l2.V4L2_PIX_FMT_SRGGB10):
@@ -208,7 +254,7 @@ class ArducamUtils(object):
         ''' Query the current format first '''
         fmt = v4l2.v4l2_format()
         fmt.type = v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE
-        ret = fcntl.ioctl(self.vd, v4l2.VIDIOC_G_FMT, fmt)
+        ret = self.ioctl(v4l2.VIDIOC_G_FMT, fmt)
 
         ''' If the current format is not the target one, attempt to set it explicitly '''
         print("\nV4L2: ", end="")
@@ -216,103 +262,90 @@ class ArducamUtils(object):
             print(f"Current pixel format is 0x{fmt.fmt.pix.pixelformat:08x}, changing to 0x{target_pixfmt:08x}")
             fmt.fmt.pix.pixelformat = target_pixfmt
             try:
-                ret = fcntl.ioctl(self.vd, v4l2.VIDIOC_S_FMT, fmt)
+                ret = self.ioctl(v4l2.VIDIOC_S_FMT, fmt)
                 print(f"Pixel format set to 0x{target_pixfmt:08x}")
             except Exception as e:
                 print(f"Failed to set pixel format to 0x{target_pixfmt:08x}:", e)
                 ''' Revert to actual settings if failed '''
-                ret = fcntl.ioctl(self.vd, v4l2.VIDIOC_G_FMT, fmt)
+                ret = self.ioctl(v4l2.VIDIOC_G_FMT, fmt)
         else:
             print(f"Current pixel format is already 0x{target_pixfmt:08x}, no need to update")
 
-    def get_pixfmt_cfg(self):
+    def get_pixfmt_cfg(self, pixelformat = None, interactive = False):
+        """
+        The conversion config of pixelformat. Without one, the user picks
+        one when interactive, else the pixel format saved in the camera
+        profile is used, else AUTO_CONVERT_TO_RGB. Never blocks unless
+        interactive, so headless tools start unattended.
+        """
         ret, pixfmt = self.get_pixelformat()
         self.set_pixelformat()
 
-        # 初始化默认配置为 AUTO_CONVERT_TO_RGB
-        chosen_config = ArducamUtils.AUTO_CONVERT_TO_RGB
-        chosen_pixfmt = None
+        pf = ArducamUtils.pixfmt_map_raw8.get(pixfmt, None)
+        if pf is not None:
+            return pf
+
+        profile = self.profile
+        if pixelformat is not None:
+            if pixelformat not in ArducamUtils.pixfmt_map:
+                print(f"No conversion config for pixel format 0x{pixelformat:08x} ({get_v4l2_key_name(pixelformat, v4l2)}), using AUTO_CONVERT_TO_RGB")
+                return ArducamUtils.AUTO_CONVERT_TO_RGB
+        elif interactive:
+            pixelformat = self.choose_pixelformat()
+        elif profile is not None and "pixelformat" in profile:
+            pixelformat = profile.get("pixelformat")
+            if pixelformat is not None and pixelformat not in ArducamUtils.pixfmt_map:
+                pixelformat = None
+        else:
+            print("No pixel format configured, using AUTO_CONVERT_TO_RGB")
+            return ArducamUtils.AUTO_CONVERT_TO_RGB
+        if profile is not None:
+            profile.set("pixelformat", pixelformat)
+            profile.save()
+
+        if pixelformat is None:
+            print("Using AUTO_CONVERT_TO_RGB")
+            return ArducamUtils.AUTO_CONVERT_TO_RGB
+        config = ArducamUtils.pixfmt_map[pixelformat]
+        ''' Print out the config the program will use. '''
+        print(f"Key: {get_v4l2_key_name(pixelformat, v4l2)}, Value: {config}")
+        return config
 
+    def choose_pixelformat(self):
+        """
+        Ask the user for one of the supported pixel formats that have a
+        conversion config, None for AUTO_CONVERT_TO_RGB.
+        """
         # 列出所有相机支持的像素格式
         print("\n相机支持的像素格式如下：")
-        fmtdesc = v4l2.v4l2_fmtdesc()
-        fmtdesc.index = 0
-        fmtdesc.type = v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE
-
-        supported_formats = []
-        while True:
-            try:
-                fcntl.ioctl(self.vd, v4l2.VIDIOC_ENUM_FMT, fmtdesc)
-                pixfmt_hex = f"0x{fmtdesc.pixelformat:08X}"
-                print(f"{fmtdesc.index}: {fmtdesc.description} (pixelformat: {pixfmt_hex})")
-                supported_formats.append({
-                    "index": fmtdesc.index,
-                    "pixelformat": fmtdesc.pixelformat,
-                    "description": fmtdesc.description
-                })
-                fmtdesc.index += 1
-            except Exception as e:
-                break  # 枚举完成或发生错误，退出循环
+        supported_formats = self.get_pixelformats()
+        for index, (pixelformat, description) in enumerate(supported_formats):
+            print(f"{index}: {description} (pixelformat: 0x{pixelformat:08X})")
 
         # 列出所有程序支持的像素格式，然后让用户选择
+        matches = [(pixelformat, description) for pixelformat, description in supported_formats
+            if pixelformat in ArducamUtils.pixfmt_map]
+        if not matches:
+            # 如果没有找到匹配的配置，使用默认配置 AUTO_CONVERT_TO_RGB
+            return None
         print("\n程序支持的配置如下：")
-        # 检查当前像素格式是否在 pixfmt_map_raw8 中
-        pf = ArducamUtils.pixfmt_map_raw8.get(pixfmt, None)
-        if pf is not None:
-            chosen_config = pf
-        else:
-            # 枚举所有支持的像素格式并收集匹配的配置
-            fmtdesc = v4l2.v4l2_fmtdesc()
-            fmtdesc.index = 0
-            fmtdesc.type = v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE
-
-            matches = []
-            while True:
-                try:
-                    fcntl.ioctl(self.vd, v4l2.VIDIOC_ENUM_FMT, fmtdesc)
-                    # 检查当前枚举的像素格式是否在 pixfmt_map 中
-                    pixfmt_config = ArducamUtils.pixfmt_map.get(fmtdesc.pixelformat, None)
-                    if pixfmt_config is not None:
-                        matches.append({
-                            "index": fmtdesc.index,
-                            "pixelformat": fmtdesc.pixelformat,
-                            "description": fmtdesc.description,
-                            "config": pixfmt_config
-                        })
-                    fmtdesc.index += 1
-                except Exception as e:
-                    break  # 枚举完成或发生错误，退出循环
-
-            if matches:
-                print("找到多个程序支持的像素格式配置：")
-                for idx, match in enumerate(matches):
-                    pixfmt_hex = f"0x{match['pixelformat']:08X}"
-                    print(f"{idx}: {match['description']} (pixelformat: {pixfmt_hex})")
-
-                while True:
-                    try:
-                        selection = input(f"请选择一个像素格式配置 (0-{len(matches) - 1})，或按回车使用默认配置: ")
-                        if selection == "":
-                            print("使用默认配置: AUTO_CONVERT_TO_RGB")
-                            break  # 保持默认配置
-                        selection = int(selection)
-                        if 0 <= selection < len(matches):
-                            chosen_config = matches[selection]["config"]
-                            chosen_pixfmt = matches[selection]["pixelformat"]
-                            print(f"已选择: {matches[selection]['description']} (pixelformat: 0x{matches[selection]['pixelformat']:08X})")
-                            break
-                        else:
-                            print(f"请输入一个介于 0 和 {len(matches) - 1} 之间的数字。")
-                    except ValueError:
-                        print("无效输入，请输入一个数字。")
-            # 如果没有找到匹配的配置，保持默认配置 AUTO_CONVERT_TO_RGB
-
-        ''' Print out the config the program will use. '''
-        key_name = get_v4l2_key_name(chosen_pixfmt, v4l2)
-        print(f"Key: {key_name}, Value: {ArducamUtils.pixfmt_map[chosen_pixfmt]}")
+        for idx, (pixelformat, description) in enumerate(matches):
+            print(f"{idx}: {description} (pixelformat: 0x{pixelformat:08X})")
 
-        # 在函数末尾统一返回选择的配置
-        return chosen_config
+        while True:
+            try:
+                selection = input(f"请选择一个像素格式配置 (0-{len(matches) - 1})，或按回车使用默认配置: ")
+                if selection == "":
+                    print("使用默认配置: AUTO_CONVERT_TO_RGB")
+                    return None
+                selection = int(selection)
+                if 0 <= selection < len(matches):
+                    print(f"已选择: {matches[selection][1]} (pixelformat: 0x{matches[selection][0]:08X})")
+                    return matches[selection][0]
+                else:
+                    print(f"请输入一个介于 0 和 {len(matches) - 1} 之间的数字。")
+            except ValueError:
+                print("无效输入，请输入一个数字。")
 
     def get_pixelformats(self):
         pixfmts = []
@@ -321,7 +354,7 @@ class ArducamUtils(object):
         fmtdesc.type = v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE
         while True:
             try:
-                fcntl.ioctl(self.vd, v4l2.VIDIOC_ENUM_FMT, fmtdesc)
+                self.ioctl(v4l2.VIDIOC_ENUM_FMT, fmtdesc)
                 pixfmts.append((fmtdesc.pixelformat, fmtdesc.description))
                 fmtdesc.index += 1
             except Exception as e:
@@ -335,7 +368,7 @@ class ArducamUtils(object):
         framesize.pixel_format = pixel_format
         while True:
             try:
-                fcntl.ioctl(self.vd, v4l2.VIDIOC_ENUM_FRAMESIZES, framesize)
+                self.ioctl(v4l2.VIDIOC_ENUM_FRAMESIZES, framesize)
                 framesizes.append((framesize.discrete.width, framesize.discrete.height))
                 framesize.index += 1
             except Exception as e:
@@ -345,9 +378,14 @@ class ArducamUtils(object):
     def __getattr__(self, key):
         return self.config.get(key)
 
+_v4l2_key_names = {}
+
 def get_v4l2_key_name(key, module):
-    # Reverse lookup for key names
-    constants = {value: name for name, value in vars(module).items() if name.startswith("V4L2_PIX_FMT_")}
+    # Reverse lookup for key names, built once per module
+    constants = _v4l2_key_names.get(module.__name__)
+    if constants is None:
+        constants = {value: name for name, value in vars(module).items() if name.startswith("V4L2_PIX_FMT_")}
+        _v4l2_key_names[module.__name__] = constants
     return constants.get(key, f"Unknown ({key})")
 
 def print_ctypes_structure(obj, indent=0):
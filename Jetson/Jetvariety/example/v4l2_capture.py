@@ -0,0 +1,290 @@
+import ctypes
+import errno
+import fcntl
+import mmap
+import os
+import select
+import cv2
+import numpy as np
+import v4l2
+
+# Sample type and channels of the frames, 16 bit samples otherwise
+_sample_types = {
+    v4l2.V4L2_PIX_FMT_GREY: (np.uint8, 1),
+    v4l2.V4L2_PIX_FMT_SBGGR8: (np.uint8, 1),
+    v4l2.V4L2_PIX_FMT_SGBRG8: (np.uint8, 1),
+    v4l2.V4L2_PIX_FMT_SGRBG8: (np.uint8, 1),
+    v4l2.V4L2_PIX_FMT_SRGGB8: (np.uint8, 1),
+    v4l2.V4L2_PIX_FMT_YUYV: (np.uint8, 2),
+    v4l2.V4L2_PIX_FMT_YVYU: (np.uint8, 2),
+    v4l2.V4L2_PIX_FMT_UYVY: (np.uint8, 2),
+    v4l2.V4L2_PIX_FMT_VYUY: (np.uint8, 2),
+}
+
+V4L2_BUF_FLAG_ERROR = 0x0040
+
+
+class V4L2Capture(object):
+    '''
+    cv2.VideoCapture replacement streaming straight from /dev/videoX with
+    VIDIOC_REQBUFS/QBUF/DQBUF. The driver writes into buffers mmap'd
+    once, read() returns a NumPy view of the buffer instead of a copy: it
+    stays valid until the next read(), copy() frames kept longer. One
+    buffer is held by the application, the driver fills the others.
+
+        cap = V4L2Capture(0, arducam_utils, buffers=4)
+        ret, frame = cap.read()
+        print(cap.sequence, cap.timestamp, cap.dropped)
+
+    timestamp is the kernel capture time of the last frame in seconds of
+    CLOCK_MONOTONIC (time.monotonic()), sequence its frame counter.
+    Gaps in sequence are frames the driver dropped for lack of a queued
+    buffer, counted in dropped.
+
+    device: object with ioctl(request, arg) and mmap(length, offset)
+    methods used instead of /dev/videoX, e.g. sim_v4l2.sim_device.
+    utils: the ArduCamControlUtilities of the camera, its register shadow
+    is invalidated when the stream starts and stops.
+    '''
+    def __init__(self, device_num, utils=None, buffers=4, device=None, timeout=2.0):
+        self.utils = utils
+        self.device = device
+        self.fd = None if device is not None else \
+            os.open('/dev/video{}'.format(device_num), os.O_RDWR | os.O_NONBLOCK)
+        self.buffer_count = buffers
+        self.timeout = timeout
+        self.buffers = []
+        self.frames = []
+        self.streaming = False
+        self.held = None
+        self.sequence = -1
+        self.timestamp = 0.0
+        self.bytesused = 0
+        self.dropped = 0
+        self.errors = 0
+        self.count = 0
+        self._buf = v4l2.v4l2_buffer()
+        self.fmt = v4l2.v4l2_format()
+        self.fmt.type = v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE
+        self.ioctl(v4l2.VIDIOC_G_FMT, self.fmt)
+
+    def ioctl(self, request, arg):
+        if self.device is not None:
+            return self.device.ioctl(request, arg)
+        return fcntl.ioctl(self.fd, request, arg)
+
+    def _mmap(self, length, offset):
+        if self.device is not None:
+            return self.device.mmap(length, offset)
+        return mmap.mmap(self.fd, length, mmap.MAP_SHARED,
+            mmap.PROT_READ | mmap.PROT_WRITE, offset=offset)
+
+    def isOpened(self):
+        return self.fd is not None or self.device is not None
+
+    @property
+    def width(self):
+        return self.fmt.fmt.pix.width
+
+    @property
+    def height(self):
+        return self.fmt.fmt.pix.height
+
+    @property
+    def pixelformat(self):
+        return self.fmt.fmt.pix.pixelformat
+
+    def set_format(self, width=None, height=None, pixelformat=None):
+        '''
+        VIDIOC_S_FMT with the given fields changed, the stream is stopped
+        and its buffers freed first. Returns False if the driver refuses.
+        '''
+        self.stop()
+        fmt = v4l2.v4l2_format()
+        fmt.type = v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE
+        self.ioctl(v4l2.VIDIOC_G_FMT, fmt)
+        if width is not None:
+            fmt.fmt.pix.width = width
+        if height is not None:
+            fmt.fmt.pix.height = height
+        if pixelformat is not None:
+            fmt.fmt.pix.pixelformat = pixelformat
+        try:
+            self.ioctl(v4l2.VIDIOC_S_FMT, fmt)
+        except OSError:
+            return False
+        self.fmt = fmt
+        return True
+
+    def _view(self, buf):
+        '''
+        Frame shaped view of a mapped buffer, bytesperline padding cut off.
+        '''
+        pix = self.fmt.fmt.pix
+        dtype, channels = _sample_types.get(pix.pixelformat, (np.uint16, 1))
+        itemsize = np.dtype(dtype).itemsize
+        stride = pix.bytesperline or pix.width * itemsize * channels
+        rows = np.frombuffer(buf, dtype, count=pix.height * stride // itemsize)
+        if channels == 1:
+            return rows.reshape(pix.height, stride // itemsize)[:, :pix.width]
+        return rows.reshape(pix.height, stride // itemsize // channels, channels)[:, :pix.width]
+
+    def start(self):
+        '''
+        Allocate and map the buffers, queue them all and start streaming.
+        '''
+        if self.streaming:
+            return
+        self.ioctl(v4l2.VIDIOC_G_FMT, self.fmt)
+        req = v4l2.v4l2_requestbuffers()
+        req.count = self.buffer_count
+        req.type = v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE
+        req.memory = v4l2.V4L2_MEMORY_MMAP
+        self.ioctl(v4l2.VIDIOC_REQBUFS, req)
+        if req.count < 2:
+            raise OSError(errno.ENOMEM, "Not enough capture buffers: {}".format(req.count))
+        for index in range(req.count):
+            buf = v4l2.v4l2_buffer()
+            buf.index = index
+            buf.type = v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE
+            buf.memory = v4l2.V4L2_MEMORY_MMAP
+            self.ioctl(v4l2.VIDIOC_QUERYBUF, buf)
+            self.buffers.append(self._mmap(buf.length, buf.m.offset))
+            self.frames.append(self._view(self.buffers[-1]))
+            self.ioctl(v4l2.VIDIOC_QBUF, buf)
+        self.ioctl(v4l2.VIDIOC_STREAMON, ctypes.c_int(v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE))
+        self.streaming = True
+        self.held = None
+        self.sequence = -1
+        if self.utils is not None:
+            self.utils.invalidate()
+
+    def stop(self):
+        '''
+        Stop streaming, unmap and free the buffers.
+        '''
+        if self.streaming:
+            self.ioctl(v4l2.VIDIOC_STREAMOFF, ctypes.c_int(v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE))
+            self.streaming = False
+            self.held = None
+            if self.utils is not None:
+                self.utils.invalidate()
+        if not self.buffers:
+            return
+        del self.frames[:]
+        for buf in self.buffers:
+            try:
+                buf.close()
+            except BufferError:
+                # A frame is still referenced, unmapped when it goes away
+                pass
+        del self.buffers[:]
+        req = v4l2.v4l2_requestbuffers()
+        req.count = 0
+        req.type = v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE
+        req.memory = v4l2.V4L2_MEMORY_MMAP
+        try:
+            self.ioctl(v4l2.VIDIOC_REQBUFS, req)
+        except OSError:
+            pass
+
+    def queue(self, index):
+        '''
+        Give buffer index back to the driver.
+        '''
+        buf = self._buf
+        buf.index = index
+        buf.type = v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE
+        buf.memory = v4l2.V4L2_MEMORY_MMAP
+        self.ioctl(v4l2.VIDIOC_QBUF, buf)
+
+    def dequeue(self, timeout=None):
+        '''
+        Index of the next filled buffer, None on timeout. Updates
+        sequence, timestamp, bytesused and dropped. The buffer belongs to
+        the application until queue(index).
+        '''
+        buf = self._buf
+        buf.type = v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE
+        buf.memory = v4l2.V4L2_MEMORY_MMAP
+        while True:
+            try:
+                self.ioctl(v4l2.VIDIOC_DQBUF, buf)
+            except OSError as e:
+                if e.errno != errno.EAGAIN or self.fd is None:
+                    raise
+                ready, _, _ = select.select((self.fd,), (), (),
+                    self.timeout if timeout is None else timeout)
+                if not ready:
+                    return None
+                continue
+            if buf.flags & V4L2_BUF_FLAG_ERROR:
+                self.errors += 1
+                self.ioctl(v4l2.VIDIOC_QBUF, buf)
+                continue
+            break
+        if self.sequence >= 0 and buf.sequence > self.sequence + 1:
+            self.dropped += buf.sequence - self.sequence - 1
+        self.sequence = buf.sequence
+        self.timestamp = buf.timestamp.secs + buf.timestamp.usecs * 1e-6
+        self.bytesused = buf.bytesused
+        self.count += 1
+        return buf.index
+
+    def grab(self):
+        if not self.streaming:
+            self.start()
+        if self.held is not None:
+            self.queue(self.held)
+            self.held = None
+        self.held = self.dequeue()
+        return self.held is not None
+
+    def retrieve(self):
+        if self.held is None:
+            return False, None
+        return True, self.frames[self.held]
+
+    def read(self):
+        '''
+        cv2.VideoCapture.read(): (True, frame) with frame a view of the
+        mapped buffer, (False, None) on timeout.
+        '''
+        if not self.grab():
+            return False, None
+        return True, self.frames[self.held]
+
+    def get(self, prop):
+        return float({
+            cv2.CAP_PROP_FRAME_WIDTH: self.width,
+            cv2.CAP_PROP_FRAME_HEIGHT: self.height,
+            cv2.CAP_PROP_FOURCC: self.pixelformat,
+            cv2.CAP_PROP_BUFFERSIZE: self.buffer_count,
+            cv2.CAP_PROP_POS_MSEC: self.timestamp * 1000,
+            cv2.CAP_PROP_POS_FRAMES: self.count,
+            cv2.CAP_PROP_CONVERT_RGB: 0,
+        }.get(prop, 0))
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.set_format(width=int(value))
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.set_format(height=int(value))
+        if prop == cv2.CAP_PROP_FOURCC:
+            return self.set_format(pixelformat=int(value))
+        if prop == cv2.CAP_PROP_BUFFERSIZE:
+            self.stop()
+            self.buffer_count = max(int(value), 2)
+            return True
+        if prop == cv2.CAP_PROP_CONVERT_RGB:
+            # Frames are always delivered as the driver writes them
+            return not value
+        return False
+
+    def release(self):
+        self.stop()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        self.device = None
+
@@ -1,5 +1,6 @@
+import os
 import sys
-sys.path.append('../')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python'))
 import arducam_mipicamera as arducam
 import v4l2 #sudo pip install v4l2
 import time
@@ -47,10 +48,11 @@ if __name__ == "__main__":
         start_time = time.time()
         do_change = True
         while True:
-            data = camera.capture(encoding = 'raw')
-            # Use different variable names to avoid memory being released
-            frame = arducam.unpack_raw10_to_raw8(data.buffer_ptr, fmt[0], fmt[1])
-            frame = cv2.cvtColor(frame.as_array.reshape((fmt[1], fmt[0])), cv2.COLOR_BAYER_RG2BGR)
+            # The buffers are released when leaving the block, the views
+            # handed to cvtColor must not be kept beyond it.
+            with camera.capture(encoding = 'raw') as data, \
+                    arducam.unpack_raw10_to_raw8(data.buffer_ptr, fmt[0], fmt[1]) as raw8:
+                frame = cv2.cvtColor(raw8.view().reshape((fmt[1], fmt[0])), cv2.COLOR_BAYER_RG2BGR)
             _isp.run_awb(frame)
             _isp.run_ae(frame)
 
@@ -71,9 +73,7 @@ if __name__ == "__main__":
                 cv2.imwrite("Test.jpg", frame)
                 break
 
-        # Release memory
         del frame
-        del data
         print("Close camera...")
         camera.close_camera()
     except Exception as e:
@@ -1,24 +1,43 @@
 from ctypes import *
+import os
 import numpy as np
-import gc
-_dll = CDLL("./libisp_lib.so")
+_dll = CDLL(os.path.join(os.path.dirname(os.path.abspath(__file__)), "libisp_lib.so"))
+
+_dll.create_isp.argtypes = [POINTER(c_void_p), c_void_p]
+_dll.run_auto_white_balance.argtypes = [c_void_p, c_void_p, c_int, c_int]
+_dll.run_auto_white_balance.restype = None
+_dll.run_auto_exposure.argtypes = [c_void_p, c_void_p, c_int, c_int]
+_dll.run_auto_exposure.restype = None
 
 class isp(object):
+    '''
+    Software AWB / AE of libisp_lib.so on BGR frames.
+
+    The library reads the frame through a raw pointer, so the array passed
+    last is referenced by the isp object until the next call instead of
+    relying on gc.collect() to keep the memory valid. AWB and AE each
+    sweep the frame; bayer_stats.bayer_3a gathers both statistics in one
+    pass over the raw Bayer data instead.
+    '''
     def __init__(self, camera_instance):
         self.camera_instance = camera_instance
         self.instance = c_void_p(0)
+        self._frame = None
         _dll.create_isp(byref(self.instance), self.camera_instance)
-    
-    def run_awb(self, img):
-        w = img.shape[1]
-        h = img.shape[0]
+
+    def _prepare(self, img):
+        if img.dtype != np.uint8 or img.ndim != 3 or img.shape[2] != 3:
+            raise ValueError("Expected a uint8 BGR image of shape (h, w, 3).")
+        img = np.ascontiguousarray(img)
+        self._frame = img
         # https://github.com/numpy/numpy/blob/1c58504eec43f9ba18ac835131fed496fb59772d/numpy/core/_internal.py#L266
-        # _dll.run_auto_white_balance(self.instance, c_void_p(img.ctypes.data), w, h)
-        _dll.run_auto_white_balance(self.instance, img.ctypes.data_as(c_void_p), w, h)
-        gc.collect()
+        return img.ctypes.data_as(c_void_p), img.shape[1], img.shape[0]
+
+    def run_awb(self, img):
+        data, w, h = self._prepare(img)
+        _dll.run_auto_white_balance(self.instance, data, w, h)
 
     def run_ae(self, img):
-        w = img.shape[1]
-        h = img.shape[0]
-        _dll.run_auto_exposure(self.instance, img.ctypes.data_as(c_void_p), w, h)
-        gc.collect()
+        data, w, h = self._prepare(img)
+        _dll.run_auto_exposure(self.instance, data, w, h)
+
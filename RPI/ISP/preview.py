@@ -1,11 +1,13 @@
+import os
 import sys
-sys.path.append('../')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python'))
 import arducam_mipicamera as arducam
 import v4l2 #sudo pip install v4l2
 import time
 import numpy as np
 import cv2
 from isp_lib import *
+from raw_pipeline import binned_preview
 
 def set_controls(camera):
     try:
@@ -23,12 +25,18 @@ def set_controls(camera):
     # except Exception as e:
     #     print(e)
 
-def resize(frame, dst_width=640):
-    height = frame.shape[0]
-    width = frame.shape[1]
-
-    scale = (dst_width * 1.0) / width
-    return cv2.resize(frame, (int(scale * width), int(scale * height))) 
+def preview_for(fmt, dst_width=640):
+    '''
+    Bins the Bayer frame down before colour conversion instead of
+    demosaicing the full frame and resizing it. The Bayer order comes from
+    the pixel format, BGGR (cv2.COLOR_BAYER_RG2BGR) when it is unknown.
+    '''
+    width, height = fmt["width"], fmt["height"]
+    order = arducam.pixelformat_bayer_order.get(fmt["pixelformat"], 'BGGR')
+    bit_width = arducam.pixelformat_bit_width.get(fmt["pixelformat"], 10)
+    factor = max(2, width // dst_width // 2 * 2)
+    return binned_preview(width, height, bit_width, order, factor = factor,
+        out_size = (dst_width, height * dst_width // width))
 
 
 if __name__ == "__main__":
@@ -40,6 +48,7 @@ if __name__ == "__main__":
         print("Setting the mode...")
         camera.set_mode(0)
         fmt = camera.get_format()
+        preview = preview_for(fmt)
         fmt = (fmt["width"], fmt["height"])
         print("Current resolution is {}".format(fmt))
         set_controls(camera)
@@ -47,16 +56,14 @@ if __name__ == "__main__":
         start_time = time.time()
         do_change = True
         while True:
-            data = camera.capture(encoding = 'raw')
-            # Use different variable names to avoid memory being released
-            frame = arducam.unpack_raw10_to_raw8(data.buffer_ptr, fmt[0], fmt[1])
-            frame = cv2.cvtColor(frame.as_array.reshape((fmt[1], fmt[0])), cv2.COLOR_BAYER_RG2BGR)
+            # The buffer is released when leaving the block, the preview
+            # is written to its own array.
+            with camera.capture(encoding = 'raw') as data:
+                frame = preview.process(data.view())
             _isp.run_awb(frame)
             _isp.run_ae(frame)
 
-            disp = resize(frame)
-
-            cv2.imshow("Arducam", disp)
+            cv2.imshow("Arducam", frame)
             ret = cv2.waitKey(10)
             if ret == ord('q'):
                 break
@@ -71,9 +78,7 @@ if __name__ == "__main__":
            #     cv2.imwrite("Test.jpg", frame)
            #     break
 
-        # Release memory
         del frame
-        del data
         print("Close camera...")
         camera.close_camera()
     except Exception as e:
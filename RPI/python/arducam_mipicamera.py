@@ -1,17 +1,17 @@
 '''
 This script is a wrapper for the libarducam_mipicamera.so dynamic library. 
-To use this script you need to pre-install libarducam_mipicamera.so
+To use the camera you need to pre-install libarducam_mipicamera.so.
+The library is loaded on the first camera call, so importing this module
+for offline processing (buffer layouts, raw unpacking) works without it.
 '''
 from ctypes import *
 import numpy as np
+import os
 import sys
-
-try:
-    camera_lib = cdll.LoadLibrary("libarducam_mipicamera.so")
-except:
-    print("Load libarducam_mipicamera fail.")
-    sys.exit(0)
-
+import collections
+import threading
+import weakref
+from raw_unpack import raw_unpacker, unpack_raw
 
 def FOURCC(a, b, c, d):
     return (ord(a) | (ord(b) << 8) | (ord(c) << 16) | (ord(d) << 24))
@@ -31,6 +31,36 @@ video_encodings = {
     'h264' : VIDEO_ENCODING_H264,
 }
 
+# Bits per pixel of the MIPI packed formats reported in FORMAT.pixelformat
+pixelformat_bit_width = {
+    FOURCC('B', 'A', '8', '1') : 8,     # SBGGR8
+    FOURCC('G', 'B', 'R', 'G') : 8,     # SGBRG8
+    FOURCC('G', 'R', 'B', 'G') : 8,     # SGRBG8
+    FOURCC('R', 'G', 'G', 'B') : 8,     # SRGGB8
+    FOURCC('G', 'R', 'E', 'Y') : 8,     # GREY
+    FOURCC('p', 'B', 'A', 'A') : 10,    # SBGGR10P
+    FOURCC('p', 'G', 'A', 'A') : 10,    # SGBRG10P
+    FOURCC('p', 'g', 'A', 'A') : 10,    # SGRBG10P
+    FOURCC('p', 'R', 'A', 'A') : 10,    # SRGGB10P
+    FOURCC('Y', '1', '0', 'P') : 10,    # Y10P
+    FOURCC('p', 'B', 'C', 'C') : 12,    # SBGGR12P
+    FOURCC('p', 'G', 'C', 'C') : 12,    # SGBRG12P
+    FOURCC('p', 'g', 'C', 'C') : 12,    # SGRBG12P
+    FOURCC('p', 'R', 'C', 'C') : 12,    # SRGGB12P
+    FOURCC('Y', '1', '2', 'P') : 12,    # Y12P
+}
+
+# Colour order of the top-left 2x2 cell, None for monochrome formats
+pixelformat_bayer_order = {}
+for _codes, _order in (
+        (('RGGB', 'pRAA', 'pRCC'), 'RGGB'),
+        (('BA81', 'pBAA', 'pBCC'), 'BGGR'),
+        (('GBRG', 'pGAA', 'pGCC'), 'GBRG'),
+        (('GRBG', 'pgAA', 'pgCC'), 'GRBG'),
+        (('GREY', 'Y10P', 'Y12P'), None)):
+    for _code in _codes:
+        pixelformat_bayer_order[FOURCC(*_code)] = _order
+
 
 # H264 level
 VIDEO_LEVEL_H264_4                  = 0x1C
@@ -155,119 +185,199 @@ class CAMERA_INTERFACE(Structure):
 
 OUTPUT_CALLBACK = CFUNCTYPE(c_int, POINTER(BUFFER))
 
-arducam_init_camera = camera_lib.arducam_init_camera
-arducam_init_camera.argtypes = [POINTER(c_void_p)]
-arducam_init_camera.restype = c_int
-
-arducam_init_camera2 = camera_lib.arducam_init_camera2
-arducam_init_camera2.argtypes = [POINTER(c_void_p), CAMERA_INTERFACE]
-arducam_init_camera2.restype = c_int
-
-arducam_set_resolution = camera_lib.arducam_set_resolution
-arducam_set_resolution.argtypes = [c_void_p, POINTER(c_int), POINTER(c_int)]
-arducam_set_resolution.restype = c_int
-
-arducam_set_mode = camera_lib.arducam_set_mode
-arducam_set_mode.argtypes = [c_void_p, c_int]
-arducam_set_mode.restype = c_int
-
-arducam_get_format = camera_lib.arducam_get_format
-arducam_get_format.argtypes = [c_void_p, POINTER(FORMAT)]
-arducam_get_format.restype = c_int
-
-arducam_start_preview = camera_lib.arducam_start_preview
-arducam_start_preview.argtypes = [c_void_p, POINTER(PREVIEW_PARAMS)]
-arducam_start_preview.restype = c_int
-
-arducam_stop_preview = camera_lib.arducam_stop_preview
-arducam_start_preview.argtypes = [c_void_p]
-arducam_start_preview.restype = c_int
-
-arducam_capture = camera_lib.arducam_capture
-arducam_capture.argtypes = [c_void_p, POINTER(IMAGE_FORMAT), c_int]
-arducam_capture.restype = POINTER(BUFFER)
-
-arducam_release_buffer = camera_lib.arducam_release_buffer
-arducam_release_buffer.argtypes = [POINTER(BUFFER)]
-arducam_release_buffer.restype = None
-
-arducam_set_raw_callback = camera_lib.arducam_set_raw_callback
-arducam_set_raw_callback.argtypes = [c_void_p, OUTPUT_CALLBACK, c_void_p]
-arducam_set_raw_callback.restype = c_int
-
-arducam_set_video_callback = camera_lib.arducam_set_video_callback
-arducam_set_video_callback.argtypes = [c_void_p, POINTER(VIDEO_ENCODER_STATE), OUTPUT_CALLBACK, c_void_p]
-arducam_set_video_callback.restype = c_int
-
-arducam_reset_control = camera_lib.arducam_reset_control
-arducam_reset_control.argtypes = [c_void_p, c_int]
-arducam_reset_control.restype = c_int
-
-arducam_set_control = camera_lib.arducam_set_control
-arducam_set_control.argtypes = [c_void_p, c_int, c_int]
-arducam_set_control.restype = c_int
-
-arducam_get_control = camera_lib.arducam_get_control
-arducam_get_control.argtypes = [c_void_p, c_int, POINTER(c_int)]
-arducam_get_control.restype = c_int
-
-arducam_get_support_formats = camera_lib.arducam_get_support_formats
-arducam_get_support_formats.argtypes = [c_void_p, POINTER(FORMAT), c_int]
-arducam_get_support_formats.restype = c_int
-
-arducam_get_support_controls = camera_lib.arducam_get_support_controls
-arducam_get_support_controls.argtypes = [c_void_p, POINTER(CAMERA_CTRL), c_int]
-arducam_get_support_controls.restype = c_int
-
-
-arducam_software_auto_exposure = camera_lib.arducam_software_auto_exposure
-arducam_software_auto_exposure.argtypes = [c_void_p, c_int]
-arducam_software_auto_exposure.restype = c_int
-
-arducam_software_auto_white_balance = camera_lib.arducam_software_auto_white_balance
-arducam_software_auto_white_balance.argtypes = [c_void_p, c_int]
-arducam_software_auto_white_balance.restype = c_int
-
-arducam_read_sensor_reg = camera_lib.arducam_read_sensor_reg
-arducam_read_sensor_reg.argtypes = [c_void_p, c_uint16, POINTER(c_uint16)]
-arducam_read_sensor_reg.restype = c_int
-
-arducam_write_sensor_reg = camera_lib.arducam_write_sensor_reg
-arducam_write_sensor_reg.argtypes = [c_void_p, c_uint16, c_uint16]
-arducam_write_sensor_reg.restype = c_int
+# name : (argtypes, restype), bound on first call by _lazy_function
+_functions = {
+    'arducam_init_camera' : ([POINTER(c_void_p)], c_int),
+    'arducam_init_camera2' : ([POINTER(c_void_p), CAMERA_INTERFACE], c_int),
+    'arducam_set_resolution' : ([c_void_p, POINTER(c_int), POINTER(c_int)], c_int),
+    'arducam_set_mode' : ([c_void_p, c_int], c_int),
+    'arducam_get_format' : ([c_void_p, POINTER(FORMAT)], c_int),
+    'arducam_start_preview' : ([c_void_p, POINTER(PREVIEW_PARAMS)], c_int),
+    'arducam_stop_preview' : ([c_void_p], c_int),
+    'arducam_capture' : ([c_void_p, POINTER(IMAGE_FORMAT), c_int], POINTER(BUFFER)),
+    'arducam_release_buffer' : ([POINTER(BUFFER)], None),
+    'arducam_set_raw_callback' : ([c_void_p, OUTPUT_CALLBACK, c_void_p], c_int),
+    'arducam_set_video_callback' : ([c_void_p, POINTER(VIDEO_ENCODER_STATE), OUTPUT_CALLBACK, c_void_p], c_int),
+    'arducam_reset_control' : ([c_void_p, c_int], c_int),
+    'arducam_set_control' : ([c_void_p, c_int, c_int], c_int),
+    'arducam_get_control' : ([c_void_p, c_int, POINTER(c_int)], c_int),
+    'arducam_get_support_formats' : ([c_void_p, POINTER(FORMAT), c_int], c_int),
+    'arducam_get_support_controls' : ([c_void_p, POINTER(CAMERA_CTRL), c_int], c_int),
+    'arducam_software_auto_exposure' : ([c_void_p, c_int], c_int),
+    'arducam_software_auto_white_balance' : ([c_void_p, c_int], c_int),
+    'arducam_read_sensor_reg' : ([c_void_p, c_uint16, POINTER(c_uint16)], c_int),
+    'arducam_write_sensor_reg' : ([c_void_p, c_uint16, c_uint16], c_int),
+    'arducam_close_camera' : ([c_void_p], c_int),
+    'arducam_unpack_raw10_to_raw8' : ([POINTER(c_ubyte), c_int, c_int], POINTER(BUFFER)),
+    'arducam_unpack_raw10_to_raw16' : ([POINTER(c_ubyte), c_int, c_int], POINTER(BUFFER)),
+    'arducam_manual_set_awb_compensation' : ([c_int, c_int], None),
+}
 
-arducam_close_camera = camera_lib.arducam_close_camera
-arducam_close_camera.argtypes = [c_void_p]
-arducam_close_camera.restype = c_int
+_camera_lib = None
+
+def load_library(name = None):
+    '''
+    Load libarducam_mipicamera.so, once. The ARDUCAM_MIPICAMERA_LIB
+    environment variable overrides the library name or path; "sim" selects
+    the simulated camera of sim_camera.py.
+    Raises OSError when the library cannot be loaded.
+    '''
+    global _camera_lib
+    if _camera_lib is None:
+        if name is None:
+            name = os.environ.get("ARDUCAM_MIPICAMERA_LIB", "libarducam_mipicamera.so")
+        if name == "sim":
+            from sim_camera import sim_library
+            _camera_lib = sim_library()
+            return _camera_lib
+        try:
+            _camera_lib = cdll.LoadLibrary(name)
+        except OSError as e:
+            raise OSError("Load libarducam_mipicamera fail: {}".format(e))
+    return _camera_lib
+
+def set_library(lib):
+    '''
+    Use lib in place of libarducam_mipicamera.so, e.g. a
+    sim_camera.sim_library(). Functions are looked up on it by name.
+    '''
+    global _camera_lib
+    _camera_lib = lib
+    for name, (argtypes, restype) in _functions.items():
+        globals()[name] = _lazy_function(name, argtypes, restype)
+
+def library_available():
+    try:
+        load_library()
+    except OSError:
+        return False
+    return True
+
+class _lazy_function(object):
+    '''
+    Stands in for a library function until its first call, which loads the
+    library, sets argtypes / restype once and replaces the module global
+    with the ctypes function itself.
+    '''
+    def __init__(self, name, argtypes, restype):
+        self.__name__ = name
+        self.argtypes = argtypes
+        self.restype = restype
+        self._func = None
+
+    def resolve(self):
+        if self._func is None:
+            func = getattr(load_library(), self.__name__)
+            try:
+                func.argtypes = self.argtypes
+                func.restype = self.restype
+            except AttributeError:
+                # Python implementation (sim_library), nothing to declare.
+                pass
+            self._func = func
+            globals()[self.__name__] = func
+        return self._func
 
-arducam_unpack_raw10_to_raw8 = camera_lib.arducam_unpack_raw10_to_raw8
-arducam_unpack_raw10_to_raw8.argtypes = [POINTER(c_ubyte), c_int, c_int]
-arducam_unpack_raw10_to_raw8.restype = POINTER(BUFFER)
+    def __call__(self, *args):
+        return self.resolve()(*args)
 
-arducam_unpack_raw10_to_raw16 = camera_lib.arducam_unpack_raw10_to_raw16
-arducam_unpack_raw10_to_raw16.argtypes = [POINTER(c_ubyte), c_int, c_int]
-arducam_unpack_raw10_to_raw16.restype = POINTER(BUFFER)
+for _name, (_argtypes, _restype) in _functions.items():
+    globals()[_name] = _lazy_function(_name, _argtypes, _restype)
 
-arducam_manual_set_awb_compensation = camera_lib.arducam_manual_set_awb_compensation
-arducam_manual_set_awb_compensation.argtypes = [c_int,c_int]
-arducam_manual_set_awb_compensation.restype = None
 def align_down(size, align):
     return (size & ~((align)-1))
 
 def align_up(size, align):
     return align_down(size + align - 1, align)
 
+def frame_shape(fmt, encoding):
+    '''
+    Shape of the padded frame the MMAL buffer holds for the given format.
+    Rows are aligned to 16 and the line stride to 32 bytes. Returns None
+    for encodings without a fixed layout (JPEG).
+    '''
+    width = fmt["width"]
+    height = fmt["height"]
+    if encoding == IMAGE_ENCODING_RAW_BAYER:
+        bit_width = pixelformat_bit_width.get(fmt["pixelformat"], 10)
+        return (align_up(height, 16), align_up(width * bit_width // 8, 32))
+    if encoding == IMAGE_ENCODING_I420:
+        return (align_up(height, 16) * 3 // 2, align_up(width, 32))
+    return None
+
+def exported_array(owner, address, length, export = None):
+    '''
+    uint8 ndarray over length bytes at address, and a weak reference to the
+    ctypes array backing it. The ctypes array is the base of every view
+    derived from the result and keeps owner alive; the weak reference tells
+    owner whether any such view still exists. Passing the previous weak
+    reference as export reuses its array while it is alive, so all views of
+    owner share one base and one weak reference tracks them all.
+    '''
+    raw = export() if export is not None else None
+    if raw is not None and len(raw) < length:
+        raise BufferError("Views of the previous length are still referenced.")
+    if raw is None:
+        raw = (c_ubyte * length).from_address(address)
+        raw._owner = owner
+    return np.frombuffer(raw, dtype=np.uint8)[:length], weakref.ref(raw)
+
+def shape_frame(arr, fmt, encoding, crop = False):
+    '''
+    Reshape a flat frame to frame_shape(), optionally cropped to the visible
+    raw lines. Returns arr unchanged when the layout is unknown.
+    '''
+    shape = None
+    if fmt is not None:
+        shape = frame_shape(fmt, encoding)
+    if shape is None or shape[0] * shape[1] > arr.size:
+        return arr
+    arr = arr[:shape[0] * shape[1]].reshape(shape)
+    if crop and encoding == IMAGE_ENCODING_RAW_BAYER:
+        bit_width = pixelformat_bit_width.get(fmt["pixelformat"], 10)
+        arr = arr[:fmt["height"], :fmt["width"] * bit_width // 8]
+    return arr
+
 class buffer(object):
     buffer_ptr = None
-    def __init__(self, buff):
+    _released = True
+    _export = None
+    def __init__(self, buff, fmt = None, encoding = None):
         if not isinstance(buff, POINTER(BUFFER)):
             raise TypeError("Expected parameter type is POINTER(BUFFER).")
         self.buffer_ptr = buff
+        self.fmt = fmt
+        self.encoding = encoding
+        self._released = not buff
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        return False
+
+    def _exported(self):
+        return self._export is not None and self._export() is not None
+
+    def view(self, crop = False):
+        '''
+        Zero-copy ndarray over the MMAL buffer. The array is shaped for the
+        capture format including the alignment padding; crop = True returns
+        a strided view of the visible raw lines only.
+        The view keeps this buffer alive, and release() refuses to hand the
+        memory back to the library while any view still exists.
+        '''
+        if self._released:
+            raise RuntimeError("Buffer has already been released.")
+        arr, self._export = exported_array(self,
+            addressof(self.buffer_ptr[0].data.contents), self.length, self._export)
+        return shape_frame(arr, self.fmt, self.encoding, crop)
 
     @property
     def as_array(self):
-        return np.ctypeslib.as_array(self.buffer_ptr[0].data, shape=(self.length,))
-    
+        return self.view().reshape(-1)
+
     @property
     def data(self):
         return string_at(self.buffer_ptr[0].data,self.length)
@@ -295,7 +405,8 @@ class buffer(object):
 
     @property
     def pts(self):
-        return self.buffer_ptr[0].pts
+        # Signed like raw_stream frames, MMAL_TIME_UNKNOWN is negative
+        return c_int64(self.buffer_ptr[0].pts).value
     @pts.setter
     def pts(self, value):
         self.buffer_ptr[0].pts = value
@@ -307,6 +418,12 @@ class buffer(object):
         return cast(self.buffer_ptr[0].userdata, POINTER(py_object))[0]
 
     def release(self):
+        if self._released:
+            return
+        if self._exported():
+            raise BufferError(
+                "Buffer views are still referenced, copy() them before releasing the buffer.")
+        self._released = True
         arducam_release_buffer(self.buffer_ptr)
 
     def __del__(self):
@@ -314,12 +431,287 @@ class buffer(object):
 
 def check_status(status,func_name):
     if status != 0:
-        raise RuntimeError("{}: Unexpected result.".format(func_name))
+        raise RuntimeError("{}: Unexpected result {}.".format(func_name, status))
+
+class frame_stream(object):
+    '''
+    Iterator over captured frames that converts into a fixed ring of
+    preallocated arrays, so a steady-state capture loop does not allocate
+    frame sized memory. A yielded array is overwritten `buffers` frames
+    later; copy() it if it has to live longer than that.
+
+    i420 frames are converted to BGR, raw frames are unpacked to dtype
+    (uint16 or uint8). Frames missing between two captures, detected from
+    the pts gap and the mode frame interval, are counted in `dropped`, and
+    `last_dropped` holds the count for the frame just returned.
+    '''
+    def __init__(self, camera, encoding = 'i420', buffers = 3, dtype = np.uint16, time_out = 3000):
+        if encoding not in ('i420', 'raw'):
+            raise ValueError("frames() supports 'i420' and 'raw' encodings.")
+        self.camera = camera
+        self.encoding = encoding
+        self.time_out = time_out
+        self.fmt = camera.current_format()
+        width = self.fmt["width"]
+        height = self.fmt["height"]
+        if encoding == 'i420':
+            import cv2
+            self._cvt = cv2.cvtColor
+            self._cvt_code = cv2.COLOR_YUV2BGR_I420
+            # cvtColor writes the padded frame, the ring keeps that shape
+            # and hands out the visible part.
+            shape = frame_shape(self.fmt, IMAGE_ENCODING_I420)
+            self._ring = [np.empty((shape[0] * 2 // 3, shape[1], 3), np.uint8) for _ in range(buffers)]
+            self._frames = [image[:height, :width] for image in self._ring]
+        else:
+            self._unpacker = raw_unpacker(width, height,
+                pixelformat_bit_width.get(self.fmt["pixelformat"], 10), dtype)
+            self._ring = [self._unpacker.new_output() for _ in range(buffers)]
+            self._frames = self._ring
+
+        interval = self.fmt["frameintervals"]
+        self.frame_interval = None
+        if interval["numerator"] and interval["denominator"]:
+            # pts is in microseconds
+            self.frame_interval = 1000000.0 * interval["numerator"] / interval["denominator"]
+        self.index = 0
+        self.count = 0
+        self.dropped = 0
+        self.last_dropped = 0
+        self.pts = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        slot = self.index
+        with self.camera.capture(self.time_out, self.encoding) as frame:
+            if frame._released:
+                raise TimeoutError("Capture timeout.")
+            pts = frame.pts
+            if self.encoding == 'i420':
+                self._cvt(frame.view(), self._cvt_code, dst=self._ring[slot])
+            else:
+                self._unpacker.unpack(frame.view(), self._ring[slot])
+
+        self.last_dropped = 0
+        if pts != MMAL_TIME_UNKNOWN:
+            if self.pts is not None and self.frame_interval:
+                missed = int(round((pts - self.pts) / self.frame_interval)) - 1
+                if missed > 0:
+                    self.last_dropped = missed
+                    self.dropped += missed
+            self.pts = pts
+        self.count += 1
+        self.index = (slot + 1) % len(self._ring)
+        return self._frames[slot]
+
+    next = __next__
+
+class queued_frame(object):
+    '''
+    A frame dequeued from a raw_stream. It owns one slot of the stream's
+    preallocated ring until release() (or the end of a with block) hands
+    the slot back to the producer.
+    '''
+    _export = None
+    def __init__(self, stream, slot, length, pts, flags):
+        self.stream = stream
+        self.slot = slot
+        self.length = length
+        self.pts = pts
+        self.flags = flags
+        self._released = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        return False
+
+    def _exported(self):
+        return self._export is not None and self._export() is not None
+
+    def view(self, crop = False):
+        '''
+        Zero-copy ndarray over the slot, shaped like buffer.view().
+        '''
+        if self._released:
+            raise RuntimeError("Frame has already been released.")
+        arr, self._export = exported_array(self,
+            self.stream._slots[self.slot].ctypes.data, self.length, self._export)
+        return shape_frame(arr, self.stream.fmt, IMAGE_ENCODING_RAW_BAYER, crop)
+
+    @property
+    def as_array(self):
+        return self.view().reshape(-1)
+
+    @property
+    def data(self):
+        return self.stream._slots[self.slot][:self.length].tobytes()
+
+    def release(self):
+        if self._released:
+            return
+        if self._exported():
+            raise BufferError(
+                "Frame views are still referenced, copy() them before releasing the frame.")
+        self._released = True
+        self.stream._free_slot(self.slot)
+
+    def __del__(self):
+        self.release()
+
+class raw_stream(object):
+    '''
+    Continuous raw capture driven by arducam_set_raw_callback.
+
+    The library releases a callback buffer as soon as the callback returns,
+    so the callback copies each frame once into a free slot of a
+    preallocated ring and publishes the slot index on a bounded single
+    producer / single consumer queue. get() (or iteration) dequeues a
+    queued_frame, which must be released to recycle its slot.
+
+    When every slot is in use the policy decides what happens to a new
+    frame: 'drop_oldest' recycles the oldest frame not yet dequeued,
+    'drop_newest' discards the incoming frame and 'block' stalls the
+    camera callback for up to block_timeout ms waiting for a free slot.
+    Discarded frames are counted in `dropped`.
+
+    allocate(slot, frame_size) may supply the slot arrays, e.g. views into
+    page aligned buffers for O_DIRECT writes (see raw_burst.py).
+    '''
+    policies = ('drop_oldest', 'drop_newest', 'block')
+
+    def __init__(self, camera, buffers = 4, policy = 'drop_oldest', block_timeout = 1000,
+            allocate = None):
+        if policy not in self.policies:
+            raise ValueError("Unknown policy {}, expected one of {}.".format(policy, self.policies))
+        if buffers < 1:
+            raise ValueError("At least one buffer is required.")
+        self.camera = camera
+        self.policy = policy
+        self.block_timeout = block_timeout / 1000.0
+        self.fmt = camera.current_format()
+        shape = frame_shape(self.fmt, IMAGE_ENCODING_RAW_BAYER)
+        self.frame_size = shape[0] * shape[1]
+        if allocate is None:
+            allocate = lambda slot, size: np.empty(size, np.uint8)
+        self._slots = [allocate(slot, self.frame_size) for slot in range(buffers)]
+        # deque append / popleft are atomic, the semaphores only count.
+        self._free = collections.deque(range(buffers))
+        self._ready = collections.deque()
+        self._free_count = threading.Semaphore(buffers)
+        self._ready_count = threading.Semaphore(0)
+        # Frame being assembled by the callback: [slot, offset, pts, flags]
+        self._filling = None
+        self._skipping = False
+        self.count = 0
+        self.dropped = 0
+        self.running = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.get()
+
+    next = __next__
+
+    def start(self):
+        if not self.running:
+            self.camera.set_raw_callback(self._callback)
+            self.running = True
+        return self
+
+    def stop(self):
+        if self.running:
+            self.running = False
+            self.camera.set_raw_callback(None)
+
+    def qsize(self):
+        return len(self._ready)
+
+    def get(self, timeout = 3000):
+        '''
+        Dequeue the next frame, waiting up to timeout ms (None waits forever).
+        '''
+        wait = None if timeout is None else timeout / 1000.0
+        while self._ready_count.acquire(timeout=wait):
+            try:
+                slot, length, pts, flags = self._ready.popleft()
+            except IndexError:
+                # The producer recycled the frame this count was for.
+                continue
+            return queued_frame(self, slot, length, pts, flags)
+        raise TimeoutError("No frame within {} ms.".format(timeout))
+
+    def _free_slot(self, slot):
+        self._free.append(slot)
+        self._free_count.release()
+
+    def _acquire_slot(self):
+        if self._free_count.acquire(blocking=False):
+            return self._free.popleft()
+        if self.policy == 'block':
+            if self._free_count.acquire(timeout=self.block_timeout):
+                return self._free.popleft()
+        elif self.policy == 'drop_oldest':
+            try:
+                slot, _, _, _ = self._ready.popleft()
+            except IndexError:
+                pass
+            else:
+                self.dropped += 1
+                # The stolen frame's ready count is reused by the next publish.
+                self._ready_count.acquire(blocking=False)
+                return slot
+        self.dropped += 1
+        return None
+
+    def _publish(self):
+        slot, offset, pts, flags = self._filling
+        self._filling = None
+        self._ready.append((slot, offset, pts, flags))
+        self.count += 1
+        self._ready_count.release()
+
+    def _callback(self, buff):
+        buf = buff[0]
+        pts = c_int64(buf.pts).value
+        if pts != MMAL_TIME_UNKNOWN:
+            # A new frame starts, a known pts marks the first part.
+            if self._filling is not None:
+                self._publish()
+            slot = self._acquire_slot()
+            self._skipping = slot is None
+            if slot is not None:
+                self._filling = [slot, 0, pts, buf.flags]
+        if self._skipping or self._filling is None or not buf.length:
+            return 0
+        frame = self._filling
+        length = min(buf.length, self.frame_size - frame[1])
+        memmove(self._slots[frame[0]].ctypes.data + frame[1], buf.data, length)
+        frame[1] += length
+        frame[3] |= buf.flags
+        if frame[1] >= self.frame_size or buf.flags & MMAL_BUFFER_HEADER_FLAG_FRAME_END:
+            self._publish()
+        return 0
 
 class mipi_camera(object):
     
     def __init__(self):
         self.camera_instance = c_void_p(0)
+        self._format = None
+        self._callbacks = {}
 
     def init_camera(self):
         check_status(
@@ -340,6 +732,7 @@ class mipi_camera(object):
             arducam_set_resolution(self.camera_instance, byref(_width), byref(_height)),
             sys._getframe().f_code.co_name
         )
+        self._format = None
         return _width.value, _height.value
 
     def set_mode(self, mode):
@@ -347,6 +740,7 @@ class mipi_camera(object):
             arducam_set_mode(self.camera_instance, mode),
             sys._getframe().f_code.co_name
         )
+        self._format = None
 
     def get_format(self):
         fmt = FORMAT()
@@ -354,7 +748,16 @@ class mipi_camera(object):
             arducam_get_format(self.camera_instance, byref(fmt)),
             sys._getframe().f_code.co_name
         )
-        return fmt.getdict()
+        self._format = fmt.getdict()
+        return dict(self._format)
+
+    def current_format(self):
+        '''
+        Cached get_format(), refreshed after set_mode/set_resolution.
+        '''
+        if self._format is None:
+            self.get_format()
+        return self._format
 
     def start_preview(self, fullscreen = True, opacity = 255, window = None):
         rect = RECTANGLE(0, 0, 640, 480)
@@ -380,30 +783,59 @@ class mipi_camera(object):
         if image_encodings[encoding] == None:
             raise TypeError("Unknown image encoding type.")
         image_format = IMAGE_FORMAT(image_encodings[encoding], quality)
-        return buffer(arducam_capture(self.camera_instance, byref(image_format), time_out))
+        return buffer(arducam_capture(self.camera_instance, byref(image_format), time_out),
+            self.current_format(), image_format.encoding)
+
+    def frames(self, encoding = 'i420', buffers = 3, dtype = np.uint16, time_out = 3000):
+        '''
+        Continuous capture into a ring of preallocated arrays, see frame_stream.
+        '''
+        return frame_stream(self, encoding, buffers, dtype, time_out)
+
+    def raw_stream(self, buffers = 4, policy = 'drop_oldest', block_timeout = 1000, allocate = None):
+        '''
+        Callback driven continuous raw capture, see raw_stream. Start it with
+        start() or a with block:
+            with camera.raw_stream() as stream:
+                for frame in stream:
+                    with frame:
+                        ...
+        '''
+        return raw_stream(self, buffers, policy, block_timeout, allocate)
+
+    def burst(self, file_name, frames = None, seconds = None, **options):
+        '''
+        Record a burst of raw frames, a number of frames or seconds, to a
+        raw container file with a pool of writer threads. Returns the statistics of
+        raw_burst.run(), options are those of raw_burst.
+        '''
+        from raw_burst import raw_burst
+        return raw_burst(self, file_name, frames, seconds, **options).run()
+
+    def _userdata_ref(self, userdata):
+        if userdata is None or isinstance(userdata, py_object):
+            return userdata
+        return py_object(userdata)
 
     def set_raw_callback(self, func = None, userdata = None):
         '''
-        Important:You need to keep a reference to userdata. 
-                  If userdata is released, using userdata in 
-                  the callback function will crash the program.
+        The callback and userdata (any Python object) are referenced by the
+        camera until the callback is replaced or cleared.
         '''
-        if userdata != None and not isinstance(userdata, py_object):
-            raise TypeError("Userdata must be of type py_object")
+        userdata = self._userdata_ref(userdata)
         cfunc = OUTPUT_CALLBACK(func) if func != None else cast(None, OUTPUT_CALLBACK)
         check_status(
             arducam_set_raw_callback(self.camera_instance, cfunc, byref(userdata) if userdata != None else None),
             sys._getframe().f_code.co_name
         )
+        self._callbacks['raw'] = (cfunc, userdata)
 
     def set_video_callback(self, func = None, userdata = None, **kwargs):    
         '''
-        Important:You need to keep a reference to userdata. 
-                  If userdata is released, using userdata in 
-                  the callback function will crash the program.
+        The callback and userdata (any Python object) are referenced by the
+        camera until the callback is replaced or cleared.
         '''
-        if userdata != None and not isinstance(userdata, py_object):
-            raise TypeError("Userdata must be of type py_object")
+        userdata = self._userdata_ref(userdata)
 
         cfunc = OUTPUT_CALLBACK(func) if func != None else cast(None, OUTPUT_CALLBACK)
 
@@ -434,6 +866,7 @@ class mipi_camera(object):
             ),
             sys._getframe().f_code.co_name
         )
+        self._callbacks['video'] = (cfunc, userdata)
 
     def reset_control(self, ctrl_id):
         check_status(
@@ -523,17 +956,14 @@ def unpack_raw10_to_raw16(buff, width, height):
     return buffer(arducam_unpack_raw10_to_raw16(buff[0].data, width, height))
 
 def unpack_mipi_raw10(byte_buf):
-    data = np.frombuffer(byte_buf, dtype=np.uint8)
-    # 5 bytes contain 4 10-bit pixels (5x8 == 4x10)
-    b1, b2, b3, b4, b5 = np.reshape(
-        data, (data.shape[0]//5, 5)).astype(np.uint16).T
-    o1 = (b1 << 2) + ((b5) & 0x3)
-    o2 = (b2 << 2) + ((b5 >> 2) & 0x3)
-    o3 = (b3 << 2) + ((b5 >> 4) & 0x3)
-    o4 = (b4 << 2) + ((b5 >> 6) & 0x3)
-    unpacked = np.reshape(np.concatenate(
-        (o1[:, None], o2[:, None], o3[:, None], o4[:, None]), axis=1),  4*o1.shape[0])
-    return unpacked
+    '''
+    Unpack a line of MIPI RAW10 data to uint16. For whole frames use
+    raw_unpack.raw_unpacker, which also strips the padding and reuses
+    its output array.
+    '''
+    data = np.frombuffer(byte_buf, dtype=np.uint8).reshape(-1)
+    width = data.shape[0] // 5 * 4
+    return unpack_raw(data[:width // 4 * 5], width, 1, 10).reshape(width)
 
 def remove_padding(data, width, height, bit_width):
     buff = np.frombuffer(data, np.uint8)
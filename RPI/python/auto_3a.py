@@ -0,0 +1,37 @@
+import arducam_mipicamera as arducam
+import time
+import numpy as np
+from raw_unpack import raw_unpacker
+from bayer_stats import zone_stats, bayer_3a, center_weights
+
+if __name__ == "__main__":
+    try:
+        camera = arducam.mipi_camera()
+        print("Open camera...")
+        camera.init_camera()
+        print("Setting the resolution...")
+        width, height = camera.set_resolution(1920, 1080)
+        fmt = camera.current_format()
+        bit_width = arducam.pixelformat_bit_width.get(fmt["pixelformat"], 10)
+        order = arducam.pixelformat_bayer_order.get(fmt["pixelformat"]) or 'RGGB'
+        print("Current resolution is {}x{}, {} RAW{}".format(width, height, order, bit_width))
+
+        unpacker = raw_unpacker(width, height, bit_width)
+        raw = unpacker.new_output()
+        # 16x12 zones over every 4th 2x2 cell, statistics never touch RGB
+        stats = zone_stats(width, height, order, zones = (16, 12), decimate = 4, bit_width = bit_width)
+        control = bayer_3a(camera, stats, weights = center_weights(stats.zones))
+
+        with camera.raw_stream(buffers = 4, policy = 'drop_oldest') as stream:
+            start = time.time()
+            for frame in stream:
+                with frame:
+                    unpacker.unpack(frame.view(), raw)
+                r_gain, b_gain, exposure = control.update(raw)
+                print("r_gain: {:.2f}, b_gain: {:.2f}, exposure: {}".format(r_gain, b_gain, exposure))
+                if time.time() - start >= 10:
+                    break
+        print("Close camera...")
+        camera.close_camera()
+    except Exception as e:
+        print(e)
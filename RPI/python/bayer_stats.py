@@ -0,0 +1,180 @@
+'''
+AWB / AE statistics computed directly on the unpacked Bayer plane.
+
+Each of the four Bayer phases is read through a strided view, optionally
+decimated, split into a grid of zones and summed per zone. No RGB image is
+produced, the result is a few hundred zone means per channel:
+
+    stats = zone_stats(1920, 1080, order = 'RGGB', bit_width = 10)
+    control = bayer_3a(camera, stats)
+    raw = unpack_raw(frame, 1920, 1080, 10)
+    control.update(raw)
+
+This module only depends on numpy.
+'''
+import numpy as np
+
+# V4L2_CID_BASE + 17, as the v4l2 module defines it
+V4L2_CID_EXPOSURE = 0x00980911
+
+# Offsets (row, column) of R, Gr, Gb and B in the top-left 2x2 cell
+bayer_phases = {
+    'RGGB' : ((0, 0), (0, 1), (1, 0), (1, 1)),
+    'BGGR' : ((1, 1), (1, 0), (0, 1), (0, 0)),
+    'GRBG' : ((0, 1), (0, 0), (1, 1), (1, 0)),
+    'GBRG' : ((1, 0), (1, 1), (0, 0), (0, 1)),
+}
+
+class zone_stats(object):
+    '''
+    Per-zone channel means of a (height, width) Bayer plane. zones is
+    (columns, rows) of the grid, decimate reads every Nth 2x2 cell in both
+    directions. Rows and columns that do not fill a whole zone are
+    ignored. Results are kept in preallocated arrays:
+
+        means: (4, rows, columns) R, Gr, Gb, B means in [0, 1]
+    '''
+    def __init__(self, width, height, order = 'RGGB', zones = (16, 12), decimate = 1, bit_width = 10):
+        if order not in bayer_phases:
+            raise ValueError("Unsupported Bayer order: {}".format(order))
+        columns, rows = zones
+        self.width = width
+        self.height = height
+        self.order = order
+        self.zones = zones
+        self.decimate = decimate
+        self.white_level = float((1 << bit_width) - 1)
+        plane_h = (height // 2 + decimate - 1) // decimate
+        plane_w = (width // 2 + decimate - 1) // decimate
+        self.zone_height = plane_h // rows
+        self.zone_width = plane_w // columns
+        if self.zone_height == 0 or self.zone_width == 0:
+            raise ValueError("Too many zones for a {}x{} frame.".format(width, height))
+        self._sums = np.zeros((4, rows, columns), np.uint64)
+        self.means = np.zeros((4, rows, columns), np.float64)
+        self._scale = 1.0 / (self.zone_height * self.zone_width * self.white_level)
+        self._luma = np.zeros((rows, columns), np.float64)
+        self._valid = np.zeros((rows, columns), np.bool_)
+        self._tmp = np.zeros((rows, columns), np.bool_)
+
+    def _zones(self, raw, phase):
+        step = 2 * self.decimate
+        columns, rows = self.zones
+        plane = raw[phase[0]::step, phase[1]::step]
+        plane = plane[:rows * self.zone_height, :columns * self.zone_width]
+        # Splitting the axes of a strided view does not copy
+        return plane.reshape(rows, self.zone_height, columns, self.zone_width)
+
+    def __call__(self, raw):
+        '''
+        Accumulate the statistics of an unpacked (height, width) uint8 or
+        uint16 Bayer plane. Returns self.
+        '''
+        if raw.shape[0] < self.height or raw.shape[1] < self.width:
+            raise ValueError("Expected a Bayer plane of at least {}x{}.".format(self.width, self.height))
+        for channel, phase in enumerate(bayer_phases[self.order]):
+            np.sum(self._zones(raw, phase), axis=(1, 3), dtype=np.uint64, out=self._sums[channel])
+        np.multiply(self._sums, self._scale, out=self.means)
+        return self
+
+    @property
+    def r(self):
+        return self.means[0]
+
+    @property
+    def g(self):
+        return (self.means[1] + self.means[2]) * 0.5
+
+    @property
+    def b(self):
+        return self.means[3]
+
+    def luma(self):
+        '''
+        (rows, columns) zone luminance, BT.601 weights on the channel means.
+        '''
+        np.multiply(self.means[0], 0.299, out=self._luma)
+        self._luma += (self.means[1] + self.means[2]) * (0.587 / 2)
+        self._luma += self.means[3] * 0.114
+        return self._luma
+
+    def awb_gains(self, low = 0.02, high = 0.9):
+        '''
+        Grey world (r_gain, b_gain) that bring R and B to the G level.
+        Zones with any channel below low or above high (dark or clipped)
+        are left out, all zones are used if none is left.
+        '''
+        np.greater_equal(self.means.min(axis=0), low, out=self._valid)
+        np.less_equal(self.means.max(axis=0), high, out=self._tmp)
+        np.logical_and(self._valid, self._tmp, out=self._valid)
+        if not self._valid.any():
+            self._valid[...] = True
+        r = self.r[self._valid].sum()
+        g = self.g[self._valid].sum()
+        b = self.b[self._valid].sum()
+        if r <= 0 or b <= 0:
+            return 1.0, 1.0
+        return float(g / r), float(g / b)
+
+    def exposure_ratio(self, target = 0.18, weights = None):
+        '''
+        Factor to apply to the exposure to bring the (weighted) mean
+        luminance to target.
+        '''
+        luma = self.luma()
+        if weights is None:
+            level = luma.mean()
+        else:
+            level = (luma * weights).sum() / weights.sum()
+        return target / max(float(level), 1.0 / self.white_level)
+
+def center_weights(zones, strength = 2.0):
+    '''
+    (rows, columns) center-weighted metering mask for exposure_ratio().
+    '''
+    columns, rows = zones
+    y = np.linspace(-1, 1, rows)[:, None]
+    x = np.linspace(-1, 1, columns)[None, :]
+    return 1.0 + (strength - 1.0) * np.clip(1.0 - np.sqrt(x * x + y * y), 0, 1)
+
+class bayer_3a(object):
+    '''
+    Drives the camera's AWB compensation and exposure from zone_stats.
+    Gains are passed to manual_set_awb_compensation() in units of
+    awb_unit (100 is 1.0x), the exposure control is moved towards the
+    target by at most max_step per update, damped by speed.
+    '''
+    def __init__(self, camera, stats, target = 0.18, speed = 0.5, max_step = 2.0,
+            exposure_range = (1, 65535), awb_unit = 100, weights = None):
+        self.camera = camera
+        self.stats = stats
+        self.target = target
+        self.speed = speed
+        self.max_step = max_step
+        self.exposure_range = exposure_range
+        self.awb_unit = awb_unit
+        self.weights = weights
+        self.gains = (1.0, 1.0)
+        self.exposure = None
+
+    def update(self, raw):
+        '''
+        Compute the statistics of raw and apply new AWB gains and exposure.
+        Returns (r_gain, b_gain, exposure).
+        '''
+        self.stats(raw)
+        r_gain, b_gain = self.stats.awb_gains()
+        self.gains = (r_gain, b_gain)
+        self.camera.manual_set_awb_compensation(
+            int(round(r_gain * self.awb_unit)), int(round(b_gain * self.awb_unit)))
+
+        if self.exposure is None:
+            self.exposure = self.camera.get_control(V4L2_CID_EXPOSURE)
+        ratio = self.stats.exposure_ratio(self.target, self.weights)
+        ratio = min(max(ratio, 1.0 / self.max_step), self.max_step) ** self.speed
+        exposure = int(round(self.exposure * ratio))
+        exposure = min(max(exposure, self.exposure_range[0]), self.exposure_range[1])
+        if exposure != self.exposure:
+            self.camera.set_control(V4L2_CID_EXPOSURE, exposure)
+            self.exposure = exposure
+        return r_gain, b_gain, exposure
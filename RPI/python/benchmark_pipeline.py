@@ -0,0 +1,227 @@
+'''
+Per-stage latency benchmark of the RAW capture pipeline:
+
+    capture -> padding -> unpack -> demosaic -> isp -> resize -> output
+
+Every stage is timed separately for every frame and reported as
+p50/p95/p99 plus a log2 histogram of the latencies. --json writes the same
+numbers for diffing between releases, --baseline compares a run against
+an earlier JSON file.
+
+python3 benchmark_pipeline.py [--sim] [--frames N] [--width W --height H]
+                              [--output encode|display|none] [--json FILE]
+                              [--baseline FILE]
+
+--sim runs against the simulated camera (sim_camera.py), without it the
+real libarducam_mipicamera.so is used. The isp stage needs ../ISP/libisp_lib.so
+and is skipped where it cannot be loaded.
+'''
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import numpy as np
+import cv2
+import arducam_mipicamera as arducam
+from raw_unpack import raw_unpacker
+from raw_pipeline import bayer_codes
+
+STAGES = ["capture", "padding", "unpack", "demosaic", "isp", "resize", "output", "total"]
+
+class latency_recorder(object):
+    '''
+    Latencies of one stage, kept in a preallocated array so recording
+    does not allocate inside the timed loop.
+    '''
+    def __init__(self, capacity):
+        self.samples = np.zeros(capacity, np.float64)
+        self.count = 0
+
+    def record(self, seconds):
+        if self.count < self.samples.size:
+            self.samples[self.count] = seconds
+            self.count += 1
+
+    def summary(self):
+        '''
+        Statistics in milliseconds and a histogram of log2(microseconds)
+        buckets, {"<upper bound us>": count}.
+        '''
+        if self.count == 0:
+            return None
+        ms = self.samples[:self.count] * 1000
+        p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+        us = np.maximum(self.samples[:self.count] * 1e6, 1)
+        buckets = np.ceil(np.log2(us)).astype(np.int64)
+        histogram = dict(("{}".format(1 << int(bucket)), int(count))
+            for bucket, count in zip(*np.unique(buckets, return_counts=True)))
+        return {
+            "count": self.count,
+            "mean": round(float(ms.mean()), 4),
+            "min": round(float(ms.min()), 4),
+            "max": round(float(ms.max()), 4),
+            "p50": round(float(p50), 4),
+            "p95": round(float(p95), 4),
+            "p99": round(float(p99), 4),
+            "histogram_us": histogram,
+        }
+
+def load_isp(camera, sim = False):
+    '''
+    ISP stage of ../ISP/isp_lib.py, None when libisp_lib.so is not usable
+    on this machine or the camera is simulated (the library would use its
+    handle as a real camera).
+    '''
+    if sim:
+        print("ISP stage skipped: simulated camera")
+        return None
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ISP'))
+    try:
+        import isp_lib
+        return isp_lib.isp(camera.camera_instance)
+    except (OSError, ImportError) as e:
+        print("ISP stage skipped: {}".format(e))
+        return None
+
+def run(camera, args):
+    fmt = camera.current_format()
+    width, height = fmt["width"], fmt["height"]
+    bit_width = arducam.pixelformat_bit_width.get(fmt["pixelformat"], 10)
+    code = bayer_codes.get(arducam.pixelformat_bayer_order.get(fmt["pixelformat"]))
+
+    unpacker = raw_unpacker(width, height, bit_width, np.uint8)
+    packed = np.empty((height, width * bit_width // 8), np.uint8)
+    gray = unpacker.new_output()
+    bgr = np.empty((height, width, 3), np.uint8)
+    preview = np.empty((args.preview_height, args.preview_width, 3), np.uint8)
+    isp = load_isp(camera, args.sim) if args.isp else None
+    window = "Arducam"
+
+    stats = dict((stage, latency_recorder(args.frames)) for stage in STAGES)
+    clock = time.perf_counter
+    for i in range(args.warmup + args.frames):
+        record = i >= args.warmup
+        start = clock()
+        frame = camera.capture(encoding = 'raw')
+        t_capture = clock()
+        # Copy the visible lines out of the aligned MMAL buffer
+        np.copyto(packed, frame.view(crop = True))
+        frame.release()
+        t_padding = clock()
+        unpacker.unpack(packed, gray)
+        t_unpack = clock()
+        if code is not None:
+            cv2.cvtColor(gray, code, dst = bgr)
+        else:
+            cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR, dst = bgr)
+        t_demosaic = clock()
+        if isp is not None:
+            isp.run_awb(bgr)
+            isp.run_ae(bgr)
+        t_isp = clock()
+        cv2.resize(bgr, (args.preview_width, args.preview_height), dst = preview,
+            interpolation = cv2.INTER_AREA)
+        t_resize = clock()
+        if args.output == 'encode':
+            cv2.imencode(".jpg", preview)
+        elif args.output == 'display':
+            cv2.imshow(window, preview)
+            cv2.waitKey(1)
+        end = clock()
+        if not record:
+            continue
+        stats["capture"].record(t_capture - start)
+        stats["padding"].record(t_padding - t_capture)
+        stats["unpack"].record(t_unpack - t_padding)
+        stats["demosaic"].record(t_demosaic - t_unpack)
+        if isp is not None:
+            stats["isp"].record(t_isp - t_demosaic)
+        stats["resize"].record(t_resize - t_isp)
+        if args.output != 'none':
+            stats["output"].record(end - t_resize)
+        stats["total"].record(end - start)
+
+    if args.output == 'display':
+        cv2.destroyWindow(window)
+    return {
+        "meta": {
+            "backend": "sim" if args.sim else "hardware",
+            "width": width,
+            "height": height,
+            "bit_width": bit_width,
+            "frames": args.frames,
+            "warmup": args.warmup,
+            "preview": [args.preview_width, args.preview_height],
+            "output": args.output,
+            "machine": platform.machine(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "stages": dict((stage, stats[stage].summary()) for stage in STAGES),
+    }
+
+def print_report(report, baseline = None):
+    meta = report["meta"]
+    print("{} {}x{} RAW{}, {} frames".format(meta["backend"], meta["width"],
+        meta["height"], meta["bit_width"], meta["frames"]))
+    header = "{:>10} {:>9} {:>9} {:>9} {:>9}".format("stage", "p50 (ms)", "p95 (ms)", "p99 (ms)", "max (ms)")
+    if baseline is not None:
+        header += " {:>10}".format("p50 delta")
+    print(header)
+    for stage in STAGES:
+        summary = report["stages"][stage]
+        if summary is None:
+            print("{:>10} {:>9}".format(stage, "skipped"))
+            continue
+        line = "{:>10} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f}".format(
+            stage, summary["p50"], summary["p95"], summary["p99"], summary["max"])
+        old = baseline["stages"].get(stage) if baseline is not None else None
+        if old:
+            line += " {:>+9.1f}%".format((summary["p50"] / old["p50"] - 1) * 100 if old["p50"] else 0)
+        print(line)
+    if report["stages"]["total"] is not None:
+        print("fps: {:.1f}".format(1000.0 / report["stages"]["total"]["mean"]))
+
+def process_arguments():
+    parser = argparse.ArgumentParser(description="Per-stage RAW pipeline benchmark.")
+    parser.add_argument('--sim', action='store_true', help="use the simulated camera")
+    parser.add_argument('--mode', type=int, help="camera mode, see list_format")
+    parser.add_argument('--width', default=1920, type=int, help="capture width")
+    parser.add_argument('--height', default=1080, type=int, help="capture height")
+    parser.add_argument('--frames', default=200, type=int, help="measured frames")
+    parser.add_argument('--warmup', default=10, type=int, help="frames run before measuring")
+    parser.add_argument('--preview-width', default=640, type=int)
+    parser.add_argument('--preview-height', default=360, type=int)
+    parser.add_argument('--output', default='encode', choices=['encode', 'display', 'none'])
+    parser.add_argument('--no-isp', dest='isp', action='store_false', help="skip the isp stage")
+    parser.add_argument('--json', help="write the report to this file")
+    parser.add_argument('--baseline', help="report of an earlier run to compare against")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = process_arguments()
+    if args.sim:
+        arducam.load_library("sim")
+    camera = arducam.mipi_camera()
+    camera.init_camera()
+    if args.mode is not None:
+        camera.set_mode(args.mode)
+    else:
+        camera.set_resolution(args.width, args.height)
+    try:
+        report = run(camera, args)
+    finally:
+        camera.close_camera()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
@@ -0,0 +1,52 @@
+'''
+Compare the tiled raw_pipeline against the serial whole-frame path on
+synthetic frames, and check that both produce the same output. Cases
+with a smaller output size also time binned_preview, which bins in the
+Bayer domain instead of demosaicing the full frame.
+
+python3 benchmark_raw_pipeline.py [--repeat N] [--threads N] [--band-rows N]
+'''
+import argparse
+import numpy as np
+from raw_unpack import pack_raw
+from raw_pipeline import raw_pipeline, binned_preview
+from benchmark_unpack import best_of
+
+CASES = [
+    # width, height, output size
+    (1920, 1080, None),
+    (2672, 2004, (668, 501)),
+    (2672, 2004, (640, 480)),
+    (4056, 3040, (1014, 760)),
+]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tiled RAW pipeline benchmark.")
+    parser.add_argument('--repeat', default=10, type=int, help="runs per case, the best is reported")
+    parser.add_argument('--threads', default=4, type=int, help="worker threads of the tiled run")
+    parser.add_argument('--band-rows', default=64, type=int, help="rows per band")
+    args = parser.parse_args()
+
+    print("{:>10} {:>10} {:>12} {:>14} {:>14} {:>8} {:>12}".format(
+        "resolution", "output", "serial (ms)", "tiled 1t (ms)",
+        "tiled {}t (ms)".format(args.threads), "speedup", "binned (ms)"))
+    for width, height, out_size in CASES:
+        image = np.random.randint(0, 1024, (height, width), dtype=np.uint16)
+        data = pack_raw(image, 10)
+        single = raw_pipeline(width, height, 10, out_size = out_size, threads = 1, band_rows = args.band_rows)
+        tiled = raw_pipeline(width, height, 10, out_size = out_size, threads = args.threads, band_rows = args.band_rows)
+        if not np.array_equal(tiled.process(data), single.process_serial(data)):
+            raise RuntimeError("Tiled output differs from the serial path")
+
+        serial = best_of(lambda: single.process_serial(data), args.repeat)
+        one = best_of(lambda: single.process(data), args.repeat)
+        many = best_of(lambda: tiled.process(data), args.repeat)
+        tiled.close()
+        binned = "-"
+        if out_size is not None:
+            factor = max(2, width // out_size[0] // 2 * 2)
+            preview = binned_preview(width, height, 10, factor = factor, out_size = out_size)
+            binned = "{:.2f}".format(best_of(lambda: preview.process(data), args.repeat))
+        print("{:>10} {:>10} {:>12.2f} {:>14.2f} {:>14.2f} {:>7.1f}x {:>12}".format(
+            "{}x{}".format(width, height), "{}x{}".format(*out_size) if out_size else "-",
+            serial, one, many, serial / many, binned))
@@ -0,0 +1,89 @@
+'''
+Compare raw_unpacker against the previous remove_padding + unpack_mipi_raw10
+path and the imx230_postProcess remove_padding on synthetic RAW10 frames.
+
+python3 benchmark_unpack.py [--repeat N]
+'''
+import argparse
+import time
+import numpy as np
+from raw_unpack import raw_unpacker, packed_stride, align_up
+
+RESOLUTIONS = [(1920, 1080), (2672, 2004), (5344, 4012)]
+
+def legacy_unpack_mipi_raw10(byte_buf):
+    data = np.frombuffer(byte_buf, dtype=np.uint8)
+    # 5 bytes contain 4 10-bit pixels (5x8 == 4x10)
+    b1, b2, b3, b4, b5 = np.reshape(
+        data, (data.shape[0]//5, 5)).astype(np.uint16).T
+    o1 = (b1 << 2) + ((b5) & 0x3)
+    o2 = (b2 << 2) + ((b5 >> 2) & 0x3)
+    o3 = (b3 << 2) + ((b5 >> 4) & 0x3)
+    o4 = (b4 << 2) + ((b5 >> 6) & 0x3)
+    unpacked = np.reshape(np.concatenate(
+        (o1[:, None], o2[:, None], o3[:, None], o4[:, None]), axis=1),  4*o1.shape[0])
+    return unpacked
+
+def legacy_remove_padding(data, width, height, bit_width):
+    buff = np.frombuffer(data, np.uint8)
+    real_width = width // 8 * bit_width
+    align_width = align_up(real_width, 32)
+    align_height = align_up(height, 16)
+
+    buff = buff.reshape(align_height, align_width)
+    buff = buff[:height, :real_width]
+    buff = buff.reshape(height * real_width)
+    return buff
+
+def legacy_postprocess_remove_padding(data, width, height, bit_width):
+    buff = np.frombuffer(data, np.uint8)
+    real_width = int(width / 8 * bit_width)
+    align_width = align_up(real_width, 32)
+    align_height = align_up(height, 16)
+    buff = buff.reshape(align_height, align_width)
+    buff = buff[:height, :real_width]
+    buff = buff.reshape(height, real_width)
+    buff = buff.astype(np.uint16) << 2
+    # now convert to real 10 bit camera signal
+    for byte in range(4):
+        buff[:, byte::5] |= ((buff[:, 4::5] >> ((4 - byte) * 2)) & 0b11)
+    # delete the unused pix
+    buff = np.delete(buff, np.s_[4::5], 1)
+    return buff
+
+def best_of(func, repeat):
+    func()
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RAW10 unpack benchmark.")
+    parser.add_argument('--repeat', default=10, type=int, help="runs per case, the best is reported")
+    args = parser.parse_args()
+
+    print("{:>10} {:>14} {:>14} {:>14} {:>14} {:>8}".format(
+        "resolution", "legacy (ms)", "postProc (ms)", "raw16 (ms)", "raw8 (ms)", "speedup"))
+    for width, height in RESOLUTIONS:
+        size = align_up(height, 16) * packed_stride(width, 10)
+        data = np.random.randint(0, 256, size, dtype=np.uint8).tobytes()
+
+        unpacker16 = raw_unpacker(width, height, 10)
+        unpacker8 = raw_unpacker(width, height, 10, np.uint8)
+        out16 = unpacker16.new_output()
+        out8 = unpacker8.new_output()
+
+        expected = legacy_unpack_mipi_raw10(legacy_remove_padding(data, width, height, 10))
+        if not np.array_equal(unpacker16.unpack(data, out16).reshape(-1), expected):
+            raise RuntimeError("raw_unpacker output differs from unpack_mipi_raw10")
+
+        legacy = best_of(lambda: legacy_unpack_mipi_raw10(
+            legacy_remove_padding(data, width, height, 10)), args.repeat)
+        post = best_of(lambda: legacy_postprocess_remove_padding(data, width, height, 10), args.repeat)
+        raw16 = best_of(lambda: unpacker16.unpack(data, out16), args.repeat)
+        raw8 = best_of(lambda: unpacker8.unpack(data, out8), args.repeat)
+        print("{:>10} {:>14.2f} {:>14.2f} {:>14.2f} {:>14.2f} {:>7.1f}x".format(
+            "{}x{}".format(width, height), legacy, post, raw16, raw8, legacy / raw16))
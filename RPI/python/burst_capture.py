@@ -0,0 +1,33 @@
+import argparse
+import arducam_mipicamera as arducam
+
+def process_arguments():
+    parser = argparse.ArgumentParser(description="Record a raw burst to a raw container file.")
+    parser.add_argument('-o', '--output', default="burst.araw", help="output file")
+    parser.add_argument('--width', default=1920, type=int)
+    parser.add_argument('--height', default=1080, type=int)
+    parser.add_argument('--frames', type=int, help="frames to record")
+    parser.add_argument('--seconds', default=5, type=float, help="seconds to record")
+    parser.add_argument('--buffers', default=8, type=int, help="frames in flight")
+    parser.add_argument('--writers', default=2, type=int, help="writer threads")
+    parser.add_argument('--direct', action='store_true', help="write with O_DIRECT")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = process_arguments()
+    try:
+        camera = arducam.mipi_camera()
+        print("Open camera...")
+        camera.init_camera()
+        print("Setting the resolution...")
+        fmt = camera.set_resolution(args.width, args.height)
+        print("Current resolution is {}".format(fmt))
+        stats = camera.burst(args.output, args.frames, None if args.frames else args.seconds,
+            buffers = args.buffers, writers = args.writers, direct = args.direct)
+        print("{} frames in {:.2f} s, {:.1f} fps, {:.1f} MB/s, dropped: {}{}".format(
+            stats["frames"], stats["seconds"], stats["fps"], stats["mb_per_s"], stats["dropped"],
+            "" if stats["direct"] or not args.direct else " (O_DIRECT not supported)"))
+        print("Close camera...")
+        camera.close_camera()
+    except Exception as e:
+        print(e)
@@ -34,17 +34,14 @@ if __name__ == "__main__":
         fmt = camera.set_resolution(1920, 1080)
         print("Current resolution is {}".format(fmt))
         set_controls(camera)
-        while cv2.waitKey(10) != 27:
-            frame = camera.capture(encoding = 'i420')
-            height = int(align_up(fmt[1], 16))
-            width = int(align_up(fmt[0], 32))
-            image = frame.as_array.reshape(int(height * 1.5), width)
-            image = cv2.cvtColor(image, cv2.COLOR_YUV2BGR_I420)
+        frames = camera.frames(encoding = 'i420')
+        for image in frames:
+            if frames.last_dropped:
+                print("Dropped {} frames.".format(frames.last_dropped))
             cv2.imshow("Arducam", image)
+            if cv2.waitKey(10) == 27:
+                break
 
-
-        # Release memory
-        del frame
         print("Close camera...")
         camera.close_camera()
     except Exception as e:
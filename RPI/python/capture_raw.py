@@ -1,6 +1,7 @@
 import arducam_mipicamera as arducam
 import v4l2 #sudo pip install v4l2
 import time
+from raw_container import raw_writer, raw_reader
 
 def set_controls(camera):
     try:
@@ -18,11 +19,22 @@ def set_controls(camera):
     except Exception as e:
         print(e)
 
+def read_controls(camera):
+    controls = {}
+    for ctrl_id in (v4l2.V4L2_CID_EXPOSURE, v4l2.V4L2_CID_GAIN):
+        try:
+            controls[ctrl_id] = camera.get_control(ctrl_id)
+        except Exception:
+            pass
+    return controls
+
 if __name__ == "__main__":
     try:
         camera = arducam.mipi_camera()
         print("Open camera...")
         camera.init_camera()
+        # Both captures also go to one self-describing container
+        writer = raw_writer("capture.araw")
         print("Setting the resolution...")
         fmt = camera.set_resolution(1920, 1080)
         print("Current resolution is {}".format(fmt))
@@ -32,6 +44,7 @@ if __name__ == "__main__":
         time.sleep(1)
         frame = camera.capture(encoding = 'raw')
         frame.as_array.tofile("{}x{}.raw".format(fmt[0],fmt[1]))
+        writer.write_frame(frame, controls = read_controls(camera))
 
         print("Setting the resolution...")
         fmt = camera.set_resolution(3280, 2464)
@@ -40,9 +53,15 @@ if __name__ == "__main__":
         print("Current resolution is {}".format(fmt))
         frame = camera.capture(encoding = 'raw')
         frame.as_array.tofile("{}x{}.raw".format(fmt[0],fmt[1]))
+        writer.write_frame(frame, controls = read_controls(camera))
 
         # Release memory
         del frame
+        writer.close()
+        # Read the container back
+        for frame in raw_reader("capture.araw"):
+            print("Frame {}: {}x{}, {} bytes, pts {}".format(frame.index, frame.width, frame.height,
+                frame.data.nbytes, "unknown" if frame.pts == arducam.MMAL_TIME_UNKNOWN else frame.pts))
         # print("Stop preview...")
         # camera.stop_preview()
         print("Close camera...")
@@ -38,19 +38,13 @@ if __name__ == "__main__":
         # camera.start_preview(fullscreen = False, window = (0, 0, 1280, 720))
         set_controls(camera)
         time.sleep(1)
-        while cv2.waitKey(10) != 27:
-            frame = camera.capture(encoding = 'raw')
-            #height = fmt[1]
-            #width  = fmt[0]
-            frame = arducam.remove_padding(frame.data, width, height, 10)
-            frame = arducam.unpack_mipi_raw10(frame)
-            frame = frame.reshape(height, width) << 6
-            image = frame
+        for image in camera.frames(encoding = 'raw'):
+            np.left_shift(image, 6, out=image)
             #image = cv2.cvtColor(frame, cv2.COLOR_YUV2BGR_I420)
             cv2.imshow("Arducam", image)
+            if cv2.waitKey(10) == 27:
+                break
 
-        # Release memory
-        del frame
         # print("Stop preview...")
         # camera.stop_preview()
         print("Close camera...")
@@ -0,0 +1,105 @@
+'''
+Lens shading correction on unpacked Bayer frames with precomputed
+fixed-point gain maps.
+
+Lens tables hold a coarse (rows, columns, 4) grid of R, Gr, Gb, B gains
+in 3.5 fixed point (32 is 1.0x). gain_map() resizes them once to the
+frame size and interleaves them into a single Bayer-ordered uint16 map,
+lens_shading applies it in place with integer arithmetic:
+
+    cache = lens_shading_cache({1: './lens_table/imx230/2672x2004.npy'}, cache_dir = '/tmp/lsc')
+    lsc = cache.get(1, 2672, 2004)
+    lsc.apply(raw)
+
+Gain maps written to cache_dir are memory mapped on the next get(), so
+switching modes does not resize the tables again.
+'''
+import os
+import numpy as np
+import cv2
+
+FRAC_BITS = 5
+
+def gain_map(table, width, height):
+    '''
+    (height, width) uint16 gain map in FRAC_BITS fixed point, the table
+    channels interleaved in R, Gr / Gb, B Bayer order.
+    '''
+    gain = np.empty((height, width), np.uint16)
+    for channel, (row, column) in enumerate(((0, 0), (0, 1), (1, 0), (1, 1))):
+        plane = cv2.resize(np.ascontiguousarray(table[:, :, channel]).astype(np.uint8),
+            (width // 2, height // 2), interpolation=cv2.INTER_LINEAR)
+        gain[row::2, column::2] = plane
+    return gain
+
+class lens_shading(object):
+    '''
+    Applies a gain map in place: pixel = min(pixel * gain >> FRAC_BITS,
+    white level). The product is formed in a uint32 scratch of block_rows
+    lines, so nothing else is allocated per frame and the scratch stays in
+    cache. Results match the float path of multiplying by gain / 32 and
+    truncating.
+    '''
+    def __init__(self, gain, bit_width = 10, block_rows = 64):
+        self.gain = gain
+        self.height, self.width = gain.shape
+        self.white_level = (1 << bit_width) - 1
+        self.block_rows = min(block_rows, self.height)
+        self._tmp = np.empty((self.block_rows, self.width), np.uint32)
+
+    def apply(self, raw):
+        if raw.shape != (self.height, self.width) or raw.dtype != np.uint16:
+            raise ValueError("Expected a uint16 frame of shape {}.".format((self.height, self.width)))
+        for start in range(0, self.height, self.block_rows):
+            end = min(start + self.block_rows, self.height)
+            tmp = self._tmp[:end - start]
+            np.multiply(raw[start:end], self.gain[start:end], out=tmp, dtype=np.uint32)
+            np.right_shift(tmp, FRAC_BITS, out=tmp)
+            np.minimum(tmp, self.white_level, out=tmp)
+            np.copyto(raw[start:end], tmp, casting='unsafe')
+        return raw
+
+class lens_shading_cache(object):
+    '''
+    lens_shading objects per (mode, width, height). tables maps a mode to
+    the .npy lens table of that mode. With cache_dir set, gain maps are
+    stored there as .npy files and loaded memory mapped afterwards.
+    '''
+    def __init__(self, tables, cache_dir = None, bit_width = 10):
+        self.tables = tables
+        self.cache_dir = cache_dir
+        self.bit_width = bit_width
+        self._cache = {}
+
+    def _path(self, mode, width, height):
+        name = os.path.splitext(os.path.basename(self.tables[mode]))[0]
+        return os.path.join(self.cache_dir, "{}_mode{}_{}x{}.gain.npy".format(name, mode, width, height))
+
+    def load(self, mode, width, height):
+        '''
+        Gain map of the mode, from cache_dir when present, otherwise
+        computed from the lens table (and saved to cache_dir).
+        '''
+        path = self._path(mode, width, height) if self.cache_dir is not None else None
+        if path is not None and os.path.exists(path) \
+                and os.path.getmtime(path) >= os.path.getmtime(self.tables[mode]):
+            gain = np.load(path, mmap_mode='r')
+            if gain.shape == (height, width) and gain.dtype == np.uint16:
+                return gain
+        gain = gain_map(np.load(self.tables[mode]), width, height)
+        if path is not None:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                np.save(f, gain)
+            os.rename(tmp, path)
+        return gain
+
+    def get(self, mode, width, height):
+        key = (mode, width, height)
+        lsc = self._cache.get(key)
+        if lsc is None:
+            lsc = lens_shading(self.load(mode, width, height), self.bit_width)
+            self._cache[key] = lsc
+        return lsc
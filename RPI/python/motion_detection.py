@@ -0,0 +1,35 @@
+import arducam_mipicamera as arducam
+import time
+from motion_vectors import motion_detector, motion_vector_stream
+from video_recorder import preroll_buffer, video_demux
+
+if __name__ == "__main__":
+    try:
+        camera = arducam.mipi_camera()
+        print("Open camera...")
+        camera.init_camera()
+        print("Setting the resolution...")
+        fmt = camera.set_resolution(1920, 1080)
+        print("Current resolution is {}".format(fmt))
+        camera.software_auto_exposure(enable = True)
+        camera.software_auto_white_balance(enable = True)
+        # Motion vectors come from the encoder, no frame differencing on the CPU.
+        vectors = motion_vector_stream(fmt[0], fmt[1],
+            detector = motion_detector(fmt[0], fmt[1], magnitude = 2, blocks = 20))
+        preroll = preroll_buffer(None, seconds = 3)
+        with video_demux(camera, sinks = [preroll], side_info = [vectors], intraperiod = 30):
+            clips = 0
+            end = time.time() + 60
+            while time.time() < end:
+                if not vectors.wait_motion(1000):
+                    continue
+                print("Motion detected ({} blocks), recording...".format(vectors.detector.moving))
+                preroll.trigger("motion_{:03d}.h264".format(clips))
+                while vectors.wait_motion(3000):
+                    time.sleep(1)
+                preroll.end_clip()
+                clips += 1
+        print("Close camera...")
+        camera.close_camera()
+    except Exception as e:
+        print(e)
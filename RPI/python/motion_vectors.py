@@ -0,0 +1,129 @@
+'''
+Motion vectors from the H.264 encoder's inline side-info output.
+
+With inlineMotionVectors enabled the encoder emits, after every frame, a
+buffer flagged MMAL_BUFFER_HEADER_FLAG_CODECSIDEINFO holding one 4 byte
+record per 16x16 macroblock: signed dx, signed dy (pixels) and the uint16
+sum of absolute differences. Each row has one extra macroblock column.
+
+    vectors = motion_vector_stream(1920, 1080, detector = motion_detector(1920, 1080))
+    demux = video_demux(camera, sinks = [recorder], side_info = [vectors])
+    demux.start()
+    if vectors.wait_motion(1000):
+        ...
+
+This module only depends on numpy.
+'''
+from ctypes import memmove
+import collections
+import threading
+import numpy as np
+
+MMAL_TIME_UNKNOWN = -(1 << 63)
+
+motion_dtype = np.dtype([
+    ('x', 'i1'),
+    ('y', 'i1'),
+    ('sad', '<u2'),
+])
+
+def motion_vector_shape(width, height):
+    '''
+    (rows, columns) of the side-info array, including the extra column.
+    '''
+    return ((height + 15) // 16, (width + 15) // 16 + 1)
+
+class motion_detector(object):
+    '''
+    Flags motion when at least `blocks` macroblocks move by `magnitude`
+    pixels or more. Blocks whose SAD is above max_sad (a poor match, often
+    noise or a lighting change) are ignored when max_sad is set.
+    Scratch arrays are allocated once, calling the detector does not
+    allocate.
+    '''
+    def __init__(self, width, height, magnitude = 2, blocks = 10, max_sad = None):
+        rows, cols = motion_vector_shape(width, height)
+        shape = (rows, cols - 1)
+        self.magnitude = magnitude
+        self.blocks = blocks
+        self.max_sad = max_sad
+        self._mag = np.empty(shape, np.int32)
+        self._tmp = np.empty(shape, np.int32)
+        self._mask = np.empty(shape, np.bool_)
+        self._sad = np.empty(shape, np.bool_)
+        self.moving = 0
+
+    def __call__(self, vectors):
+        '''
+        Number of moving macroblocks is kept in `moving`, returns whether it
+        reaches `blocks`.
+        '''
+        mv = vectors[:, :-1]
+        np.multiply(mv['x'], mv['x'], out=self._mag, dtype=np.int32)
+        np.multiply(mv['y'], mv['y'], out=self._tmp, dtype=np.int32)
+        np.add(self._mag, self._tmp, out=self._mag)
+        np.greater_equal(self._mag, self.magnitude * self.magnitude, out=self._mask)
+        if self.max_sad is not None:
+            np.less_equal(mv['sad'], self.max_sad, out=self._sad)
+            np.logical_and(self._mask, self._sad, out=self._mask)
+        self.moving = int(np.count_nonzero(self._mask))
+        return self.moving >= self.blocks
+
+class motion_vector_stream(object):
+    '''
+    video_demux side-info sink. Each side-info buffer is copied into a
+    small ring of preallocated (rows, columns) motion_dtype arrays and run
+    through `detector` if one is given. get() returns the latest vectors,
+    wait_motion() blocks until the detector fires.
+    '''
+    def __init__(self, width, height, detector = None, buffers = 3):
+        self.shape = motion_vector_shape(width, height)
+        self.size = self.shape[0] * self.shape[1] * motion_dtype.itemsize
+        self.detector = detector
+        self._ring = [np.zeros(self.shape, motion_dtype) for _ in range(buffers)]
+        self._index = 0
+        self._latest = None
+        self._cond = threading.Condition()
+        self.motion_event = threading.Event()
+        self.motion = False
+        self.frames = 0
+        self.malformed = 0
+        self.pts = MMAL_TIME_UNKNOWN
+
+    def feed(self, data, length, flags, pts = MMAL_TIME_UNKNOWN):
+        if length != self.size:
+            self.malformed += 1
+            return
+        slot = self._index
+        vectors = self._ring[slot]
+        memmove(vectors.ctypes.data, data, length)
+        motion = self.detector(vectors) if self.detector is not None else False
+        with self._cond:
+            self._latest = slot
+            self._index = (slot + 1) % len(self._ring)
+            self.pts = pts
+            self.motion = motion
+            self.frames += 1
+            self._cond.notify_all()
+        if motion:
+            self.motion_event.set()
+        else:
+            self.motion_event.clear()
+
+    def get(self, out = None, timeout = None):
+        '''
+        Copy of the latest motion vectors, waiting up to timeout ms for the
+        first frame. Returns None on timeout.
+        '''
+        with self._cond:
+            if self._latest is None:
+                self._cond.wait(None if timeout is None else timeout / 1000.0)
+            if self._latest is None:
+                return None
+            if out is None:
+                out = np.empty(self.shape, motion_dtype)
+            np.copyto(out, self._ring[self._latest])
+            return out
+
+    def wait_motion(self, timeout = None):
+        return self.motion_event.wait(None if timeout is None else timeout / 1000.0)
@@ -0,0 +1,208 @@
+'''
+High-rate raw burst capture to a raw container file.
+
+The stream's ring slots live inside page aligned record buffers, each one
+page of frame header followed by the payload, so a frame goes from the
+camera callback to the disk without another copy. The capture thread
+only fills in the header and hands the record to a pool of writer
+threads, which write it with os.pwrite at an offset fixed up front and
+then recycle the slot. With direct = True the file is opened with
+O_DIRECT to bypass the page cache (file systems that refuse it fall back
+to buffered writes), and the file is preallocated for the expected size.
+
+    with raw_burst(camera, "burst.araw", seconds = 5, writers = 2, direct = True) as burst:
+        stats = burst.run()
+    print(stats["mb_per_s"], stats["dropped"])
+
+or camera.burst("burst.araw", frames = 100). The result is a regular
+raw container with page alignment, read it with raw_container.raw_reader.
+Frames that arrive while every buffer is queued for writing are dropped
+and counted, the disk bandwidth shows up as the drop count.
+'''
+import errno
+import mmap
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from arducam_mipicamera import IMAGE_ENCODING_RAW_BAYER, align_up
+from raw_container import pack_file_header, pack_frame_header, pack_index, frame_layout
+
+PAGE = mmap.PAGESIZE
+
+def _page_buffer(data):
+    '''
+    data copied to a page aligned buffer of whole pages.
+    '''
+    page = mmap.mmap(-1, align_up(len(data), PAGE))
+    page[:len(data)] = data
+    return page
+
+def _collect(futures, wait = False):
+    '''
+    Raise the first writer error, returns the writes still running.
+    '''
+    running = []
+    for f in futures:
+        if wait or f.done():
+            f.result()
+        else:
+            running.append(f)
+    return running
+
+class raw_burst(object):
+    '''
+    frames / seconds: stop after that many frames or seconds, whichever
+    comes first. buffers: ring slots, frames in flight between camera and
+    disk. writers: writer threads. controls: {control id: value} stored
+    with every frame.
+    '''
+    def __init__(self, camera, file_name, frames = None, seconds = None, buffers = 8,
+            writers = 2, direct = False, preallocate = True, controls = None):
+        if frames is None and seconds is None:
+            raise ValueError("Give the number of frames or seconds to record.")
+        self.camera = camera
+        self.file_name = file_name
+        self.frames = frames
+        self.seconds = seconds
+        self.buffers = buffers
+        self.writers = writers
+        self.direct = direct
+        self.preallocate = preallocate
+        self.controls = controls
+        self._records = []
+        self._fd = None
+        self.stream = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _allocate(self, slot, size):
+        # Anonymous maps are page aligned, as O_DIRECT requires
+        record = mmap.mmap(-1, PAGE + align_up(size, PAGE))
+        self._records.append(record)
+        return np.frombuffer(record, np.uint8, size, PAGE)
+
+    def _open(self):
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+        if self.direct and hasattr(os, "O_DIRECT"):
+            try:
+                return os.open(self.file_name, flags | os.O_DIRECT, 0o644)
+            except OSError as e:
+                if e.errno != errno.EINVAL:
+                    raise
+        self.direct = False
+        return os.open(self.file_name, flags, 0o644)
+
+    def _expected_frames(self, fmt):
+        frames = self.frames
+        if self.seconds is not None:
+            interval = fmt.get("frameintervals", {})
+            if interval.get("numerator"):
+                fps = interval["denominator"] / float(interval["numerator"])
+                estimate = int(self.seconds * fps) + 1
+                frames = estimate if frames is None else min(frames, estimate)
+        return frames
+
+    def _write(self, record, offset, length):
+        view = memoryview(record)[:length]
+        while length:
+            written = os.pwrite(self._fd, view, offset)
+            view = view[written:]
+            offset += written
+            length -= written
+
+    def _write_frame(self, frame, offset, length):
+        try:
+            self._write(self._records[frame.slot], offset, length)
+        finally:
+            frame.release()
+
+    def run(self):
+        '''
+        Record the burst, returns the statistics of stats().
+        '''
+        self.stream = self.camera.raw_stream(self.buffers, 'drop_newest', allocate = self._allocate)
+        fmt = self.stream.fmt
+        self._fd = self._open()
+        os.pwrite(self._fd, _page_buffer(pack_file_header(PAGE)), 0)
+        expected = self._expected_frames(fmt)
+        if self.preallocate and expected and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(self._fd, 0,
+                    PAGE + expected * (PAGE + align_up(self.stream.frame_size, PAGE)))
+            except OSError:
+                pass
+
+        offsets = []
+        pending = []
+        offset = PAGE
+        self.bytes = 0
+        pool = ThreadPoolExecutor(self.writers)
+        self.stream.start()
+        self.start = time.time()
+        deadline = self.start + self.seconds if self.seconds is not None else None
+        try:
+            while self.frames is None or len(offsets) < self.frames:
+                if deadline is not None and time.time() >= deadline:
+                    break
+                frame = self.stream.get()
+                rows, stride = frame_layout(fmt, IMAGE_ENCODING_RAW_BAYER, frame.length)
+                header = pack_frame_header(len(offsets), offset, fmt, IMAGE_ENCODING_RAW_BAYER,
+                    rows, stride, frame.length, frame.pts, frame.flags, self.controls, PAGE)
+                if len(header) != PAGE:
+                    frame.release()
+                    raise ValueError("Frame header does not fit in one page.")
+                record = self._records[frame.slot]
+                record[:PAGE] = header
+                length = PAGE + align_up(frame.length, PAGE)
+                pending.append(pool.submit(self._write_frame, frame, offset, length))
+                offsets.append(offset)
+                offset += length
+                self.bytes += frame.length
+                if len(pending) > 2 * self.buffers:
+                    pending = _collect(pending)
+        finally:
+            self.stream.stop()
+            pool.shutdown()
+            self.elapsed = time.time() - self.start
+        _collect(pending, wait = True)
+        self.count = len(offsets)
+        self.dropped = self.stream.dropped
+
+        # The index is not page sized, it goes through the page cache
+        with open(self.file_name, "r+b") as f:
+            f.seek(offset)
+            f.write(pack_index(offsets, offset))
+            f.truncate()
+        os.close(self._fd)
+        self._fd = None
+        return self.stats()
+
+    def stats(self):
+        elapsed = max(self.elapsed, 1e-9)
+        return {
+            "frames": self.count,
+            "dropped": self.dropped,
+            "bytes": self.bytes,
+            "seconds": self.elapsed,
+            "mb_per_s": self.bytes / elapsed / 1e6,
+            "fps": self.count / elapsed,
+            "direct": self.direct,
+        }
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self.stream = None
+        for record in self._records:
+            try:
+                record.close()
+            except BufferError:
+                pass
+        self._records = []
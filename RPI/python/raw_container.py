@@ -0,0 +1,273 @@
+'''
+Self-describing container for raw capture bursts.
+
+Every frame is stored with its format (mode, width, height, pixelformat,
+encoding), stride, bit depth, Bayer order, pts, flags and control values,
+followed by the payload as the camera delivered it. Frame headers and
+payloads start on `align` byte boundaries, 64 by default and the page
+size for O_DIRECT writers (see raw_burst.py). close() appends an index
+of frame offsets, so a reader can seek to frame N in O(1); files that
+were not closed are scanned instead.
+
+    with raw_writer("burst.araw") as writer:
+        for frame in stream:
+            with frame:
+                writer.write_frame(frame, fmt, controls = {V4L2_CID_EXPOSURE: 1000})
+
+    reader = raw_reader("burst.araw")
+    frame = reader[10]
+    image = frame.unpack()
+
+Readers memory map the file, frame data are zero-copy views into it.
+
+Layout, little-endian:
+    file header     'ARAW', version, alignment (= file header size)
+    frame           'AFRM' frame header, (id, value) controls, padding, payload
+    ...
+    index           uint64 offset of every frame
+    trailer         'AIDX', frame count, index offset
+'''
+import mmap
+import struct
+import numpy as np
+from arducam_mipicamera import IMAGE_ENCODING_RAW_BAYER, \
+    MMAL_TIME_UNKNOWN, pixelformat_bit_width, pixelformat_bayer_order, \
+    frame_shape, align_up
+from raw_unpack import unpack_raw
+
+VERSION = 1
+ALIGN = 64
+
+_file_header = struct.Struct('<4sHH')
+_frame_header = struct.Struct('<4sIIiiiIIIIB4s3xIqQH6x')
+_control = struct.Struct('<Ii')
+_trailer = struct.Struct('<4sIQ')
+
+def pack_file_header(align = ALIGN):
+    header = _file_header.pack(b'ARAW', VERSION, align)
+    return header + b'\0' * (align - len(header))
+
+def frame_layout(fmt, encoding, size):
+    '''
+    (rows, stride) of a size byte payload, (0, 0) when unknown.
+    '''
+    shape = frame_shape(fmt, encoding)
+    if shape is not None and shape[0] * shape[1] == size:
+        return shape
+    if encoding == IMAGE_ENCODING_RAW_BAYER:
+        stride = fmt["width"] * pixelformat_bit_width.get(fmt["pixelformat"], 10) // 8
+        if size % stride == 0:
+            return size // stride, stride
+    return 0, 0
+
+def pack_frame_header(index, offset, fmt, encoding, rows, stride, size,
+        pts = MMAL_TIME_UNKNOWN, flags = 0, controls = None, align = ALIGN):
+    '''
+    Header of a frame starting at file offset, padded so that the payload
+    starts on an align boundary.
+    '''
+    controls = sorted((controls or {}).items())
+    order = pixelformat_bayer_order.get(fmt["pixelformat"])
+    fixed = _frame_header.size + _control.size * len(controls)
+    header_size = align_up(offset + fixed, align) - offset
+    header = _frame_header.pack(b'AFRM', header_size, index,
+        fmt.get("mode", -1), fmt["width"], fmt["height"], fmt["pixelformat"], encoding,
+        stride, rows, pixelformat_bit_width.get(fmt["pixelformat"], 10),
+        order.encode() if order else b'', flags, pts, size, len(controls))
+    header += b''.join(_control.pack(ctrl_id, value) for ctrl_id, value in controls)
+    return header + b'\0' * (header_size - len(header))
+
+def pack_index(offsets, index_offset):
+    '''
+    Index and trailer, written at index_offset after the last frame.
+    '''
+    return np.array(offsets, '<u8').tobytes() + _trailer.pack(b'AIDX', len(offsets), index_offset)
+
+class raw_frame(object):
+    '''
+    One frame of a raw_reader. data is the payload as a uint8 view into
+    the mapped file, shaped (rows, stride) when the layout is known.
+    '''
+    def __init__(self, fields, controls, data):
+        (self.index, self.mode, self.width, self.height, self.pixelformat, self.encoding,
+            self.stride, self.rows, self.bit_width, order, self.flags, self.pts) = fields
+        self.order = order.decode() if order.strip(b'\0') else None
+        self.controls = controls
+        if self.rows * self.stride == data.size and self.stride:
+            data = data.reshape(self.rows, self.stride)
+        self.data = data
+
+    @property
+    def fmt(self):
+        '''
+        The frame format as mipi_camera.get_format() reports it.
+        '''
+        return {"mode": self.mode, "width": self.width, "height": self.height,
+            "pixelformat": self.pixelformat}
+
+    def view(self, crop = False):
+        '''
+        The payload; crop = True returns the visible packed raw lines only.
+        '''
+        if crop and self.encoding == IMAGE_ENCODING_RAW_BAYER and self.data.ndim == 2:
+            return self.data[:self.height, :self.width * self.bit_width // 8]
+        return self.data
+
+    def unpack(self, out = None, dtype = np.uint16):
+        if self.encoding != IMAGE_ENCODING_RAW_BAYER:
+            raise ValueError("Only raw frames can be unpacked.")
+        return unpack_raw(self.data, self.width, self.height, self.bit_width, out, dtype)
+
+class raw_writer(object):
+    '''
+    Appends frames to a new container file. Payloads are written straight
+    from the caller's array, without an intermediate copy when it is
+    contiguous.
+    '''
+    def __init__(self, file_name, align = ALIGN):
+        self.file_name = file_name
+        self.align = align
+        self._file = open(file_name, "wb")
+        self._offsets = []
+        self._file.write(pack_file_header(align))
+        self._offset = align
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def write(self, data, fmt, encoding = IMAGE_ENCODING_RAW_BAYER, pts = MMAL_TIME_UNKNOWN,
+            controls = None, flags = 0):
+        '''
+        Append one frame. data: ndarray or bytes-like payload, padded as
+        the camera delivers it (buffer.view()) or not. fmt: the dict of
+        mipi_camera.get_format(). controls: {control id: value}.
+        '''
+        if isinstance(data, np.ndarray):
+            if data.ndim == 2 and data.dtype == np.uint8:
+                layout = data.shape
+            else:
+                layout = None
+            data = np.ascontiguousarray(data)
+        else:
+            data = np.frombuffer(data, np.uint8)
+            layout = None
+        size = data.nbytes
+        rows, stride = layout if layout is not None else frame_layout(fmt, encoding, size)
+        header = pack_frame_header(len(self._offsets), self._offset, fmt, encoding,
+            rows, stride, size, pts, flags, controls, self.align)
+        self._file.write(header)
+        self._file.write(memoryview(data).cast('B'))
+        padding = align_up(size, self.align) - size
+        if padding:
+            self._file.write(b'\0' * padding)
+        self._offsets.append(self._offset)
+        self._offset += len(header) + size + padding
+
+    def write_frame(self, frame, fmt = None, controls = None):
+        '''
+        Append a mipi_camera buffer or raw_stream frame with its pts and
+        flags. fmt defaults to the format the frame was captured with.
+        '''
+        if fmt is None:
+            fmt = frame.fmt if hasattr(frame, "fmt") else frame.stream.fmt
+        encoding = getattr(frame, "encoding", IMAGE_ENCODING_RAW_BAYER)
+        self.write(frame.view(), fmt, encoding, frame.pts, controls, frame.flags)
+
+    def close(self):
+        if self._file is None:
+            return
+        self._file.write(pack_index(self._offsets, self._offset))
+        self._file.close()
+        self._file = None
+
+class raw_reader(object):
+    '''
+    Memory mapped container reader. reader[n] returns raw_frame n, the
+    reader iterates over all frames.
+    '''
+    def __init__(self, file_name):
+        self.file_name = file_name
+        with open(file_name, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffer = np.frombuffer(self._mmap, np.uint8)
+        magic, version, self.align = _file_header.unpack_from(self._mmap, 0)
+        if magic != b'ARAW':
+            raise ValueError("{} is not a raw container.".format(file_name))
+        if version > VERSION:
+            raise ValueError("Unsupported container version {}.".format(version))
+        self.offsets = self._read_index()
+        if self.offsets is None:
+            self.offsets = self._scan()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _read_index(self):
+        size = len(self._mmap)
+        if size < self.align + _trailer.size:
+            return None
+        magic, count, offset = _trailer.unpack_from(self._mmap, size - _trailer.size)
+        if magic != b'AIDX' or offset + count * 8 + _trailer.size != size:
+            return None
+        return np.frombuffer(self._mmap, '<u8', count, offset)
+
+    def _scan(self):
+        '''
+        Offsets of the complete frames of a file without index.
+        '''
+        offsets = []
+        offset = self.align
+        size = len(self._mmap)
+        while offset + _frame_header.size <= size:
+            fields = _frame_header.unpack_from(self._mmap, offset)
+            if fields[0] != b'AFRM':
+                break
+            end = offset + fields[1] + align_up(fields[14], self.align)
+            if offset + fields[1] + fields[14] > size:
+                break
+            offsets.append(offset)
+            offset = end
+        return np.array(offsets, np.uint64)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.offsets)
+        if not 0 <= index < len(self.offsets):
+            raise IndexError("Frame index out of range.")
+        offset = int(self.offsets[index])
+        fields = _frame_header.unpack_from(self._mmap, offset)
+        header_size, size, count = fields[1], fields[14], fields[15]
+        controls = dict(_control.unpack_from(self._mmap, offset + _frame_header.size + i * _control.size)
+            for i in range(count))
+        start = offset + header_size
+        return raw_frame(fields[2:14], controls, self._buffer[start:start + size])
+
+    def __iter__(self):
+        for i in range(len(self.offsets)):
+            yield self[i]
+
+    def close(self):
+        '''
+        Unmap the file. Frames still referenced keep the mapping alive
+        until they are gone.
+        '''
+        self._buffer = None
+        self.offsets = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
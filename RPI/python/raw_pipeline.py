@@ -0,0 +1,217 @@
+'''
+Tiled, multi-threaded RAW processing:
+
+    unpack -> lens shading -> demosaic -> shift to 8 bit -> resize
+
+The frame is split into horizontal bands that are processed start to
+finish by a thread pool while they are still in cache. NumPy and OpenCV
+release the GIL inside their loops, so the bands run in parallel on the
+4 cores of a Pi or Jetson. Each band also unpacks and demosaics a few rows
+above and below it, so the output is bit-identical to processing the
+whole frame:
+
+    pipeline = raw_pipeline(2672, 2004, 10, 'RGGB', lsc = lsc, out_size = (668, 501))
+    bgr = pipeline.process(frame.view())
+
+Scratch and output buffers are allocated once. process() returns the
+same output array for every frame.
+'''
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+from raw_unpack import raw_unpacker, packed_view
+from lens_shading import lens_shading
+from bayer_stats import bayer_phases
+
+# OpenCV names Bayer conversions after the second row, RGGB sensors are BG.
+bayer_codes = {
+    'RGGB' : cv2.COLOR_BayerBG2BGR,
+    'BGGR' : cv2.COLOR_BayerRG2BGR,
+    'GBRG' : cv2.COLOR_BayerGR2BGR,
+    'GRBG' : cv2.COLOR_BayerGB2BGR,
+}
+
+# Rows read beyond each band edge for demosaic, even to keep the Bayer phase
+OVERLAP = 2
+
+class _band(object):
+    '''
+    Rows [start, end) of the frame, read as [top, bottom) with the
+    overlap. Every band has its own unpacker, shading and scratch, so bands
+    never share temporaries.
+    '''
+    def __init__(self, pipeline, start, end):
+        self.start = start
+        self.end = end
+        self.top = max(start - OVERLAP, 0)
+        self.bottom = min(end + OVERLAP, pipeline.height)
+        rows = self.bottom - self.top
+        self.unpacker = raw_unpacker(pipeline.width, rows, pipeline.bit_width)
+        self.lsc = None
+        if pipeline.lsc is not None:
+            self.lsc = lens_shading(pipeline.lsc.gain[self.top:self.bottom], pipeline.bit_width)
+        self.raw = self.unpacker.new_output()
+        self.bgr = np.empty((rows, pipeline.width, 3), np.uint16)
+
+class raw_pipeline(object):
+    '''
+    width, height, bit_width: the packed input frames. order: Bayer
+    order, None for monochrome. lsc: optional lens_shading of the full
+    frame. out_size: (width, height) of the output, resized with
+    INTER_AREA; integer downscales are done per band, others on the whole
+    8 bit frame. band_rows: rows per band, rounded to keep the Bayer
+    phase and the resize blocks aligned.
+    '''
+    def __init__(self, width, height, bit_width = 10, order = 'RGGB', lsc = None,
+            out_size = None, threads = 4, band_rows = 64):
+        self.width = width
+        self.height = height
+        self.bit_width = bit_width
+        self.code = bayer_codes[order] if order is not None else cv2.COLOR_GRAY2BGR
+        self.shift = bit_width - 8
+        self.lsc = lsc
+        self.out_size = out_size
+        self.bgr = np.empty((height, width, 3), np.uint8)
+
+        align = 2
+        self.factor = None
+        if out_size is not None and out_size != (width, height):
+            fx, fy = width // out_size[0], height // out_size[1]
+            if fx * out_size[0] == width and fy * out_size[1] == height:
+                self.factor = fy
+                align = align * fy // np.gcd(align, fy)
+            self.out = np.empty((out_size[1], out_size[0], 3), np.uint8)
+        else:
+            self.out = self.bgr
+        band_rows = max(align, band_rows // align * align)
+        self.bands = [_band(self, start, min(start + band_rows, height))
+            for start in range(0, height, band_rows)]
+        self.threads = threads
+        self._pool = ThreadPoolExecutor(threads) if threads > 1 else None
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _run(self, band):
+        '''
+        All stages for one band, its rows stay in cache from unpack to
+        resize.
+        '''
+        band.unpacker.unpack(self._packed[band.top:band.bottom], band.raw)
+        if band.lsc is not None:
+            band.lsc.apply(band.raw)
+        cv2.cvtColor(band.raw, self.code, dst = band.bgr)
+        inner = band.bgr[band.start - band.top:band.end - band.top]
+        np.right_shift(inner, self.shift, out = self.bgr[band.start:band.end], casting = 'unsafe')
+        if self.factor is not None:
+            f = self.factor
+            cv2.resize(self.bgr[band.start:band.end], (self.out_size[0], (band.end - band.start) // f),
+                dst = self.out[band.start // f:band.end // f], interpolation = cv2.INTER_AREA)
+
+
+    def process(self, data):
+        '''
+        Process one packed frame (bytes, flat array or the padded 2-D
+        buffer view) and return the 8 bit BGR output.
+        '''
+        self._packed = packed_view(data, self.width, self.height, self.bit_width)
+        if self._pool is None:
+            for band in self.bands:
+                self._run(band)
+        else:
+            for _ in self._pool.map(self._run, self.bands):
+                pass
+        self._packed = None
+        if self.out_size is not None and self.factor is None:
+            cv2.resize(self.bgr, self.out_size, dst = self.out, interpolation = cv2.INTER_AREA)
+        return self.out
+
+    def process_serial(self, data):
+        '''
+        The same stages on the whole frame, one after the other. Reference
+        for process().
+        '''
+        raw = raw_unpacker(self.width, self.height, self.bit_width).unpack(data)
+        if self.lsc is not None:
+            self.lsc.apply(raw)
+        bgr = cv2.cvtColor(raw, self.code)
+        bgr = (bgr >> self.shift).astype(np.uint8)
+        if self.out_size is not None and self.out_size != (self.width, self.height):
+            bgr = cv2.resize(bgr, self.out_size, interpolation = cv2.INTER_AREA)
+        return bgr
+
+class binned_preview(object):
+    '''
+    Preview that bins in the Bayer domain before any colour conversion.
+    Every 2x2 Bayer cell becomes one BGR pixel (R, mean of both greens, B)
+    from the 8 most significant bits, factor 4, 8 ... then averages 2x2,
+    4x4 ... of those cells with INTER_AREA. Nothing is demosaiced or kept
+    at 16 bit full resolution, use raw_pipeline for stills.
+
+        preview = binned_preview(4056, 3040, 10, 'RGGB', factor = 4)
+        bgr = preview.process(frame.view())     # 1014x760
+
+    process() also accepts unpacked (height, width) uint16 frames holding
+    bit_width values. out_size resizes the binned image once more.
+    '''
+    def __init__(self, width, height, bit_width = 10, order = 'RGGB', factor = 2, out_size = None):
+        if factor < 2 or factor % 2:
+            raise ValueError("Binning factor must be an even number.")
+        self.width = width
+        self.height = height
+        self.bit_width = bit_width
+        self.phases = bayer_phases[order] if order is not None else None
+        self.half = (width // 2, height // 2)
+        self.size = (width // factor, height // factor)
+        self.out_size = out_size
+        self._unpacker = raw_unpacker(width, height, bit_width, np.uint8)
+        self._gray = self._unpacker.new_output()
+        if self.phases is not None:
+            self._planes = [np.empty((height // 2, width // 2), np.uint8) for _ in range(4)]
+            self._half = np.empty((height // 2, width // 2, 3), np.uint8)
+        else:
+            self._binned_gray = np.empty((self.size[1], self.size[0]), np.uint8)
+        self._binned = np.empty((self.size[1], self.size[0], 3), np.uint8)
+        self.out = self._binned
+        if out_size is not None and tuple(out_size) != self.size:
+            self.out = np.empty((out_size[1], out_size[0], 3), np.uint8)
+
+    def _planes_of(self, data):
+        '''
+        Split the frame into its four Bayer phases, 8 bit each.
+        '''
+        unpacked = isinstance(data, np.ndarray) and data.dtype == np.uint16
+        if unpacked:
+            src = data[:self.height, :self.width]
+        else:
+            # The 8 bit unpack only loads the MSB bytes, one pass
+            src = self._unpacker.unpack(data, self._gray)
+        for plane, (row, column) in zip(self._planes, self.phases):
+            if unpacked:
+                np.right_shift(src[row::2, column::2], self.bit_width - 8, out = plane, casting = 'unsafe')
+            else:
+                np.copyto(plane, src[row::2, column::2])
+        return self._planes
+
+    def process(self, data):
+        if self.phases is None:
+            if isinstance(data, np.ndarray) and data.dtype == np.uint16:
+                np.right_shift(data[:self.height, :self.width], self.bit_width - 8,
+                    out = self._gray, casting = 'unsafe')
+            else:
+                self._unpacker.unpack(data, self._gray)
+            cv2.resize(self._gray, self.size, dst = self._binned_gray, interpolation = cv2.INTER_AREA)
+            cv2.cvtColor(self._binned_gray, cv2.COLOR_GRAY2BGR, dst = self._binned)
+        else:
+            r, gr, gb, b = self._planes_of(data)
+            cv2.addWeighted(gr, 0.5, gb, 0.5, 0, dst = gr)
+            if self.size == self.half:
+                cv2.merge((b, gr, r), dst = self._binned)
+            else:
+                cv2.merge((b, gr, r), dst = self._half)
+                cv2.resize(self._half, self.size, dst = self._binned, interpolation = cv2.INTER_AREA)
+        if self.out is not self._binned:
+            cv2.resize(self._binned, tuple(self.out_size), dst = self.out, interpolation = cv2.INTER_AREA)
+        return self.out
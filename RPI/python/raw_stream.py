@@ -0,0 +1,29 @@
+import arducam_mipicamera as arducam
+import time
+
+if __name__ == "__main__":
+    try:
+        camera = arducam.mipi_camera()
+        print("Open camera...")
+        camera.init_camera()
+        print("Setting the resolution...")
+        fmt = camera.set_resolution(1920, 1080)
+        print("Current resolution is {}".format(fmt))
+        with camera.raw_stream(buffers = 4, policy = 'drop_oldest') as stream:
+            start = last = time.time()
+            for frame in stream:
+                with frame:
+                    image = frame.view(crop = True)
+                    mean = image.mean()
+                    del image
+                now = time.time()
+                if now - last >= 1:
+                    last = now
+                    print("fps: {:.1f}, dropped: {}, mean: {:.1f}".format(
+                        stream.count / (now - start), stream.dropped, mean))
+                if now - start >= 10:
+                    break
+        print("Close camera...")
+        camera.close_camera()
+    except Exception as e:
+        print(e)
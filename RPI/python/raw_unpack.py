@@ -0,0 +1,171 @@
+'''
+Unpacking of MIPI CSI-2 packed raw frames (RAW8/RAW10/RAW12).
+
+The unpacker writes straight into a caller supplied output array and strips
+the 32 byte stride / 16 line alignment padding in the same pass, so a capture
+loop can reuse one output array for every frame:
+
+    unpacker = raw_unpacker(width, height, 10)
+    image = unpacker.new_output()
+    while True:
+        with camera.capture(encoding = 'raw') as frame:
+            unpacker.unpack(frame.view(), image)
+
+This module only depends on numpy, it can be used to post-process raw files
+on machines without libarducam_mipicamera.so.
+'''
+import numpy as np
+
+def align_down(size, align):
+    return (size & ~((align)-1))
+
+def align_up(size, align):
+    return align_down(size + align - 1, align)
+
+# pixels, bytes per packed group, lane type holding one group of pixels,
+# (shift, mask) steps spreading the MSB bytes into 16-bit lanes and the
+# multiplier / mask moving each pixel's low bits into its lane.
+_packing = {
+    8 : (1, 1, None, (), 0, 0),
+    10 : (4, 5, np.uint64,
+        ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF)),
+        1 | (1 << 14) | (1 << 28) | (1 << 42), 0x0003000300030003),
+    12 : (2, 3, np.uint32,
+        ((8, 0x00FF00FF),),
+        1 | (1 << 12), 0x000F000F),
+}
+
+def packed_stride(width, bit_width):
+    return align_up(width * bit_width // 8, 32)
+
+def packed_view(data, width, height, bit_width, stride = None):
+    '''
+    Strided (height, width * bit_width / 8) view of the visible packed bytes.
+    data may be bytes, a 1-D array or the 2-D padded array returned by
+    buffer.view(). Nothing is copied.
+    '''
+    real_width = width * bit_width // 8
+    src = data if isinstance(data, np.ndarray) else np.frombuffer(data, np.uint8)
+    if src.ndim == 2:
+        return src[:height, :real_width]
+    if stride is None:
+        stride = packed_stride(width, bit_width)
+        if src.size < stride * height:
+            # Padding was already removed (e.g. remove_padding output).
+            stride = real_width
+    if src.size < stride * height:
+        raise ValueError("Buffer too small for {}x{} RAW{}.".format(width, height, bit_width))
+    return src[:stride * height].reshape(height, stride)[:, :real_width]
+
+class raw_unpacker(object):
+    '''
+    Unpacks RAW8/RAW10/RAW12 frames of a fixed size into uint16 (full bit
+    depth) or uint8 (the 8 most significant bits) arrays. Scratch memory is
+    allocated once, unpack() itself does not allocate.
+
+    Each packed group is loaded as one little-endian word and widened with
+    shift/mask steps over whole rows, so every numpy loop runs over long
+    contiguous lines instead of 4 or 5 byte strided columns.
+    '''
+    def __init__(self, width, height, bit_width = 10, dtype = np.uint16):
+        if bit_width not in _packing:
+            raise ValueError("Unsupported bit width: {}".format(bit_width))
+        pixels, group, lane, _, _, _ = _packing[bit_width]
+        if width % pixels != 0:
+            raise ValueError("Width must be a multiple of {} for RAW{}.".format(pixels, bit_width))
+        if np.dtype(dtype) not in (np.dtype(np.uint8), np.dtype(np.uint16)):
+            raise TypeError("Output dtype must be uint8 or uint16.")
+        self.width = width
+        self.height = height
+        self.bit_width = bit_width
+        self.dtype = np.dtype(dtype)
+        self._tmp = self._low = None
+        if self.dtype == np.uint16 and bit_width != 8:
+            self._tmp = np.empty((height, width // pixels), lane)
+            self._low = np.empty((height, width // pixels), lane)
+
+    def new_output(self):
+        return np.empty((self.height, self.width), self.dtype)
+
+    def unpack(self, data, out = None, stride = None):
+        src = packed_view(data, self.width, self.height, self.bit_width, stride)
+        if out is None:
+            out = self.new_output()
+        elif out.shape != (self.height, self.width) or out.dtype != self.dtype \
+                or not out.flags.c_contiguous:
+            raise ValueError("Expected contiguous {} output of shape {}.".format(
+                self.dtype, (self.height, self.width)))
+
+        if self.bit_width == 8:
+            np.copyto(out, src, casting='unsafe')
+            return out
+
+        pixels, group, lane, spread, low_mul, low_mask = _packing[self.bit_width]
+        packed = src.reshape(self.height, self.width // pixels, group)
+        # Unaligned little-endian load of the leading MSB bytes of every group
+        msb = packed[:, :, :pixels].view('<u{}'.format(pixels))[:, :, 0]
+        if self.dtype == np.uint8:
+            np.copyto(out.view(msb.dtype), msb)
+            return out
+
+        # Output lanes, little-endian hosts only (Pi, Jetson, x86)
+        dst = out.view(lane)
+        tmp = self._tmp
+        low = self._low
+        np.copyto(dst, msb, casting='unsafe')
+        for shift, mask in spread:
+            np.left_shift(dst, shift, out=tmp)
+            np.bitwise_or(dst, tmp, out=dst)
+            np.bitwise_and(dst, lane(mask), out=dst)
+        np.left_shift(dst, self.bit_width - 8, out=dst)
+        np.copyto(low, packed[:, :, pixels], casting='unsafe')
+        np.multiply(low, lane(low_mul), out=low)
+        np.bitwise_and(low, lane(low_mask), out=low)
+        np.bitwise_or(dst, low, out=dst)
+        return out
+
+_unpackers = {}
+
+def unpack_raw(data, width, height, bit_width = 10, out = None, dtype = np.uint16, stride = None):
+    '''
+    Functional form of raw_unpacker.unpack(), unpackers are cached per
+    (width, height, bit_width, dtype).
+    '''
+    if out is not None:
+        dtype = out.dtype
+    key = (width, height, bit_width, np.dtype(dtype))
+    unpacker = _unpackers.get(key)
+    if unpacker is None:
+        unpacker = _unpackers[key] = raw_unpacker(width, height, bit_width, dtype)
+    return unpacker.unpack(data, out, stride)
+
+def pack_raw(image, bit_width = 10, out = None):
+    '''
+    Inverse of raw_unpacker.unpack(): packs a (height, width) array of
+    bit_width values into the padded MIPI CSI-2 layout the camera delivers,
+    (align_up(height, 16), packed_stride(width, bit_width)) bytes.
+    Used to synthesize and re-encode raw frames, not on the capture path.
+    '''
+    if bit_width not in _packing:
+        raise ValueError("Unsupported bit width: {}".format(bit_width))
+    height, width = image.shape
+    pixels, group, _, _, _, _ = _packing[bit_width]
+    if width % pixels != 0:
+        raise ValueError("Width must be a multiple of {} for RAW{}.".format(pixels, bit_width))
+    shape = (align_up(height, 16), packed_stride(width, bit_width))
+    if out is None:
+        out = np.zeros(shape, np.uint8)
+    elif out.shape != shape or out.dtype != np.uint8:
+        raise ValueError("Expected uint8 output of shape {}.".format(shape))
+    packed = out[:height, :width * bit_width // 8].reshape(height, width // pixels, group)
+    pix = image.astype(np.uint16).reshape(height, width // pixels, pixels)
+    if bit_width == 8:
+        packed[:, :, 0] = pix[:, :, 0]
+        return out
+    low_bits = bit_width - 8
+    packed[:, :, :pixels] = pix >> low_bits
+    low = np.zeros((height, width // pixels), np.uint16)
+    for i in range(pixels):
+        low |= (pix[:, :, i] & ((1 << low_bits) - 1)) << (i * low_bits)
+    packed[:, :, pixels] = low
+    return out
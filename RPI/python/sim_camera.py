@@ -0,0 +1,503 @@
+'''
+Simulated libarducam_mipicamera for machines without a camera.
+
+sim_library implements the library's C API in Python on the same ctypes
+structures, so mipi_camera and everything built on it run unchanged:
+
+    import arducam_mipicamera as arducam
+    from sim_camera import sim_library
+    arducam.set_library(sim_library(modes = [(1920, 1080, 30)]))
+
+or, for an unmodified script:
+
+    ARDUCAM_MIPICAMERA_LIB=sim python3 capture2opencv.py
+
+Frames are synthesized Bayer test patterns, or replayed captures: raw and
+i420 files of concatenated buffer.as_array dumps, and .h264 streams.
+Buffers have the exact padded layout of the real ones (rows aligned to
+16, line stride to 32 bytes), and frames are paced at the mode's frame
+interval unless realtime = False.
+'''
+from ctypes import *
+import os
+import threading
+import time
+import numpy as np
+import arducam_mipicamera as arducam
+from raw_unpack import pack_raw, raw_unpacker
+
+def _target(arg):
+    '''
+    The ctypes object behind a byref() or pointer() argument.
+    '''
+    if arg is None:
+        return None
+    obj = getattr(arg, '_obj', None)
+    return obj if obj is not None else arg.contents
+
+_bars = np.array([
+    (1.0, 1.0, 1.0), (1.0, 1.0, 0.0), (0.0, 1.0, 1.0), (0.0, 1.0, 0.0),
+    (1.0, 0.0, 1.0), (1.0, 0.0, 0.0), (0.0, 0.0, 1.0), (0.0, 0.0, 0.0),
+], np.float32) * 0.75
+
+class pattern_source(object):
+    '''
+    Colour bars with a white bar moving right by width / frames pixels per
+    frame. The `frames` distinct frames are built once per layout.
+    '''
+    def __init__(self, frames = 16):
+        self.frames = frames
+        self._cache = {}
+
+    def rgb(self, width, height, index):
+        x = np.arange(width)
+        image = np.empty((height, width, 3), np.float32)
+        image[:] = _bars[x * len(_bars) // width]
+        bar = index % self.frames * width // self.frames
+        image[:, bar:bar + max(width // 32, 2)] = 1.0
+        return image
+
+    def frame(self, fmt, encoding, index):
+        key = (fmt["width"], fmt["height"], fmt["pixelformat"], encoding, index % self.frames)
+        data = self._cache.get(key)
+        if data is None:
+            rgb = self.rgb(fmt["width"], fmt["height"], index)
+            if encoding == arducam.IMAGE_ENCODING_I420:
+                data = self._i420(rgb, fmt)
+            else:
+                data = self._raw(rgb, fmt)
+            self._cache[key] = data
+        return data
+
+    def _raw(self, rgb, fmt):
+        bit_width = arducam.pixelformat_bit_width.get(fmt["pixelformat"], 10)
+        order = arducam.pixelformat_bayer_order.get(fmt["pixelformat"], 'RGGB')
+        if order is None:
+            plane = rgb.dot(np.array((0.299, 0.587, 0.114), np.float32))
+        else:
+            channel = {'R': 0, 'G': 1, 'B': 2}
+            plane = np.empty(rgb.shape[:2], np.float32)
+            for i, c in enumerate(order):
+                dy, dx = divmod(i, 2)
+                plane[dy::2, dx::2] = rgb[dy::2, dx::2, channel[c]]
+        image = (plane * ((1 << bit_width) - 1)).astype(np.uint16)
+        return pack_raw(image, bit_width).reshape(-1)
+
+    def _i420(self, rgb, fmt):
+        height, width = rgb.shape[:2]
+        shape = arducam.frame_shape(fmt, arducam.IMAGE_ENCODING_I420)
+        stride = shape[1]
+        align_height = shape[0] * 2 // 3
+        r, g, b = rgb[:, :, 0], rgb[:, :, 1], rgb[:, :, 2]
+        y = 16 + 219 * (0.299 * r + 0.587 * g + 0.114 * b)
+        u = 128 + 224 * (-0.169 * r - 0.331 * g + 0.5 * b)
+        v = 128 + 224 * (0.5 * r - 0.419 * g - 0.081 * b)
+        data = np.full(shape[0] * shape[1], 128, np.uint8)
+        planes = data[:align_height * stride].reshape(align_height, stride)
+        planes[:height, :width] = y
+        chroma = align_height // 2 * stride // 2
+        for i, plane in enumerate((u, v)):
+            start = align_height * stride + i * chroma
+            dst = data[start:start + chroma].reshape(align_height // 2, stride // 2)
+            dst[:height // 2, :width // 2] = plane[::2, ::2]
+        return data
+
+class file_source(object):
+    '''
+    Replays a file of concatenated padded frames, as written by
+    buffer.as_array.tofile(), for the current mode. The file is memory
+    mapped and frames are cycled.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self._data = np.memmap(path, np.uint8, 'r')
+
+    def frame(self, fmt, encoding, index):
+        shape = arducam.frame_shape(fmt, encoding)
+        size = shape[0] * shape[1]
+        count = self._data.size // size
+        if count == 0:
+            raise ValueError("{} holds no {}x{} frame.".format(self.path, fmt["width"], fmt["height"]))
+        index %= count
+        return self._data[index * size:(index + 1) * size]
+
+def h264_access_units(data):
+    '''
+    Split an Annex B H.264 stream into (payload, flags) chunks as the
+    encoder callback delivers them: SPS/PPS as a CONFIG chunk, then one
+    chunk per picture, with any other NAL units attached to the next one.
+    '''
+    starts = []
+    pos = data.find(b'\x00\x00\x01')
+    while pos != -1:
+        starts.append(pos - 1 if pos > 0 and data[pos - 1] == 0 else pos)
+        pos = data.find(b'\x00\x00\x01', pos + 3)
+    units = []
+    pending = b''
+    pending_type = None
+    for i, start in enumerate(starts):
+        end = starts[i + 1] if i + 1 < len(starts) else len(data)
+        nal = data[start:end]
+        header = data.find(b'\x00\x00\x01', start) + 3
+        nal_type = data[header] & 0x1F if header < len(data) else 0
+        if nal_type in (7, 8):
+            if pending and pending_type != 'config':
+                units.append((pending, 0))
+                pending = b''
+            pending += nal
+            pending_type = 'config'
+            continue
+        if pending_type == 'config':
+            units.append((pending, arducam.MMAL_BUFFER_HEADER_FLAG_CONFIG))
+            pending = b''
+            pending_type = None
+        pending += nal
+        if nal_type in (1, 5):
+            flags = arducam.MMAL_BUFFER_HEADER_FLAG_FRAME_END
+            if nal_type == 5:
+                flags |= arducam.MMAL_BUFFER_HEADER_FLAG_KEYFRAME
+            units.append((pending, flags))
+            pending = b''
+    if pending:
+        units.append((pending, arducam.MMAL_BUFFER_HEADER_FLAG_CONFIG
+            if pending_type == 'config' else 0))
+    return units
+
+class sim_library(object):
+    '''
+    Stand-in for libarducam_mipicamera.so, see arducam_mipicamera.set_library.
+
+    modes: (width, height, fps) tuples, selected by set_mode/set_resolution.
+    pixelformat: fourcc string of the raw format, 'pRAA' is RAW10 RGGB.
+    raw, i420: capture files to replay instead of the test pattern.
+    h264: .h264 file replayed by the video callback. Without it the video
+        callback emits placeholder NAL units sized for the bitrate, which
+        exercise recording paths but do not decode.
+    realtime: pace frames at the frame interval; False delivers frames as
+        fast as they are consumed, with pts still advancing per frame.
+    '''
+    controls = [
+        # id, description, max, min, default
+        (0x00980911, b"Exposure", 65535, 1, 1000),
+        (0x00980913, b"Gain", 255, 0, 16),
+        (0x00980914, b"Horizontal Flip", 1, 0, 0),
+        (0x00980915, b"Vertical Flip", 1, 0, 0),
+        (0x009a090a, b"Focus, Absolute", 1023, 0, 0),
+    ]
+
+    def __init__(self, modes = ((1920, 1080, 30), (640, 480, 60)), pixelformat = 'pRAA',
+            raw = None, i420 = None, h264 = None, realtime = True):
+        self.modes = [tuple(mode) for mode in modes]
+        self.pixelformat = arducam.FOURCC(*pixelformat)
+        self.realtime = realtime
+        pattern = pattern_source()
+        self.sources = {
+            arducam.IMAGE_ENCODING_RAW_BAYER: file_source(raw) if raw else pattern,
+            arducam.IMAGE_ENCODING_I420: file_source(i420) if i420 else pattern,
+        }
+        self.h264 = None
+        if h264:
+            with open(h264, 'rb') as f:
+                self.h264 = h264_access_units(f.read())
+        self.mode = 0
+        self.values = dict((ctrl[0], ctrl[4]) for ctrl in self.controls)
+        self.registers = {}
+        self._buffers = {}
+        self._lock = threading.Lock()
+        self._streams = {}
+        self._start = time.time()
+        self._index = -1
+
+    # Frame clock
+
+    def frame_interval(self):
+        return 1.0 / self.modes[self.mode][2]
+
+    def _next_frame(self):
+        '''
+        Index of the next frame, waiting for it when realtime.
+        '''
+        with self._lock:
+            if not self.realtime:
+                self._index += 1
+                return self._index
+            interval = self.frame_interval()
+            index = max(self._index + 1, int((time.time() - self._start) / interval) + 1)
+            self._index = index
+        delay = self._start + index * interval - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        return index
+
+    def _pts(self, index):
+        # microseconds
+        return int(round(index * self.frame_interval() * 1000000))
+
+    def _format(self):
+        width, height, fps = self.modes[self.mode]
+        return {"mode": self.mode, "width": width, "height": height,
+            "pixelformat": self.pixelformat,
+            "frameintervals": {"numerator": 1, "denominator": fps}}
+
+    def _reset_clock(self):
+        with self._lock:
+            self._start = time.time()
+            self._index = -1
+
+    # Buffers
+
+    def _buffer(self, data, flags, pts, userdata = None):
+        buf = arducam.BUFFER()
+        buf.data = data.ctypes.data_as(POINTER(c_ubyte))
+        buf.alloc_size = buf.length = data.size
+        buf.flags = flags
+        buf.pts = pts
+        buf.userdata = userdata
+        return buf
+
+    def _hold(self, data, flags = arducam.MMAL_BUFFER_HEADER_FLAG_FRAME_END, pts = 0):
+        buf = self._buffer(data, flags, pts)
+        self._buffers[addressof(buf)] = (buf, data)
+        return pointer(buf)
+
+    # Streams driven by callbacks
+
+    def _start_stream(self, name, cfunc, userdata, produce):
+        self._stop_stream(name)
+        if not cfunc:
+            return 0
+        userdata = addressof(_target(userdata)) if userdata is not None else None
+        stop = threading.Event()
+        thread = threading.Thread(target=self._run_stream,
+            args=(stop, cfunc, userdata, produce), name="sim_" + name)
+        thread.daemon = True
+        self._streams[name] = (thread, stop)
+        thread.start()
+        return 0
+
+    def _stop_stream(self, name):
+        stream = self._streams.pop(name, None)
+        if stream is None:
+            return
+        thread, stop = stream
+        stop.set()
+        if thread is not threading.current_thread():
+            thread.join()
+
+    def _run_stream(self, stop, cfunc, userdata, produce):
+        while not stop.is_set():
+            index = self._next_frame()
+            if stop.is_set():
+                break
+            for data, flags, pts in produce(index):
+                buf = self._buffer(data, flags, pts, userdata)
+                cfunc(pointer(buf))
+
+    def _raw_frames(self, index):
+        data = self.sources[arducam.IMAGE_ENCODING_RAW_BAYER].frame(
+            self._format(), arducam.IMAGE_ENCODING_RAW_BAYER, index)
+        return [(np.ascontiguousarray(data), arducam.MMAL_BUFFER_HEADER_FLAG_FRAME_END, self._pts(index))]
+
+    def _video_producer(self, state):
+        width, height, fps = self.modes[self.mode]
+        intraperiod = state.intraperiod if state.intraperiod > 0 else fps
+        frame_bytes = max(state.bitrate // 8 // fps, 64) if state.bitrate > 0 else 64 << 10
+        config = np.frombuffer(b'\x00\x00\x00\x01\x67\x64\x00\x28' + b'\xac' * 16 +
+            b'\x00\x00\x00\x01\x68\xee\x3c\x80', np.uint8)
+        keyframe = np.full(frame_bytes * 4, 0xa5, np.uint8)
+        keyframe[:5] = (0, 0, 0, 1, 0x65)
+        pframe = np.full(frame_bytes, 0x5a, np.uint8)
+        pframe[:5] = (0, 0, 0, 1, 0x41)
+        rows, cols = (height + 15) // 16, (width + 15) // 16 + 1
+        vectors = np.zeros((rows, cols, 4), np.uint8)
+        pattern = pattern_source()
+        step = min(width // pattern.frames, 127)
+        units = self.h264
+        FRAME_END = arducam.MMAL_BUFFER_HEADER_FLAG_FRAME_END
+        KEYFRAME = arducam.MMAL_BUFFER_HEADER_FLAG_KEYFRAME
+        CONFIG = arducam.MMAL_BUFFER_HEADER_FLAG_CONFIG
+        state_vectors = state.inlineMotionVectors
+        inline_headers = state.bInlineHeaders
+
+        def produce(index):
+            pts = self._pts(index)
+            out = []
+            if units is not None:
+                # Replay: one picture per frame, config chunks go with it.
+                for _ in range(len(units)):
+                    data, flags = units[produce.position % len(units)]
+                    produce.position += 1
+                    out.append((np.frombuffer(data, np.uint8), flags, pts))
+                    if flags & FRAME_END:
+                        break
+            else:
+                # The stream starts with headers and a keyframe.
+                count = produce.count
+                if count == 0 or (inline_headers and count % intraperiod == 0):
+                    out.append((config, CONFIG, pts))
+                if count % intraperiod == 0:
+                    out.append((keyframe, KEYFRAME | FRAME_END, pts))
+                else:
+                    out.append((pframe, FRAME_END, pts))
+            produce.count += 1
+            if state_vectors:
+                vectors[:] = 0
+                bar = index % pattern.frames * width // pattern.frames // 16
+                vectors[:, bar:bar + 2, 0] = step
+                out.append((vectors.reshape(-1), arducam.MMAL_BUFFER_HEADER_FLAG_CODECSIDEINFO, pts))
+            return out
+        produce.position = 0
+        produce.count = 0
+        return produce
+
+    # C API
+
+    def arducam_init_camera(self, camera_instance):
+        _target(camera_instance).value = 1
+        self._reset_clock()
+        return 0
+
+    def arducam_init_camera2(self, camera_instance, camera_interface):
+        return self.arducam_init_camera(camera_instance)
+
+    def arducam_set_resolution(self, camera_instance, width, height):
+        width = _target(width)
+        height = _target(height)
+        self.mode = min(range(len(self.modes)), key=lambda i:
+            abs(self.modes[i][0] - width.value) + abs(self.modes[i][1] - height.value))
+        width.value, height.value = self.modes[self.mode][:2]
+        self._reset_clock()
+        return 0
+
+    def arducam_set_mode(self, camera_instance, mode):
+        if not 0 <= mode < len(self.modes):
+            return -1
+        self.mode = mode
+        self._reset_clock()
+        return 0
+
+    def _fill_format(self, fmt, mode):
+        width, height, fps = self.modes[mode]
+        fmt.mode = mode
+        fmt.width = width
+        fmt.height = height
+        fmt.pixelformat = self.pixelformat
+        fmt.frameintervals.numerator = 1
+        fmt.frameintervals.denominator = fps
+        fmt.description = "sim {}x{} {}fps".format(width, height, fps).encode()
+
+    def arducam_get_format(self, camera_instance, fmt):
+        self._fill_format(_target(fmt), self.mode)
+        return 0
+
+    def arducam_get_support_formats(self, camera_instance, fmt, index):
+        if not 0 <= index < len(self.modes):
+            return -1
+        self._fill_format(_target(fmt), index)
+        return 0
+
+    def arducam_start_preview(self, camera_instance, preview_params):
+        return 0
+
+    def arducam_stop_preview(self, camera_instance):
+        return 0
+
+    def arducam_capture(self, camera_instance, image_format, timeout):
+        encoding = _target(image_format).encoding
+        index = self._next_frame()
+        if encoding == arducam.IMAGE_ENCODING_JPEG:
+            import cv2
+            i420 = self.sources[arducam.IMAGE_ENCODING_I420].frame(
+                self._format(), arducam.IMAGE_ENCODING_I420, index)
+            shape = arducam.frame_shape(self._format(), arducam.IMAGE_ENCODING_I420)
+            bgr = cv2.cvtColor(np.asarray(i420).reshape(shape), cv2.COLOR_YUV2BGR_I420)
+            width, height = self.modes[self.mode][:2]
+            _, data = cv2.imencode('.jpg', bgr[:height, :width],
+                [cv2.IMWRITE_JPEG_QUALITY, _target(image_format).quality])
+            data = data.reshape(-1)
+        elif encoding in self.sources:
+            # Copy, the caller may write into the buffer.
+            data = np.array(self.sources[encoding].frame(self._format(), encoding, index))
+        else:
+            return POINTER(arducam.BUFFER)()
+        return self._hold(data, pts=self._pts(index))
+
+    def arducam_release_buffer(self, buff):
+        self._buffers.pop(addressof(buff.contents), None)
+
+    def arducam_set_raw_callback(self, camera_instance, callback, userdata):
+        return self._start_stream('raw', callback, userdata, self._raw_frames)
+
+    def arducam_set_video_callback(self, camera_instance, encoder_state, callback, userdata):
+        if not callback:
+            self._stop_stream('video')
+            return 0
+        return self._start_stream('video', callback, userdata,
+            self._video_producer(_target(encoder_state)))
+
+    def _control(self, ctrl_id):
+        for ctrl in self.controls:
+            if ctrl[0] == ctrl_id:
+                return ctrl
+        return None
+
+    def arducam_reset_control(self, camera_instance, ctrl_id):
+        ctrl = self._control(ctrl_id)
+        if ctrl is None:
+            return -1
+        self.values[ctrl_id] = ctrl[4]
+        return 0
+
+    def arducam_set_control(self, camera_instance, ctrl_id, value):
+        ctrl = self._control(ctrl_id)
+        if ctrl is None:
+            return -1
+        self.values[ctrl_id] = min(max(value, ctrl[3]), ctrl[2])
+        return 0
+
+    def arducam_get_control(self, camera_instance, ctrl_id, value):
+        if ctrl_id not in self.values:
+            return -1
+        _target(value).value = self.values[ctrl_id]
+        return 0
+
+    def arducam_get_support_controls(self, camera_instance, ctrl, index):
+        if not 0 <= index < len(self.controls):
+            return -1
+        ctrl = _target(ctrl)
+        ctrl.id, ctrl.desc, ctrl.max_value, ctrl.min_value, ctrl.default_value = self.controls[index]
+        return 0
+
+    def arducam_software_auto_exposure(self, camera_instance, enable):
+        return 0
+
+    def arducam_software_auto_white_balance(self, camera_instance, enable):
+        return 0
+
+    def arducam_manual_set_awb_compensation(self, r_gain, b_gain):
+        return None
+
+    def arducam_read_sensor_reg(self, camera_instance, address, value):
+        _target(value).value = self.registers.get(address, 0)
+        return 0
+
+    def arducam_write_sensor_reg(self, camera_instance, address, value):
+        self.registers[address] = value
+        return 0
+
+    def arducam_close_camera(self, camera_instance):
+        for name in list(self._streams):
+            self._stop_stream(name)
+        self._buffers.clear()
+        return 0
+
+    def _unpack(self, data, width, height, dtype):
+        size = arducam.align_up(height, 16) * arducam.align_up(width * 10 // 8, 32)
+        packed = np.ctypeslib.as_array(data, shape=(size,))
+        return self._hold(raw_unpacker(width, height, 10, dtype).unpack(packed).reshape(-1).view(np.uint8))
+
+    def arducam_unpack_raw10_to_raw8(self, data, width, height):
+        return self._unpack(data, width, height, np.uint8)
+
+    def arducam_unpack_raw10_to_raw16(self, data, width, height):
+        return self._unpack(data, width, height, np.uint16)
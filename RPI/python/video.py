@@ -1,8 +1,7 @@
 import arducam_mipicamera as arducam
 import v4l2 #sudo pip install v4l2
 import time
-import ctypes
-import numpy as np
+from video_recorder import h264_recorder
 
 def set_controls(camera):
     try:
@@ -20,12 +19,6 @@ def set_controls(camera):
     except Exception as e:
         print(e)
 
-def callback(data):
-    buff = arducam.buffer(data)
-    file = buff.userdata
-    buff.as_array.tofile(file)
-    return 0
-
 if __name__ == "__main__":
     try:
         camera = arducam.mipi_camera()
@@ -37,13 +30,12 @@ if __name__ == "__main__":
         print("Start preview...")
         camera.start_preview(fullscreen = False, window = (0, 0, 1280, 720))
         set_controls(camera)
-        file = open("test.h264", "wb")
-        # Need keep py_object reference
-        file_obj = ctypes.py_object(file)
-        camera.set_video_callback(callback, file_obj)
-        time.sleep(10)
-        camera.set_video_callback(None, None)
-        file.close()
+        recorder = h264_recorder(camera, "test.h264")
+        recorder.start()
+        for _ in range(10):
+            time.sleep(1)
+            print(recorder.stats())
+        recorder.stop()
         print("Stop preview...")
         camera.stop_preview()
         print("Close camera...")
@@ -0,0 +1,474 @@
+'''
+H.264 recording on top of mipi_camera.set_video_callback.
+
+The encoder callback only copies each encoded chunk into a preallocated
+arena and queues it; a writer thread coalesces queued chunks into large
+write() calls, so a slow SD card no longer stalls the encoder:
+
+    recorder = h264_recorder(camera, "video_{:03d}.h264", segment_time = 60)
+    recorder.start()
+    ...
+    print(recorder.stats())
+    recorder.stop()
+
+preroll_buffer keeps the last seconds of the stream in memory and starts
+such a recorder from the nearest keyframe when an event is triggered.
+'''
+from ctypes import *
+import collections
+import threading
+import time
+import arducam_mipicamera as arducam
+
+class chunk_arena(object):
+    '''
+    Fixed size ring of bytes. Chunks are allocated at the head and freed in
+    allocation order from the tail; a chunk that does not fit before the
+    end of the ring wraps to the start and the skipped bytes are reclaimed
+    with it.
+    '''
+    def __init__(self, size):
+        self.size = size
+        self.buffer = (c_ubyte * size)()
+        self.address = addressof(self.buffer)
+        self.view = memoryview(self.buffer).cast('B')
+        self._head = 0
+        self._tail = 0
+        self.used = 0
+
+    def alloc(self, length):
+        if length > self.size or self.used + length > self.size:
+            return None
+        if self.used == 0:
+            self._head = self._tail = 0
+        padding = 0
+        if self._head >= self._tail:
+            if self.size - self._head >= length:
+                offset = self._head
+            elif self._tail >= length:
+                padding = self.size - self._head
+                offset = 0
+            else:
+                return None
+        elif self._tail - self._head >= length:
+            offset = self._head
+        else:
+            return None
+        self._head = offset + length
+        self.used += length + padding
+        return offset
+
+    def free(self, offset, length):
+        end = offset + length
+        if offset < self._tail:
+            # Wrapped, the padding before the start of the ring goes too.
+            self.used -= self.size - self._tail + end
+        else:
+            self.used -= end - self._tail
+        self._tail = end
+
+class h264_recorder(object):
+    '''
+    Records the encoder output to file_name, which may contain a format
+    field for the segment number. With segment_time (seconds) set, a new
+    segment is started on the first keyframe after segment_time elapsed,
+    and the last SPS/PPS (MMAL_BUFFER_HEADER_FLAG_CONFIG) is repeated at
+    the start of every segment so each file decodes on its own.
+
+    When the arena is full the chunk is dropped and the stream skips ahead
+    to the next SPS/PPS or IDR chunk that starts a frame. dropped counts
+    the chunks skipped, dropped_frames the frames that lost chunks; frames
+    only counts frames queued whole. flush_size / flush_interval bound how much data
+    the writer collects before calling write().
+    Other keyword arguments are encoder options for set_video_callback.
+    With camera = None no callback is installed and chunks come from feed().
+    '''
+    def __init__(self, camera, file_name, segment_time = None, arena_size = 16 << 20,
+            flush_size = 1 << 20, flush_interval = 0.5, **options):
+        self.camera = camera
+        self.file_name = file_name
+        self.segment_time = segment_time
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.options = options
+        self.arena = chunk_arena(arena_size)
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._resync = False
+        self._file = None
+        self._config = b''
+        self._frame_start = True
+        self._feed_frame_start = True
+        self._segment_start = None
+        self.segments = []
+        self.chunks = 0
+        self.frames = 0
+        self.dropped = 0
+        self.dropped_frames = 0
+        self.bytes_written = 0
+        self.write_calls = 0
+        self._rate = 0.0
+        self._rate_mark = (time.time(), 0)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def start(self):
+        if self._running:
+            return self
+        self._running = True
+        self._thread = threading.Thread(target=self._writer, name="h264_recorder")
+        self._thread.daemon = True
+        self._thread.start()
+        if self.camera is not None:
+            self.camera.set_video_callback(self._callback, **self.options)
+        return self
+
+    def stop(self):
+        if not self._running:
+            return
+        if self.camera is not None:
+            self.camera.set_video_callback(None)
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join()
+        self._thread = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def stats(self):
+        '''
+        queue_depth / queued_bytes growing while bytes_per_sec stays flat
+        means storage is the bottleneck.
+        '''
+        now = time.time()
+        mark_time, mark_bytes = self._rate_mark
+        if now - mark_time >= 0.5:
+            self._rate = (self.bytes_written - mark_bytes) / (now - mark_time)
+            self._rate_mark = (now, self.bytes_written)
+        return {
+            'queue_depth': len(self._queue),
+            'queued_bytes': self.arena.used,
+            'bytes_per_sec': self._rate,
+            'bytes_written': self.bytes_written,
+            'write_calls': self.write_calls,
+            'chunks': self.chunks,
+            'frames': self.frames,
+            'dropped': self.dropped,
+            'dropped_frames': self.dropped_frames,
+            'segments': len(self.segments),
+        }
+
+    def _callback(self, buff):
+        buf = buff[0]
+        self.feed(buf.data, buf.length, buf.flags)
+        return 0
+
+    def feed(self, data, length, flags, pts = arducam.MMAL_TIME_UNKNOWN):
+        '''
+        Queue one encoded chunk, data is an address or a ctypes pointer.
+        Called by the video callback, or by the owner of a recorder created
+        with camera = None (preroll_buffer, video_demux).
+        '''
+        if not length or flags & arducam.MMAL_BUFFER_HEADER_FLAG_CODECSIDEINFO:
+            return
+        if flags & arducam.MMAL_BUFFER_HEADER_FLAG_CONFIG:
+            # Small and rare, kept for the start of the next segment.
+            self._config = string_at(data, length)
+        frame_start = self._feed_frame_start
+        if not flags & arducam.MMAL_BUFFER_HEADER_FLAG_CONFIG:
+            self._feed_frame_start = bool(flags & arducam.MMAL_BUFFER_HEADER_FLAG_FRAME_END)
+        if self._resync:
+            # Resume with a whole access unit: SPS/PPS or an IDR frame
+            if not frame_start or not flags & (arducam.MMAL_BUFFER_HEADER_FLAG_KEYFRAME
+                    | arducam.MMAL_BUFFER_HEADER_FLAG_CONFIG):
+                self._drop(flags)
+                return
+            self._resync = False
+        with self._cond:
+            offset = self.arena.alloc(length)
+            if offset is None:
+                self._drop(flags)
+                self._resync = True
+                return
+            memmove(self.arena.address + offset, data, length)
+            self._queue.append((offset, length, flags, time.time()))
+            self.chunks += 1
+            if flags & arducam.MMAL_BUFFER_HEADER_FLAG_FRAME_END:
+                self.frames += 1
+            if self.arena.used >= self.flush_size:
+                self._cond.notify()
+
+    def _drop(self, flags):
+        self.dropped += 1
+        if flags & arducam.MMAL_BUFFER_HEADER_FLAG_FRAME_END:
+            self.dropped_frames += 1
+
+    def _writer(self):
+        while True:
+            with self._cond:
+                if self._running and self.arena.used < self.flush_size:
+                    self._cond.wait(self.flush_interval)
+                chunks = list(self._queue)
+                self._queue.clear()
+                running = self._running
+            if chunks:
+                self._write(chunks)
+                with self._cond:
+                    for offset, length, _, _ in chunks:
+                        self.arena.free(offset, length)
+            elif not running:
+                return
+
+    def _write(self, chunks):
+        run_start = run_end = None
+        for offset, length, flags, stamp in chunks:
+            if self._file is None or self._should_rotate(flags, stamp):
+                if run_start is not None:
+                    self._flush_run(run_start, run_end)
+                    run_start = None
+                self._open_segment(flags, stamp)
+            if run_start is not None and offset != run_end:
+                self._flush_run(run_start, run_end)
+                run_start = None
+            if run_start is None:
+                run_start = offset
+            run_end = offset + length
+            self._frame_start = bool(flags & arducam.MMAL_BUFFER_HEADER_FLAG_FRAME_END)
+        if run_start is not None:
+            self._flush_run(run_start, run_end)
+
+    def _flush_run(self, start, end):
+        self._file.write(self.arena.view[start:end])
+        self.bytes_written += end - start
+        self.write_calls += 1
+
+    def _should_rotate(self, flags, stamp):
+        if not self.segment_time or not self._frame_start \
+                or not flags & arducam.MMAL_BUFFER_HEADER_FLAG_KEYFRAME:
+            return False
+        return stamp - self._segment_start >= self.segment_time
+
+    def _open_segment(self, flags, stamp):
+        if self._file is not None:
+            self._file.close()
+        name = self.file_name.format(len(self.segments))
+        self._file = open(name, "wb", buffering=0)
+        self.segments.append(name)
+        self._segment_start = stamp
+        if self._config and not flags & arducam.MMAL_BUFFER_HEADER_FLAG_CONFIG:
+            self._file.write(self._config)
+            self.bytes_written += len(self._config)
+            self.write_calls += 1
+
+class preroll_buffer(object):
+    '''
+    Keeps the last `seconds` of encoder output in memory so an event clip
+    can start before the event. Chunks are grouped into GOPs starting at a
+    keyframe and evicted a whole GOP at a time, oldest first, once the next
+    GOP already covers the window or the data would exceed `budget` bytes.
+    Memory is bounded by budget whatever the encoder bitrate is.
+
+    trigger() starts an h264_recorder fed with the latest SPS/PPS and the
+    buffered GOPs from the nearest keyframe at or before `seconds` ago,
+    followed by the live stream until end_clip().
+    Other keyword arguments are encoder options for set_video_callback.
+    With camera = None no callback is installed and chunks come from feed().
+    '''
+    def __init__(self, camera, seconds = 5, budget = 32 << 20, **options):
+        self.camera = camera
+        self.seconds = seconds
+        self.budget = budget
+        self.options = options
+        self.arena = chunk_arena(budget)
+        # [start time, [(offset, length, flags), ...]] per GOP
+        self._gops = collections.deque()
+        self._lock = threading.Lock()
+        self._config = b''
+        self._frame_start = True
+        self._pts_seen = False
+        self._last = None
+        self._clip = None
+        self.evicted = 0
+        self.running = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def start(self):
+        if not self.running:
+            if self.camera is not None:
+                self.camera.set_video_callback(self._callback, **self.options)
+            self.running = True
+        return self
+
+    def stop(self):
+        if self.running:
+            self.running = False
+            if self.camera is not None:
+                self.camera.set_video_callback(None)
+        self.end_clip()
+
+    def buffered(self):
+        '''
+        (seconds, bytes) currently held.
+        '''
+        with self._lock:
+            if not self._gops:
+                return 0, 0
+            return self._last - self._gops[0][0], self.arena.used
+
+    def trigger(self, file_name, **kwargs):
+        '''
+        Start a clip, kwargs are passed to h264_recorder. Returns the
+        recorder; a clip already running is returned unchanged.
+        '''
+        with self._lock:
+            if self._clip is not None:
+                return self._clip
+            kwargs.setdefault('arena_size', max(2 * self.budget, 16 << 20))
+            clip = h264_recorder(None, file_name, **kwargs).start()
+            if self._config:
+                config = create_string_buffer(self._config, len(self._config))
+                clip.feed(config, len(self._config), arducam.MMAL_BUFFER_HEADER_FLAG_CONFIG)
+            gops = list(self._gops)
+            start = 0
+            if self._last is not None:
+                cutoff = self._last - self.seconds
+                for i, (stamp, _) in enumerate(gops):
+                    if stamp <= cutoff:
+                        start = i
+            for _, chunks in gops[start:]:
+                for offset, length, flags in chunks:
+                    clip.feed(self.arena.address + offset, length, flags)
+            self._clip = clip
+            return clip
+
+    def end_clip(self):
+        with self._lock:
+            clip = self._clip
+            self._clip = None
+        if clip is not None:
+            clip.stop()
+        return clip
+
+    def _clock(self, pts):
+        # pts is in microseconds, wall time only if the encoder gives none.
+        if pts != arducam.MMAL_TIME_UNKNOWN:
+            self._pts_seen = True
+            return pts / 1000000.0
+        if self._pts_seen:
+            return self._last
+        return time.time()
+
+    def _evict(self):
+        _, chunks = self._gops.popleft()
+        for offset, length, _ in chunks:
+            self.arena.free(offset, length)
+        self.evicted += 1
+
+    def _callback(self, buff):
+        buf = buff[0]
+        self.feed(buf.data, buf.length, buf.flags, c_int64(buf.pts).value)
+        return 0
+
+    def feed(self, data, length, flags, pts = arducam.MMAL_TIME_UNKNOWN):
+        if not length or flags & arducam.MMAL_BUFFER_HEADER_FLAG_CODECSIDEINFO:
+            return
+        with self._lock:
+            if self._clip is not None:
+                self._clip.feed(data, length, flags)
+            self._store(data, length, flags, pts)
+
+    def _store(self, data, length, flags, pts):
+        stamp = self._last = self._clock(pts)
+        if flags & arducam.MMAL_BUFFER_HEADER_FLAG_CONFIG:
+            self._config = string_at(data, length)
+            return
+        keyframe = self._frame_start and flags & arducam.MMAL_BUFFER_HEADER_FLAG_KEYFRAME
+        self._frame_start = bool(flags & arducam.MMAL_BUFFER_HEADER_FLAG_FRAME_END)
+        if keyframe:
+            self._gops.append([stamp, []])
+        elif not self._gops:
+            # Nothing to decode this against, wait for a keyframe.
+            return
+        cutoff = stamp - self.seconds
+        while len(self._gops) > 1 and self._gops[1][0] <= cutoff:
+            self._evict()
+        offset = self.arena.alloc(length)
+        while offset is None:
+            if len(self._gops) == 1:
+                # The current GOP alone exceeds the budget.
+                self._evict()
+                return
+            self._evict()
+            offset = self.arena.alloc(length)
+        memmove(self.arena.address + offset, data, length)
+        self._gops[-1][1].append((offset, length, flags))
+
+class video_demux(object):
+    '''
+    Single video callback fanning the encoder output out to several
+    consumers. Encoded chunks go to every sink in `sinks`, codec side-info
+    buffers (inline motion vectors) to every sink in `side_info`. Sinks
+    are objects with feed(data, length, flags, pts), such as an
+    h264_recorder or preroll_buffer created with camera = None, or a
+    motion_vectors.motion_vector_stream.
+    Other keyword arguments are encoder options for set_video_callback;
+    inlineMotionVectors is enabled when side_info is given.
+    '''
+    def __init__(self, camera, sinks = (), side_info = (), **options):
+        self.camera = camera
+        self.sinks = list(sinks)
+        self.side_info = list(side_info)
+        if self.side_info:
+            options.setdefault('inlineMotionVectors', 1)
+        self.options = options
+        self.running = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def start(self):
+        if not self.running:
+            for sink in self.sinks + self.side_info:
+                if hasattr(sink, 'start'):
+                    sink.start()
+            self.camera.set_video_callback(self._callback, **self.options)
+            self.running = True
+        return self
+
+    def stop(self):
+        if self.running:
+            self.running = False
+            self.camera.set_video_callback(None)
+            for sink in self.sinks + self.side_info:
+                if hasattr(sink, 'stop'):
+                    sink.stop()
+
+    def _callback(self, buff):
+        buf = buff[0]
+        if not buf.length:
+            return 0
+        pts = c_int64(buf.pts).value
+        sinks = self.side_info \
+            if buf.flags & arducam.MMAL_BUFFER_HEADER_FLAG_CODECSIDEINFO else self.sinks
+        for sink in sinks:
+            sink.feed(buf.data, buf.length, buf.flags, pts)
+        return 0
@@ -1,16 +1,13 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python'))
 import arducam_mipicamera as arducam
 import time
 import cv2 #sudo apt-get install python-opencv
+import numpy as np
 import json
-import os
 from datetime import datetime
 
-def align_down(size, align):
-    return (size & ~((align)-1))
-
-def align_up(size, align):
-    return align_down(size + align - 1, align)
-
 def input_number(num_range = None):
     loop = True
     while loop:
@@ -39,17 +36,6 @@ def select_mode(camera):
     fmt = camera.get_format()
     print("Current mode: {},resolution: {}x{}".format(fmt['mode'], fmt['width'], fmt['height']))
 
-def get_frame(camera):
-    frame = camera.capture(encoding = 'i420')
-    fmt = camera.get_format()
-    height = int(align_up(fmt['height'], 16))
-    width = int(align_up(fmt['width'], 32))
-    image = frame.as_array.reshape(int(height * 1.5), width)
-    image = cv2.cvtColor(image, cv2.COLOR_YUV2BGR_I420)
-    image = image[:fmt['height'], :fmt['width']]
-    return image
-
-
 def write_camera_params(fmt):
     result = json.dumps({'mode':fmt['mode'], 'width':fmt['width'], 'height':fmt['height'], },\
              sort_keys=True, indent=4, separators=(',',':'))
@@ -78,10 +64,13 @@ if __name__ == "__main__":
         image_width = int(fmt['width'] * scale)
         image_height = int(fmt['height'] * scale)
 
+        # Frames are converted into a preallocated ring, the format is
+        # read once for the whole stream.
+        frames = camera.frames(encoding = 'i420')
+        preview = np.empty((image_height, image_width, 3), np.uint8)
         while cv2.waitKey(10) != ord('q'):
             counter+=1
-            frame = get_frame(camera)
-            frame = cv2.resize(frame, (image_width, image_height))
+            frame = cv2.resize(next(frames), (image_width, image_height), dst = preview)
             cv2.imshow("Arducam", frame)
             
         t1 = datetime.now()
@@ -25,6 +25,8 @@
 import os
 import time
 from datetime import datetime
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python'))
 import arducam_mipicamera as arducam
 import json
 import cv2
@@ -41,7 +41,7 @@ def align_up(size, align):
 
 def remove_padding(data, width, height, bit_width):
     buff = np.frombuffer(data, np.uint8)
-    real_width = width / 8 * bit_width
+    real_width = width * bit_width // 8
     align_width = align_up(real_width, 32)
     align_height = align_up(height, 16)
     
@@ -58,10 +58,10 @@ def save_image(img, name):
 if __name__ == "__main__":
     print("Notice:This program only support csi-2 raw 10bit packet data convert to jpg.\n")
     if len(sys.argv) != 6:
-        print("python {} <input_name> <output_name> <width> <height> ".format(
+        print("python {} <input_name> <output_name> <width> <height> <bayer_order>".format(
             sys.argv[0]))
         print("Bayer Order:")
-        for key, value in bayer_order_maps.iteritems():
+        for key, value in bayer_order_maps.items():
             print("    " + key)
         exit(-1)
 
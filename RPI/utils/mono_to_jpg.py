@@ -11,7 +11,7 @@ def align_up(size, align):
 
 def remove_padding(data, width, height, bit_width):
     buff = np.frombuffer(data, np.uint8)
-    real_width = width / 8 * bit_width
+    real_width = width * bit_width // 8
     align_width = align_up(real_width, 32)
     align_height = align_up(height, 16)
     
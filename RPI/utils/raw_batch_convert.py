@@ -0,0 +1,167 @@
+'''
+Batch conversion of MIPI CSI-2 packed raw captures to JPEG or PNG.
+
+Inputs are files, directories (every *.raw inside) or glob patterns. Each
+file is memory mapped and converted by a pool of worker processes, one per
+core by default. Workers keep their unpacker and image buffers between
+files of the same size. Outputs that are newer than their input are
+skipped, so an interrupted run can simply be restarted.
+
+python3 raw_batch_convert.py captures/ 'field/*.raw' --bayer bayer_bg --format jpg
+
+The frame size is taken from --width/--height or from a WIDTHxHEIGHT in
+the file name (capture_raw.py writes 1920x1080.raw). Files may hold the
+padded buffer the camera delivers or the visible lines only.
+'''
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+from multiprocessing import Pool
+import numpy as np
+import cv2
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python'))
+from raw_unpack import raw_unpacker, packed_stride, align_up
+
+bayer_order_maps = {
+    "bayer_bg": cv2.COLOR_BayerBG2BGR,
+    "bayer_gb": cv2.COLOR_BayerGB2BGR,
+    "bayer_rg": cv2.COLOR_BayerRG2BGR,
+    "bayer_gr": cv2.COLOR_BayerGR2BGR,
+    "gray": None,
+}
+
+_size_pattern = re.compile(r"(\d+)x(\d+)")
+
+def find_inputs(patterns, recursive = False):
+    '''
+    Sorted raw files named by patterns: files, directories or globs.
+    '''
+    files = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "**", "*.raw") if recursive else os.path.join(pattern, "*.raw")
+        for name in glob.glob(pattern, recursive = recursive):
+            if os.path.isfile(name):
+                files.add(name)
+    return sorted(files)
+
+def frame_size(name, width = None, height = None):
+    if width and height:
+        return width, height
+    match = _size_pattern.search(os.path.basename(name))
+    if match is None:
+        raise ValueError("No WIDTHxHEIGHT in the file name, pass --width and --height")
+    return int(match.group(1)), int(match.group(2))
+
+def output_name(name, output_dir, extension):
+    base = os.path.splitext(os.path.basename(name))[0] + "." + extension
+    return os.path.join(output_dir if output_dir else os.path.dirname(name), base)
+
+def up_to_date(name, output):
+    return os.path.exists(output) and os.path.getmtime(output) >= os.path.getmtime(name)
+
+# Per worker process state, set up by _init_worker
+_options = None
+_scratch = {}
+
+def _init_worker(options):
+    global _options
+    _options = options
+    # One process per core already, keep OpenCV from starting more threads
+    cv2.setNumThreads(1)
+
+def _buffers(width, height):
+    '''
+    Unpacker and output images of one frame size, reused for every file of
+    that size this worker converts.
+    '''
+    key = (width, height)
+    buffers = _scratch.get(key)
+    if buffers is None:
+        unpacker = raw_unpacker(width, height, _options["bit_width"], np.uint8)
+        buffers = (unpacker, unpacker.new_output(), np.empty((height, width, 3), np.uint8))
+        _scratch[key] = buffers
+    return buffers
+
+def convert(name):
+    '''
+    Convert one file, returns (name, output, pixels or 0 when skipped,
+    error message or None).
+    '''
+    options = _options
+    output = output_name(name, options["output_dir"], options["format"])
+    try:
+        if not options["force"] and up_to_date(name, output):
+            return name, output, 0, None
+        width, height = frame_size(name, options["width"], options["height"])
+        bit_width = options["bit_width"]
+        unpacker, gray, bgr = _buffers(width, height)
+        data = np.memmap(name, np.uint8, 'r')
+        padded = align_up(height, 16) * packed_stride(width, bit_width)
+        if data.size not in (padded, height * width * bit_width // 8):
+            raise ValueError("{} bytes does not match {}x{} RAW{}".format(data.size, width, height, bit_width))
+        unpacker.unpack(data, gray)
+        del data
+        code = bayer_order_maps[options["bayer"]]
+        image = gray
+        if code is not None:
+            cv2.cvtColor(gray, code, dst = bgr)
+            image = bgr
+        if options["format"] == "jpg":
+            params = [cv2.IMWRITE_JPEG_QUALITY, options["quality"]]
+        else:
+            params = [cv2.IMWRITE_PNG_COMPRESSION, options["compression"]]
+        tmp = output + ".part." + options["format"]
+        if not cv2.imwrite(tmp, image, params):
+            raise IOError("Cannot write {}".format(output))
+        os.replace(tmp, output)
+        return name, output, width * height, None
+    except Exception as e:
+        return name, output, 0, str(e)
+
+def process_arguments():
+    parser = argparse.ArgumentParser(description="Convert MIPI packed raw captures to JPEG/PNG.")
+    parser.add_argument('inputs', nargs='+', help="raw files, directories or glob patterns")
+    parser.add_argument('--width', type=int, help="frame width, default: from the file name")
+    parser.add_argument('--height', type=int, help="frame height, default: from the file name")
+    parser.add_argument('--bit-width', default=10, type=int, choices=[8, 10, 12])
+    parser.add_argument('--bayer', default="bayer_bg", choices=sorted(bayer_order_maps),
+        help="OpenCV Bayer conversion, gray for monochrome sensors")
+    parser.add_argument('--format', default="jpg", choices=["jpg", "png"])
+    parser.add_argument('--quality', default=95, type=int, help="JPEG quality")
+    parser.add_argument('--compression', default=3, type=int, help="PNG compression level")
+    parser.add_argument('--output-dir', help="default: next to each input")
+    parser.add_argument('--recursive', action='store_true', help="descend into directories")
+    parser.add_argument('--force', action='store_true', help="convert files whose output is up to date")
+    parser.add_argument('--jobs', default=os.cpu_count() or 1, type=int, help="worker processes")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = process_arguments()
+    files = find_inputs(args.inputs, args.recursive)
+    if not files:
+        print("No raw files found.")
+        exit(-1)
+    if args.output_dir and not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+    options = dict(vars(args))
+
+    converted = skipped = failed = pixels = 0
+    start = time.time()
+    with Pool(args.jobs, _init_worker, (options,)) as pool:
+        for name, output, frame_pixels, error in pool.imap_unordered(convert, files, chunksize = 4):
+            if error is not None:
+                failed += 1
+                print("{}: {}".format(name, error))
+            elif frame_pixels == 0:
+                skipped += 1
+            else:
+                converted += 1
+                pixels += frame_pixels
+    elapsed = max(time.time() - start, 1e-9)
+    print("{} converted, {} skipped, {} failed in {:.1f} s, {:.1f} MP/s, {:.1f} files/s".format(
+        converted, skipped, failed, elapsed, pixels / elapsed / 1e6, converted / elapsed))
+    exit(-1 if failed else 0)